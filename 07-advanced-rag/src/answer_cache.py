@@ -0,0 +1,155 @@
+"""
+Семантический кеш ответов RAG
+
+Ключ - embedding трансформированного запроса (после query transformation с учетом истории),
+значение - готовый результат {"answer", "documents"}. Если новый запрос ближе порога
+ANSWER_CACHE_SIMILARITY_THRESHOLD (cosine) к сохраненному и запись не старше TTL -
+ответ возвращается без retrieval и генерации.
+
+Кеш сбрасывается при переиндексации (rag.initialize_retriever()).
+Каждое попадание пишется в журнал аудита (JSONL): пары запросов и их близость
+позволяют найти ложные попадания и подобрать порог.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """In-memory кеш ответов с поиском ближайшего запроса по cosine similarity"""
+
+    def __init__(self, threshold: float, ttl_seconds: float, max_entries: int, audit_path: str | None = None):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.audit_path = Path(audit_path) if audit_path else None
+        self._lock = threading.Lock()
+        self._vectors = None  # матрица нормализованных embeddings запросов
+        self._entries = []    # {"query", "result", "created_at", "latency"}
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "saved_seconds": 0.0, "invalidations": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _drop_expired(self):
+        """Удаление записей старше TTL (вызывается под lock)"""
+        if not self._entries:
+            return
+        now = time.time()
+        keep = [i for i, entry in enumerate(self._entries) if now - entry["created_at"] <= self.ttl_seconds]
+        if len(keep) < len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep] if keep else None
+
+    def lookup(self, query: str, query_vector) -> dict | None:
+        """
+        Поиск ответа для близкого запроса
+
+        Returns:
+            dict | None: {"answer", "documents"} или None при промахе
+        """
+        vector = self._normalize(query_vector)
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._drop_expired()
+            if self._vectors is None:
+                self.stats["misses"] += 1
+                return None
+
+            similarities = self._vectors @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            entry = self._entries[best]
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += entry["latency"]
+
+        logger.info(f"Answer cache hit: similarity={similarity:.3f}, cached query: {entry['query'][:80]}")
+        self._audit(query, entry, similarity)
+        result = entry["result"]
+        return {"answer": result["answer"], "documents": list(result["documents"])}
+
+    def store(self, query: str, query_vector, result: dict, latency: float):
+        """Сохранение ответа (latency - время полного RAG, для статистики сэкономленного времени)"""
+        vector = self._normalize(query_vector)[np.newaxis, :]
+        entry = {
+            "query": query,
+            "result": {"answer": result["answer"], "documents": list(result["documents"])},
+            "created_at": time.time(),
+            "latency": latency,
+        }
+        with self._lock:
+            self._drop_expired()
+            self._entries.append(entry)
+            self._vectors = vector if self._vectors is None else np.vstack([self._vectors, vector])
+            # Вытеснение самых старых записей сверх лимита
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._entries = self._entries[overflow:]
+                self._vectors = self._vectors[overflow:]
+
+    def invalidate(self):
+        """Сброс кеша (после переиндексации ответы могут устареть)"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries = []
+            self._vectors = None
+            self.stats["invalidations"] += 1
+        if count:
+            logger.info(f"Answer cache invalidated: {count} entries dropped")
+
+    def _audit(self, query: str, entry: dict, similarity: float):
+        """Запись попадания в журнал аудита для поиска ложных срабатываний"""
+        if self.audit_path is None:
+            return
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "query": query,
+            "cached_query": entry["query"],
+            "similarity": round(similarity, 4),
+            "age_seconds": round(time.time() - entry["created_at"], 1),
+            "answer": entry["result"]["answer"],
+        }
+        try:
+            self.audit_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.audit_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to write answer cache audit: {e}")
+
+    def get_stats(self) -> dict:
+        """Статистика: hit rate, сэкономленное время, размер"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["enabled"] = config.ANSWER_CACHE_ENABLED
+        stats["threshold"] = self.threshold
+        return stats
+
+
+# Общий экземпляр кеша
+cache = SemanticAnswerCache(
+    threshold=config.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+    max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+    audit_path=config.ANSWER_CACHE_AUDIT_PATH or None,
+)
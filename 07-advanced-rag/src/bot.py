@@ -53,7 +53,7 @@ async def main():
     logger.info(f"  Show sources: {config.SHOW_SOURCES}")
     logger.info("-" * 70)
     
-    # Индексация при старте
+    # Индексация при старте: если документы не изменились - индекс загружается с диска (INDEX_DIR)
     logger.info("📚 Starting indexing...")
     result = await indexer.reindex_all()
     if result and result[0] is not None:
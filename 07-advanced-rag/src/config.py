@@ -22,6 +22,11 @@ class Config:
     HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "intfloat/multilingual-e5-base")
     HUGGINGFACE_DEVICE = os.getenv("HUGGINGFACE_DEVICE", "cpu")  # cpu/cuda/mps
     
+    # Indexing Configuration
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+    INDEX_DIR = os.getenv("INDEX_DIR", "index")  # Директория для сохраненного индекса
+    
     # Retrieval Configuration
     RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic")  # semantic/hybrid/hybrid_reranker
     SEMANTIC_RETRIEVER_K = int(os.getenv("SEMANTIC_RETRIEVER_K", "10"))
@@ -33,6 +38,32 @@ class Config:
     CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
     RERANKER_TOP_K = int(os.getenv("RERANKER_TOP_K", "3"))
     
+    # Адаптивная трансформация запроса
+    QUERY_REWRITE_MODE = os.getenv("QUERY_REWRITE_MODE", "adaptive")  # adaptive/always
+    QUERY_REWRITE_MIN_WORDS = int(os.getenv("QUERY_REWRITE_MIN_WORDS", "4"))  # Короче - считается уточнением
+    QUERY_REWRITE_HISTORY_MESSAGES = int(os.getenv("QUERY_REWRITE_HISTORY_MESSAGES", "6"))  # Ключ кеша
+    QUERY_REWRITE_CACHE_SIZE = int(os.getenv("QUERY_REWRITE_CACHE_SIZE", "2000"))
+    
+    # Семантический кеш ответов (ключ - embedding трансформированного запроса)
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    ANSWER_CACHE_AUDIT_PATH = os.getenv("ANSWER_CACHE_AUDIT_PATH", "logs/answer_cache_audit.jsonl")  # Пусто - без аудита
+    
+    # Потоковый вывод ответа (правки одного сообщения Telegram)
+    STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # Мин. секунд между правками
+    STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "40"))  # Мин. прирост текста для правки
+    
+    # История диалогов
+    CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "sqlite")  # sqlite/memory
+    CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "storage/conversations.sqlite")
+    CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "20"))  # Сообщений на чат
+    CONVERSATION_MAX_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", "3000"))  # Примерных токенов на чат
+    CONVERSATION_CACHE_CHATS = int(os.getenv("CONVERSATION_CACHE_CHATS", "1000"))  # Чатов в памяти (LRU)
+    CONVERSATION_IDLE_TTL_HOURS = float(os.getenv("CONVERSATION_IDLE_TTL_HOURS", "72"))  # Удаление неактивных
+    
     # Отображение источников
     SHOW_SOURCES = os.getenv("SHOW_SOURCES", "false").lower() == "true"
     
@@ -69,6 +100,22 @@ class Config:
                 f"Must be one of: {', '.join(valid_retrieval_modes)}"
             )
         
+        # Валидация QUERY_REWRITE_MODE
+        valid_query_rewrite_modes = ["adaptive", "always"]
+        if cls.QUERY_REWRITE_MODE not in valid_query_rewrite_modes:
+            raise ValueError(
+                f"Invalid QUERY_REWRITE_MODE: {cls.QUERY_REWRITE_MODE}. "
+                f"Must be one of: {', '.join(valid_query_rewrite_modes)}"
+            )
+        
+        # Валидация CONVERSATION_STORE
+        valid_conversation_stores = ["sqlite", "memory"]
+        if cls.CONVERSATION_STORE not in valid_conversation_stores:
+            raise ValueError(
+                f"Invalid CONVERSATION_STORE: {cls.CONVERSATION_STORE}. "
+                f"Must be one of: {', '.join(valid_conversation_stores)}"
+            )
+        
         # Валидация EMBEDDING_PROVIDER
         valid_embedding_providers = ["openai", "huggingface"]
         if cls.EMBEDDING_PROVIDER not in valid_embedding_providers:
@@ -0,0 +1,273 @@
+"""
+Хранилище истории диалогов
+
+Вместо неограниченного словаря chat_conversations в памяти процесса:
+- история хранится компактно: (role, content, tokens), без объектов LangChain
+- SQLite по умолчанию (CONVERSATION_STORE=sqlite) - история переживает перезапуск бота;
+  memory - только в памяти процесса (для разработки)
+- LRU кеш последних активных чатов в памяти (CONVERSATION_CACHE_CHATS)
+- ограничения на чат: число сообщений (CONVERSATION_MAX_MESSAGES) и примерное число
+  токенов (CONVERSATION_MAX_TOKENS) - старые сообщения обрезаются
+- неактивные дольше CONVERSATION_IDLE_TTL_HOURS чаты удаляются
+- async API (aload/aappend/areset): операции SQLite выполняются в потоке
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+ROLE_HUMAN = "human"
+ROLE_AI = "ai"
+
+# Очистка неактивных чатов - раз в CLEANUP_EVERY добавлений
+CLEANUP_EVERY = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """Примерное число токенов (~3 символа на токен для русского текста)"""
+    return len(text) // 3 + 1
+
+
+def to_messages(records: list) -> list:
+    """Компактные записи (role, content, ...) -> LangChain messages"""
+    return [
+        HumanMessage(content=record[1]) if record[0] == ROLE_HUMAN else AIMessage(content=record[1])
+        for record in records
+    ]
+
+
+def trim_history(records: list, max_messages: int, max_tokens: int) -> int:
+    """
+    Сколько старых записей нужно удалить, чтобы уложиться в лимиты
+
+    Записи - (role, content, tokens, ...). История после обрезки начинается
+    с сообщения пользователя (ответ без вопроса бесполезен для контекста).
+    """
+    # Последний вопрос пользователя (и ответ на него) оставляем всегда, даже сверх лимита
+    keep_from = max((i for i, record in enumerate(records) if record[0] == ROLE_HUMAN), default=max(len(records) - 1, 0))
+    drop = min(max(0, len(records) - max_messages), keep_from)
+    total_tokens = sum(record[2] for record in records[drop:])
+    while total_tokens > max_tokens and drop < keep_from:
+        total_tokens -= records[drop][2]
+        drop += 1
+    while drop < keep_from and records[drop][0] != ROLE_HUMAN:
+        drop += 1
+    return drop
+
+
+class ConversationStore:
+    """Базовое хранилище: LRU кеш в памяти + backend (_read/_write/_delete)"""
+
+    def __init__(self, max_messages: int, max_tokens: int, cache_chats: int, idle_ttl_seconds: float):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.cache_chats = cache_chats
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._cache = OrderedDict()  # chat_id -> list[(role, content, tokens)]
+        self._lock = threading.Lock()
+        self._appends = 0
+
+    # ---------- Backend ----------
+
+    def _read(self, chat_id: int) -> list:
+        return []
+
+    def _write(self, chat_id: int, new_records: list, drop: int):
+        """Сохранение новых записей и удаление drop самых старых"""
+
+    def _delete(self, chat_id: int):
+        pass
+
+    def _cleanup_idle(self, cutoff: float) -> int:
+        return 0
+
+    # ---------- Кеш ----------
+
+    def _cache_put(self, chat_id: int, records: list):
+        self._cache[chat_id] = records
+        self._cache.move_to_end(chat_id)
+        while len(self._cache) > self.cache_chats:
+            evicted, _ = self._cache.popitem(last=False)
+            self._on_evict(evicted)
+
+    def _on_evict(self, chat_id: int):
+        """Чат вытеснен из LRU кеша (в SQLite история остается на диске)"""
+
+    def _get_records(self, chat_id: int) -> list:
+        if chat_id in self._cache:
+            self._cache.move_to_end(chat_id)
+            return self._cache[chat_id]
+        records = self._read(chat_id)
+        self._cache_put(chat_id, records)
+        return records
+
+    # ---------- Sync API ----------
+
+    def load(self, chat_id: int) -> list:
+        """История чата в виде LangChain messages"""
+        with self._lock:
+            return to_messages(self._get_records(chat_id))
+
+    def append(self, chat_id: int, messages: list[tuple[str, str]]):
+        """Добавление сообщений [(role, content), ...] с обрезкой по лимитам"""
+        new_records = [(role, content, estimate_tokens(content)) for role, content in messages]
+        with self._lock:
+            records = self._get_records(chat_id) + new_records
+            drop = trim_history(records, self.max_messages, self.max_tokens)
+            self._write(chat_id, new_records, drop)
+            self._cache_put(chat_id, records[drop:])
+            self._appends += 1
+            cleanup = self._appends % CLEANUP_EVERY == 0
+        if cleanup:
+            self.cleanup_idle()
+
+    def reset(self, chat_id: int):
+        """Удаление истории чата (/start)"""
+        with self._lock:
+            self._cache.pop(chat_id, None)
+            self._delete(chat_id)
+
+    def cleanup_idle(self) -> int:
+        """Удаление чатов без активности дольше idle_ttl_seconds"""
+        cutoff = time.time() - self.idle_ttl_seconds
+        with self._lock:
+            removed = self._cleanup_idle(cutoff)
+        if removed:
+            logger.info(f"Conversation store: removed {removed} idle chats")
+        return removed
+
+    # ---------- Async API ----------
+
+    async def aload(self, chat_id: int) -> list:
+        return await asyncio.to_thread(self.load, chat_id)
+
+    async def aappend(self, chat_id: int, messages: list[tuple[str, str]]):
+        await asyncio.to_thread(self.append, chat_id, messages)
+
+    async def areset(self, chat_id: int):
+        await asyncio.to_thread(self.reset, chat_id)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"cached_chats": len(self._cache)}
+
+
+class MemoryConversationStore(ConversationStore):
+    """История только в памяти: кеш и есть хранилище (время активности - для очистки)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._updated_at = {}
+
+    def _write(self, chat_id: int, new_records: list, drop: int):
+        self._updated_at[chat_id] = time.time()
+
+    def _delete(self, chat_id: int):
+        self._updated_at.pop(chat_id, None)
+
+    def _on_evict(self, chat_id: int):
+        # Без backend вытеснение из LRU означает потерю истории
+        self._updated_at.pop(chat_id, None)
+
+    def _cleanup_idle(self, cutoff: float) -> int:
+        idle = [chat_id for chat_id, updated_at in self._updated_at.items() if updated_at < cutoff]
+        for chat_id in idle:
+            self._cache.pop(chat_id, None)
+            del self._updated_at[chat_id]
+        return len(idle)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """История в SQLite: чаты и сообщения (role, content, tokens)"""
+
+    def __init__(self, path: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # check_same_thread=False - доступ из потоков asyncio.to_thread защищен self._lock
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            " chat_id INTEGER PRIMARY KEY,"
+            " updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " chat_id INTEGER NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " tokens INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, id);"
+            "CREATE INDEX IF NOT EXISTS idx_chats_updated ON chats(updated_at);"
+        )
+        self._conn.commit()
+
+    def _read(self, chat_id: int) -> list:
+        rows = self._conn.execute(
+            "SELECT role, content, tokens FROM messages WHERE chat_id = ? ORDER BY id", (chat_id,)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def _write(self, chat_id: int, new_records: list, drop: int):
+        # drop считается по истории вместе с новыми записями - сначала вставка, затем удаление
+        self._conn.executemany(
+            "INSERT INTO messages (chat_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+            [(chat_id, role, content, tokens) for role, content, tokens in new_records]
+        )
+        if drop:
+            self._conn.execute(
+                "DELETE FROM messages WHERE id IN ("
+                " SELECT id FROM messages WHERE chat_id = ? ORDER BY id LIMIT ?)",
+                (chat_id, drop)
+            )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO chats (chat_id, updated_at) VALUES (?, ?)", (chat_id, time.time())
+        )
+        self._conn.commit()
+
+    def _delete(self, chat_id: int):
+        self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+        self._conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+        self._conn.commit()
+
+    def _cleanup_idle(self, cutoff: float) -> int:
+        idle = [row[0] for row in self._conn.execute(
+            "SELECT chat_id FROM chats WHERE updated_at < ?", (cutoff,)
+        ).fetchall()]
+        for chat_id in idle:
+            self._cache.pop(chat_id, None)
+            self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+        self._conn.execute("DELETE FROM chats WHERE updated_at < ?", (cutoff,))
+        self._conn.commit()
+        return len(idle)
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        with self._lock:
+            stats["chats"] = self._conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+            stats["messages"] = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return stats
+
+
+def create_store() -> ConversationStore:
+    """Хранилище по CONVERSATION_STORE из конфига"""
+    limits = dict(
+        max_messages=config.CONVERSATION_MAX_MESSAGES,
+        max_tokens=config.CONVERSATION_MAX_TOKENS,
+        cache_chats=config.CONVERSATION_CACHE_CHATS,
+        idle_ttl_seconds=config.CONVERSATION_IDLE_TTL_HOURS * 3600,
+    )
+    if config.CONVERSATION_STORE == "memory":
+        logger.info("Conversation store: memory")
+        return MemoryConversationStore(**limits)
+    logger.info(f"Conversation store: sqlite ({config.CONVERSATION_DB_PATH})")
+    return SQLiteConversationStore(config.CONVERSATION_DB_PATH, **limits)
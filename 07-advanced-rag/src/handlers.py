@@ -2,26 +2,26 @@ import logging
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage
 from config import config
 import indexer
 import rag
 import evaluation
+from streaming import TelegramStreamer
+import conversation_store
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Глобальный словарь для хранения историй диалогов в формате LangChain Messages
-chat_conversations: dict[int, list] = {}
+# Хранилище историй диалогов (SQLite + LRU кеш в памяти, лимиты на размер истории)
+conversations = conversation_store.create_store()
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     logger.info(f"User {message.chat.id} started the bot")
     
-    # Инициализируем историю с системным промптом в LangChain формате
-    chat_conversations[message.chat.id] = [
-        SystemMessage(content=config.SYSTEM_PROMPT)
-    ]
+    # Начинаем диалог заново
+    await conversations.areset(message.chat.id)
     
     await message.answer(
         "Привет! Я RAG-ассистент Сбербанка.\n\n"
@@ -71,7 +71,8 @@ async def cmd_index(message: Message):
     await message.answer("Начинаю переиндексацию документов...")
     
     try:
-        result = await indexer.reindex_all()
+        # /index - явный запрос на полную переиндексацию, игнорируем сохраненный индекс
+        result = await indexer.reindex_all(force=True)
         if result and result[0] is not None:
             rag.vector_store, rag.chunks = result
             rag.initialize_retriever()
@@ -132,6 +133,32 @@ async def cmd_index_status(message: Message):
             f"• Устройство: {stats.get('device', 'N/A')}\n"
         )
     
+    # Трансформация запроса
+    rewrite_stats = stats.get('query_rewrite', {})
+    if rewrite_stats:
+        status_text += (
+            f"\n✏️ *Трансформация запроса: {rewrite_stats['mode']}*\n"
+            f"• Без LLM: {rewrite_stats['llm_skipped_rate']:.0%}\n"
+            f"• p50/p95: {rewrite_stats['overall']['p50_ms']:.0f}/{rewrite_stats['overall']['p95_ms']:.0f} мс\n"
+        )
+    
+    # Семантический кеш ответов
+    cache_stats = stats.get('answer_cache', {})
+    if cache_stats.get('enabled'):
+        status_text += (
+            f"\n💾 *Кеш ответов*\n"
+            f"• Записей: {cache_stats['entries']}, порог: {cache_stats['threshold']}\n"
+            f"• Hit rate: {cache_stats['hit_rate']:.0%} ({cache_stats['hits']}/{cache_stats['lookups']})\n"
+            f"• Сэкономлено: {cache_stats['saved_seconds']:.0f} сек\n"
+        )
+    
+    # История диалогов
+    conversation_stats = conversations.get_stats()
+    status_text += f"\n🗂 *История диалогов: {config.CONVERSATION_STORE}*\n"
+    status_text += f"• Чатов в кеше: {conversation_stats['cached_chats']}\n"
+    if 'chats' in conversation_stats:
+        status_text += f"• В базе: {conversation_stats['chats']} чатов, {conversation_stats['messages']} сообщений\n"
+    
     await message.answer(status_text, parse_mode="Markdown")
 
 @router.message(Command("evaluate_dataset"))
@@ -231,17 +258,6 @@ async def handle_message(message: Message):
     
     logger.info(f"Message from {message.chat.id}: {message.text[:100]}...")
     
-    # Инициализируем историю если её нет
-    if message.chat.id not in chat_conversations:
-        chat_conversations[message.chat.id] = [
-            SystemMessage(content=config.SYSTEM_PROMPT)
-        ]
-    
-    # Добавляем сообщение пользователя в историю
-    chat_conversations[message.chat.id].append(
-        HumanMessage(content=message.text)
-    )
-    
     try:
         # Проверка инициализации векторного хранилища
         if rag.vector_store is None or rag.retriever is None:
@@ -250,20 +266,29 @@ async def handle_message(message: Message):
                 "⚠️ Векторное хранилище не инициализировано. "
                 "Пожалуйста, подождите или используйте /index для индексации."
             )
-            # Удаляем последнее сообщение из истории
-            chat_conversations[message.chat.id].pop()
             return
         
-        # Получаем ответ через RAG (передаем историю без system message)
+        # Потоковый вывод: ответ появляется по мере генерации (правки одного сообщения)
+        streamer = TelegramStreamer(message) if config.STREAMING_ENABLED else None
+        
+        # История диалога + текущее сообщение пользователя
+        history = await conversations.aload(message.chat.id)
+        messages = history + [HumanMessage(content=message.text)]
+        
+        # Получаем ответ через RAG
         # Теперь возвращает dict с answer и documents
-        result = await rag.rag_answer(chat_conversations[message.chat.id][1:])
+        result = await rag.rag_answer(
+            messages,
+            on_token=streamer.push if streamer else None
+        )
         answer = result["answer"]
         documents = result["documents"]
         
-        # Добавляем ответ в историю
-        chat_conversations[message.chat.id].append(
-            AIMessage(content=answer)
-        )
+        # Сохраняем вопрос и ответ в историю (только при успешном ответе)
+        await conversations.aappend(message.chat.id, [
+            (conversation_store.ROLE_HUMAN, message.text),
+            (conversation_store.ROLE_AI, answer)
+        ])
         
         # Формируем итоговый ответ с источниками если включено
         final_response = answer
@@ -272,20 +297,19 @@ async def handle_message(message: Message):
             if sources:
                 final_response = f"{answer}\n\n{sources}"
         
-        await message.answer(final_response)
+        if streamer:
+            await streamer.finish(final_response)
+        else:
+            await message.answer(final_response)
         
     except ValueError as e:
         logger.error(f"ValueError in handle_message for chat {message.chat.id}: {e}")
-        # Удаляем последнее сообщение из истории
-        chat_conversations[message.chat.id].pop()
         await message.answer(
             "⚠️ Векторное хранилище не готово. "
             "Используйте /index для индексации документов."
         )
     except Exception as e:
         logger.error(f"Error in handle_message for chat {message.chat.id}: {e}", exc_info=True)
-        # Удаляем последнее сообщение из истории
-        chat_conversations[message.chat.id].pop()
         await message.answer(
             "Произошла ошибка при обработке вашего сообщения. "
             "Попробуйте еще раз или используйте /start для начала нового диалога."
@@ -1,5 +1,6 @@
 import json
 import logging
+import uuid
 from pathlib import Path
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_core.documents import Document
@@ -8,6 +9,7 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+import index_storage
 
 logger = logging.getLogger(__name__)
 
@@ -33,8 +35,8 @@ def load_pdf_documents(data_dir: str) -> list:
 def split_documents(pages: list) -> list:
     """Разбиение документов на чанки"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP
     )
     chunks = text_splitter.split_documents(pages)
     logger.info(f"Split into {len(chunks)} chunks")
@@ -133,9 +135,16 @@ def create_embeddings():
     else:
         raise ValueError(f"Unknown embedding provider: {provider}. Use 'openai' or 'huggingface'")
 
-def create_vector_store(chunks: list):
+def describe_embeddings(embeddings) -> dict:
+    """Параметры embeddings, от которых зависят векторы (часть манифеста индекса)"""
+    if isinstance(embeddings, HuggingFaceEmbeddings):
+        return {"provider": "huggingface", "model": embeddings.model_name, "normalize": True}
+    return {"provider": "openai", "model": embeddings.model, "base_url": config.OPENAI_BASE_URL}
+
+def create_vector_store(chunks: list, embeddings=None):
     """Создание векторного хранилища"""
-    embeddings = create_embeddings()
+    if embeddings is None:
+        embeddings = create_embeddings()
     vector_store = InMemoryVectorStore.from_documents(
         documents=chunks,
         embedding=embeddings
@@ -143,22 +152,71 @@ def create_vector_store(chunks: list):
     logger.info(f"Created vector store with {len(chunks)} chunks")
     return vector_store
 
-async def reindex_all():
-    """Полная переиндексация всех документов (PDF + JSON)
+def restore_vector_store(entries: list, vectors, embeddings):
+    """
+    Восстановление векторного хранилища из сохраненного индекса (без вызова embeddings)
     
     Returns:
-        tuple: (vector_store, chunks) для инициализации retriever
+        tuple: (vector_store, chunks)
     """
-    logger.info("Starting full reindexing...")
+    vector_store = InMemoryVectorStore(embedding=embeddings)
+    chunks = []
+    for entry, vector in zip(entries, vectors.tolist()):
+        vector_store.store[entry["id"]] = {
+            "id": entry["id"],
+            "vector": vector,
+            "text": entry["text"],
+            "metadata": entry["metadata"],
+        }
+        chunks.append(Document(id=entry["id"], page_content=entry["text"], metadata=entry["metadata"]))
+    logger.info(f"Restored vector store with {len(chunks)} chunks from disk")
+    return vector_store, chunks
+
+def save_vector_store(vector_store, manifest: dict):
+    """Сохранение векторного хранилища на диск вместе с манифестом"""
+    entries = []
+    vectors = []
+    for record in vector_store.store.values():
+        entries.append({
+            "id": record["id"],
+            "text": record["text"],
+            "metadata": record["metadata"],
+        })
+        vectors.append(record["vector"])
+    index_storage.save_index(config.INDEX_DIR, manifest, entries, vectors)
+
+async def reindex_all(force: bool = False):
+    """Индексация всех документов (PDF + JSON) с переиспользованием индекса на диске
     
+    Если исходные файлы и настройки не изменились (манифест актуален),
+    индекс загружается с диска без парсинга PDF и вызова embeddings.
+    
+    Args:
+        force: принудительная полная переиндексация (игнорировать сохраненный индекс)
+    
+    Returns:
+        tuple: (vector_store, chunks) для инициализации retriever
+    """
     try:
+        embeddings = create_embeddings()
+        source_files = index_storage.get_source_files(config.DATA_DIR)
+        manifest = index_storage.build_manifest(source_files, describe_embeddings(embeddings))
+        
+        # Пытаемся загрузить актуальный индекс с диска
+        if not force:
+            saved = index_storage.load_index(config.INDEX_DIR, manifest)
+            if saved is not None and saved[0]:
+                return restore_vector_store(*saved, embeddings)
+        
+        logger.info("Starting full reindexing...")
+        
         # Загрузка PDF документов
         pages = load_pdf_documents(config.DATA_DIR)
         pdf_chunks = split_documents(pages) if pages else []
         logger.info(f"PDF: {len(pdf_chunks)} chunks")
         
         # Загрузка JSON Q&A пар
-        json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
+        json_file = Path(config.DATA_DIR) / index_storage.JSON_DOCUMENTS_FILE
         json_documents = load_json_documents(str(json_file))
         logger.info(f"JSON: {len(json_documents)} Q&A pairs")
         
@@ -169,11 +227,22 @@ async def reindex_all():
             logger.warning("No documents found to index")
             return None, []
         
+        # Явные id чанков - одинаковые в vector store, chunks (BM25) и индексе на диске
+        for chunk in all_chunks:
+            if not chunk.id:
+                chunk.id = str(uuid.uuid4())
+        
         logger.info(f"Total chunks to index: {len(all_chunks)} (PDF: {len(pdf_chunks)}, JSON: {len(json_documents)})")
         
-        vector_store = create_vector_store(all_chunks)
+        vector_store = create_vector_store(all_chunks, embeddings)
         logger.info("Reindexing completed successfully")
         
+        # Сохраняем индекс на диск (ошибка сохранения не должна ломать запуск бота)
+        try:
+            save_vector_store(vector_store, manifest)
+        except Exception as e:
+            logger.error(f"Failed to save index to disk: {e}", exc_info=True)
+        
         # Возвращаем vector_store и chunks для BM25
         return vector_store, all_chunks
         
@@ -0,0 +1,205 @@
+"""
+Адаптивная трансформация запроса перед retrieval
+
+Трансформация через LLM нужна, чтобы учесть историю диалога ("а по вкладам?").
+Для первого вопроса в диалоге и для самодостаточных вопросов она только добавляет
+полный LLM round-trip перед поиском, поэтому:
+- первый вопрос (одно сообщение пользователя) - ищем по тексту вопроса без LLM
+- самодостаточный вопрос (QUERY_REWRITE_MODE=adaptive) - дешевая эвристика:
+  достаточно длинный и без отсылок к предыдущим сообщениям ("это", "а если", "там" ...)
+- остальные - LLM, результат кешируется по hash последних сообщений истории
+
+Время этапа (до начала retrieval) пишется по источникам (skip/cache/llm),
+p50/p95 периодически логируются - видно, сколько выигрывает time-to-first-token.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Слова и обороты, отсылающие к предыдущим сообщениям диалога
+FOLLOW_UP_MARKERS = frozenset({
+    "это", "этот", "эта", "эти", "этого", "этой", "этих", "этом", "этим",
+    "тот", "та", "те", "того", "той", "тех", "том", "такой", "такие", "такая", "такого",
+    "он", "она", "оно", "они", "его", "ее", "её", "их", "ему", "ей", "им", "нему", "ней", "них",
+    "там", "туда", "тогда", "тоже", "также", "еще", "ещё", "выше", "ранее", "предыдущий",
+    "последний", "последнее", "вышеупомянутый", "аналогично", "подробнее",
+})
+FOLLOW_UP_PREFIXES = ("а ", "и ", "но ", "ну а ")
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Размер окна для p50/p95 и частота логирования
+LATENCY_WINDOW = 500
+LOG_EVERY = 20
+
+
+def _last_human_text(messages: list) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return ""
+
+
+def is_self_contained(text: str) -> bool:
+    """Вопрос понятен без истории: достаточно длинный и без отсылок к предыдущим сообщениям"""
+    lowered = text.strip().lower()
+    words = WORD_RE.findall(lowered)
+    if len(words) < config.QUERY_REWRITE_MIN_WORDS:
+        return False
+    if lowered.startswith(FOLLOW_UP_PREFIXES):
+        return False
+    return not any(word in FOLLOW_UP_MARKERS for word in words)
+
+
+def needs_rewrite(messages: list) -> tuple[bool, str]:
+    """
+    Нужна ли трансформация через LLM
+
+    Returns:
+        tuple: (нужна ли, причина: first_turn / self_contained / follow_up / always)
+    """
+    if config.QUERY_REWRITE_MODE == "always":
+        return True, "always"
+    human_count = sum(1 for message in messages if isinstance(message, HumanMessage))
+    if human_count <= 1:
+        return False, "first_turn"
+    if is_self_contained(_last_human_text(messages)):
+        return False, "self_contained"
+    return True, "follow_up"
+
+
+def history_key(messages: list) -> str:
+    """Ключ кеша: hash последних QUERY_REWRITE_HISTORY_MESSAGES сообщений (тип + текст)"""
+    recent = messages[-config.QUERY_REWRITE_HISTORY_MESSAGES:]
+    payload = "\x00".join(f"{message.type}:{message.content}" for message in recent)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RewriteCache:
+    """LRU кеш трансформированных запросов"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key: str, query: str):
+        with self._lock:
+            self._items[key] = query
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class StageLatency:
+    """Скользящее окно времени этапа трансформации по источникам (skip/cache/llm)"""
+
+    def __init__(self):
+        self._samples = {"skip": deque(maxlen=LATENCY_WINDOW), "cache": deque(maxlen=LATENCY_WINDOW),
+                         "llm": deque(maxlen=LATENCY_WINDOW)}
+        self._all = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.counts = {"skip": 0, "cache": 0, "llm": 0}
+
+    def record(self, source: str, seconds: float):
+        with self._lock:
+            self._samples[source].append(seconds)
+            self._all.append(seconds)
+            self.counts[source] += 1
+            total = sum(self.counts.values())
+        if total % LOG_EVERY == 0:
+            self.log()
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        if not samples:
+            return {"p50_ms": 0.0, "p95_ms": 0.0}
+        values = np.array(samples) * 1000
+        return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = {source: self._percentiles(samples) for source, samples in self._samples.items()}
+            stats["overall"] = self._percentiles(self._all)
+            stats["counts"] = dict(self.counts)
+        total = sum(stats["counts"].values())
+        stats["llm_skipped_rate"] = (total - stats["counts"]["llm"]) / total if total else 0.0
+        return stats
+
+    def log(self):
+        stats = self.get_stats()
+        llm, overall = stats["llm"], stats["overall"]
+        logger.info(
+            f"Query rewrite stage: p50={overall['p50_ms']:.0f}ms p95={overall['p95_ms']:.0f}ms "
+            f"(always-LLM baseline p50={llm['p50_ms']:.0f}ms p95={llm['p95_ms']:.0f}ms), "
+            f"LLM skipped for {stats['llm_skipped_rate']:.0%} of queries, counts={stats['counts']}"
+        )
+
+
+# Общие экземпляры
+cache = RewriteCache(config.QUERY_REWRITE_CACHE_SIZE)
+latency = StageLatency()
+
+
+def _resolve(messages: list) -> tuple[str | None, str | None, str]:
+    """Запрос без LLM (если возможно): (query, source, key для кеша)"""
+    rewrite, reason = needs_rewrite(messages)
+    if not rewrite:
+        logger.info(f"Query rewrite skipped ({reason})")
+        return _last_human_text(messages), "skip", ""
+    key = history_key(messages)
+    cached = cache.get(key)
+    if cached is not None:
+        logger.info("Query rewrite cache hit")
+        return cached, "cache", key
+    return None, None, key
+
+
+def rewrite_query(messages: list, transform_chain) -> str:
+    """Запрос для retrieval (sync)"""
+    start = time.perf_counter()
+    query, source, key = _resolve(messages)
+    if query is None:
+        query, source = transform_chain.invoke({"messages": messages}), "llm"
+        cache.set(key, query)
+    latency.record(source, time.perf_counter() - start)
+    return query
+
+
+async def arewrite_query(messages: list, transform_chain) -> str:
+    """Запрос для retrieval (async)"""
+    start = time.perf_counter()
+    query, source, key = _resolve(messages)
+    if query is None:
+        query, source = await transform_chain.ainvoke({"messages": messages}), "llm"
+        cache.set(key, query)
+    latency.record(source, time.perf_counter() - start)
+    return query
+
+
+def get_stats() -> dict:
+    """Статистика этапа трансформации: режим, p50/p95 по источникам, размер кеша"""
+    stats = latency.get_stats()
+    stats["mode"] = config.QUERY_REWRITE_MODE
+    stats["cache_entries"] = len(cache)
+    return stats
@@ -1,11 +1,14 @@
 import logging
+import time
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
 from langchain_openai import ChatOpenAI
 from langchain_community.retrievers import BM25Retriever
 from langchain_classic.retrievers import EnsembleRetriever
 from config import config
+from answer_cache import cache as answer_cache
+import query_rewrite
 
 logger = logging.getLogger(__name__)
 
@@ -128,6 +131,8 @@ def initialize_retriever():
     
     try:
         retriever = create_retriever()
+        # Новый индекс - сохраненные ответы могли устареть
+        answer_cache.invalidate()
         logger.info(f"✓ Retriever initialized in '{config.RETRIEVAL_MODE}' mode")
         return True
     except Exception as e:
@@ -254,6 +259,45 @@ def get_retrieval_query_transformation_chain():
         | StrOutputParser()
     )
 
+def get_retrieval_query_chain():
+    """
+    Запрос для поиска: готовый (ключ "query" во входе) или адаптивная трансформация
+    
+    Трансформация через LLM пропускается для первого вопроса и самодостаточных
+    вопросов, результаты LLM кешируются по истории (см. query_rewrite.py)
+    """
+    transform_chain = get_retrieval_query_transformation_chain()
+    return RunnableBranch(
+        (lambda x: bool(x.get("query")), lambda x: x["query"]),
+        RunnableLambda(
+            func=lambda x: query_rewrite.rewrite_query(x["messages"], transform_chain),
+            afunc=lambda x: query_rewrite.arewrite_query(x["messages"], transform_chain)
+        )
+    )
+
+def get_documents_chain():
+    """Retrieval часть RAG-цепочки: запрос → documents (с reranking для hybrid_reranker)"""
+    if retriever is None:
+        raise ValueError("Retriever not initialized")
+    
+    if config.RETRIEVAL_MODE.lower() == "hybrid_reranker":
+        return (
+            RunnablePassthrough.assign(
+                ensemble_docs=get_retrieval_query_chain() | retriever
+            )
+            | (lambda x: [doc for doc, score in rerank_documents(
+                query=x["messages"][-1].content if x["messages"] else "",
+                documents=x["ensemble_docs"],
+                top_k=config.RERANKER_TOP_K
+            )])
+        )
+    return get_retrieval_query_chain() | retriever
+
+def get_answer_chain():
+    """Генерация ответа по context и messages (astream - потоковый вывод токенов)"""
+    conversational_answering_prompt, _ = _load_prompts()
+    return conversational_answering_prompt | _get_llm() | StrOutputParser()
+
 def get_rag_chain():
     """Финальная RAG-цепочка возвращающая answer и documents в LCEL стиле"""
     if retriever is None:
@@ -267,7 +311,7 @@ def get_rag_chain():
         # LCEL цепочка с reranking: ensemble_docs → rerank → documents → answer
         return (
             RunnablePassthrough.assign(
-                ensemble_docs=get_retrieval_query_transformation_chain() | retriever
+                ensemble_docs=get_retrieval_query_chain() | retriever
             )
             # Шаг reranking: переранжируем документы cross-encoder
             | RunnablePassthrough.assign(
@@ -293,7 +337,7 @@ def get_rag_chain():
     # Шаг 1: Получаем documents через query transformation
     return (
         RunnablePassthrough.assign(
-            documents=get_retrieval_query_transformation_chain() | retriever
+            documents=get_retrieval_query_chain() | retriever
         )
         # Шаг 2: Генерируем ответ на основе documents
         | RunnablePassthrough.assign(
@@ -306,12 +350,41 @@ def get_rag_chain():
         | (lambda x: {"answer": x["answer"], "documents": x["documents"]})
     )
 
-async def rag_answer(messages):
+async def _run_rag(messages, query: str = None, on_token=None):
+    """
+    Retrieval и генерация ответа
+    
+    Без on_token - полная LCEL цепочка. С on_token - documents через retrieval часть,
+    затем ответ через astream(): on_token получает накопленный текст после каждого токена.
+    """
+    inputs = {"messages": messages}
+    if query:
+        inputs["query"] = query
+    
+    if on_token is None:
+        return await get_rag_chain().ainvoke(inputs)
+    
+    documents = await get_documents_chain().ainvoke(inputs)
+    answer = ""
+    async for token in get_answer_chain().astream({
+        "context": format_chunks(documents),
+        "messages": messages
+    }):
+        answer += token
+        await on_token(answer)
+    return {"answer": answer, "documents": documents}
+
+async def rag_answer(messages, on_token=None):
     """
     Получить ответ от RAG с учетом истории диалога
     
+    При ANSWER_CACHE_ENABLED запрос сначала трансформируется, по его embedding
+    ищется близкий ранее заданный вопрос - при попадании ответ возвращается
+    из кеша без retrieval и генерации.
+    
     Args:
         messages: список LangChain messages (HumanMessage, AIMessage)
+        on_token: async callback(текст ответа на данный момент) для потокового вывода
     
     Returns:
         dict: {"answer": str, "documents": list[Document]}
@@ -320,8 +393,20 @@ async def rag_answer(messages):
         logger.error("Vector store or retriever not initialized")
         raise ValueError("Векторное хранилище не инициализировано. Запустите индексацию.")
     
-    rag_chain = get_rag_chain()
-    result = await rag_chain.ainvoke({"messages": messages})
+    if not config.ANSWER_CACHE_ENABLED:
+        return await _run_rag(messages, on_token=on_token)
+    
+    start = time.perf_counter()
+    query = await query_rewrite.arewrite_query(messages, get_retrieval_query_transformation_chain())
+    query_vector = await vector_store.embeddings.aembed_query(query)
+    
+    cached = answer_cache.lookup(query, query_vector)
+    if cached is not None:
+        return cached
+    
+    # Промах: полный RAG с уже трансформированным запросом (без повторной трансформации)
+    result = await _run_rag(messages, query, on_token)
+    answer_cache.store(query, query_vector, result, latency=time.perf_counter() - start)
     return result
 
 def get_vector_store_stats():
@@ -360,5 +445,11 @@ def get_vector_store_stats():
         stats["cross_encoder_model"] = config.CROSS_ENCODER_MODEL
         stats["reranker_top_k"] = config.RERANKER_TOP_K
     
+    # Этап трансформации запроса (пропуски LLM, p50/p95)
+    stats["query_rewrite"] = query_rewrite.get_stats()
+    
+    # Семантический кеш ответов (hit rate, сэкономленное время)
+    stats["answer_cache"] = answer_cache.get_stats()
+    
     return stats
 
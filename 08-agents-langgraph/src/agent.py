@@ -184,10 +184,11 @@ async def agent_answer(messages, chat_id: int):
     
     logger.info(f"🤖 Agent starting for chat {chat_id}...")
     
-    # stream() возвращает каждый шаг агента (для детального логирования)
+    # astream() возвращает каждый шаг агента (для детального логирования)
     # stream_mode="values" - получаем полное состояние на каждом шаге
+    # Async - инструменты (rag_search) выполняются без блокировки event loop
     final_state = None
-    for state in bank_agent.stream(inputs, config=agent_config, stream_mode="values"):
+    async for state in bank_agent.astream(inputs, config=agent_config, stream_mode="values"):
         final_state = state
         _log_agent_step(state["messages"][-1])
     
@@ -66,7 +66,8 @@ async def main():
     logger.info("-" * 70)
     
     # Индексация документов при старте
-    # Загружаем PDF и JSON, создаем chunks, генерируем embeddings, сохраняем в FAISS
+    # Если документы не изменились - индекс загружается с диска (INDEX_DIR) без embeddings,
+    # иначе загружаем PDF и JSON, создаем chunks, генерируем embeddings и сохраняем индекс
     logger.info("📚 Starting indexing...")
     result = await indexer.reindex_all()
     if result and result[0] is not None:
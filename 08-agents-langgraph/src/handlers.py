@@ -107,7 +107,8 @@ async def cmd_index(message: Message):
     await message.answer("Начинаю переиндексацию документов...")
     
     try:
-        result = await indexer.reindex_all()
+        # /index - явный запрос на полную переиндексацию, игнорируем сохраненный индекс
+        result = await indexer.reindex_all(force=True)
         if result and result[0] is not None:
             rag.vector_store, rag.chunks = result
             rag.initialize_retriever()
@@ -0,0 +1,210 @@
+"""
+Персистентное хранение векторного индекса на диске
+
+Формат индекса (директория INDEX_DIR):
+- manifest.json   - версия формата, хеши исходных файлов, модель embeddings, параметры splitter,
+                    SHA-256 файлов chunks.jsonl и embeddings.npy
+- chunks.jsonl    - чанки (id, текст, метаданные), по одному JSON объекту на строку
+- embeddings.npy  - матрица embeddings float32 (строка i соответствует строке i в chunks.jsonl)
+
+При старте бота индекс загружается с диска, если манифест совпадает с текущими
+исходными файлами и настройками; иначе выполняется полная переиндексация.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Версия формата индекса (увеличиваем при несовместимых изменениях)
+INDEX_FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+# JSON с Q&A парами справочного центра
+JSON_DOCUMENTS_FILE = "sberbank_help_documents.json"
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 содержимого файла (читаем блоками, чтобы не грузить PDF целиком)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_source_files(data_dir: str) -> list:
+    """Список исходных файлов для индексации (PDF + JSON) в стабильном порядке"""
+    data_path = Path(data_dir)
+    if not data_path.exists():
+        return []
+
+    files = sorted(data_path.glob("*.pdf"))
+    json_file = data_path / JSON_DOCUMENTS_FILE
+    if json_file.exists():
+        files.append(json_file)
+    return files
+
+
+def build_manifest(source_files: list, embedding: dict) -> dict:
+    """
+    Манифест текущего состояния исходных данных и настроек
+
+    Сравнение сохраненного манифеста с текущим позволяет понять,
+    можно ли переиспользовать индекс без повторного embedding.
+
+    Args:
+        source_files: исходные файлы из get_source_files()
+        embedding: параметры embeddings, от которых зависят векторы (провайдер, модель)
+    """
+    return {
+        "version": INDEX_FORMAT_VERSION,
+        "sources": {path.name: file_sha256(path) for path in source_files},
+        "embedding": embedding,
+        "splitter": {
+            "chunk_size": config.CHUNK_SIZE,
+            "chunk_overlap": config.CHUNK_OVERLAP,
+        },
+    }
+
+
+def is_manifest_fresh(saved: dict, current: dict) -> bool:
+    """Индекс актуален, если совпадают версия, исходные файлы и настройки"""
+    return all(
+        saved.get(key) == current.get(key)
+        for key in ("version", "sources", "embedding", "splitter")
+    )
+
+
+def _write_atomic(path: Path, write_fn) -> str:
+    """Запись во временный файл с последующим rename (без полузаписанных файлов)
+
+    Returns:
+        str: SHA-256 записанного файла
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    write_fn(tmp_path)
+    digest = file_sha256(tmp_path)
+    os.replace(tmp_path, path)
+    return digest
+
+
+def save_index(index_dir: str, manifest: dict, entries: list, vectors):
+    """
+    Сохранение индекса на диск
+
+    Args:
+        index_dir: директория индекса
+        manifest: манифест из build_manifest()
+        entries: список dict с ключами id, text, metadata
+        vectors: матрица embeddings (len(entries) x dim)
+    """
+    index_path = Path(index_dir)
+    index_path.mkdir(parents=True, exist_ok=True)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.shape[0] != len(entries):
+        raise ValueError(f"Embeddings count {matrix.shape[0]} != chunks count {len(entries)}")
+
+    def write_chunks(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def write_embeddings(path):
+        with open(path, 'wb') as f:
+            np.save(f, matrix)
+
+    checksums = {}
+
+    def write_manifest(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    **manifest,
+                    "count": len(entries),
+                    "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                    "checksums": checksums,
+                },
+                f, ensure_ascii=False, indent=2
+            )
+
+    # Манифест пишем последним и с хешами файлов: если процесс упадет между заменами,
+    # load_index увидит несовпадение хешей и не соединит новые чанки со старыми векторами
+    checksums[CHUNKS_FILE] = _write_atomic(index_path / CHUNKS_FILE, write_chunks)
+    checksums[EMBEDDINGS_FILE] = _write_atomic(index_path / EMBEDDINGS_FILE, write_embeddings)
+    _write_atomic(index_path / MANIFEST_FILE, write_manifest)
+
+    logger.info(f"Index saved to {index_path} ({len(entries)} chunks)")
+
+
+def load_manifest(index_dir: str) -> dict | None:
+    """Загрузка сохраненного манифеста (None если индекса нет)"""
+    manifest_path = Path(index_dir) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Failed to read index manifest: {e}")
+        return None
+
+
+def load_index(index_dir: str, current_manifest: dict):
+    """
+    Загрузка индекса с диска, если он актуален
+
+    Args:
+        index_dir: директория индекса
+        current_manifest: манифест текущих исходных файлов и настроек
+
+    Returns:
+        tuple: (entries, vectors) или None если индекс отсутствует, устарел или поврежден
+    """
+    saved_manifest = load_manifest(index_dir)
+    if saved_manifest is None:
+        logger.info("No saved index found")
+        return None
+
+    if not is_manifest_fresh(saved_manifest, current_manifest):
+        logger.info("Saved index is stale (sources or settings changed)")
+        return None
+
+    index_path = Path(index_dir)
+    for name, expected in saved_manifest.get("checksums", {}).items():
+        try:
+            actual = file_sha256(index_path / name)
+        except OSError as e:
+            logger.warning(f"Failed to load saved index: {e}")
+            return None
+        if actual != expected:
+            logger.warning(f"Saved index is inconsistent: {name} does not match the manifest (interrupted save?)")
+            return None
+
+    try:
+        entries = []
+        with open(index_path / CHUNKS_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+        vectors = np.load(index_path / EMBEDDINGS_FILE)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to load saved index: {e}")
+        return None
+
+    if vectors.shape[0] != len(entries):
+        logger.warning(f"Saved index is corrupted: {vectors.shape[0]} vectors for {len(entries)} chunks")
+        return None
+
+    logger.info(f"Loaded index from {index_path} ({len(entries)} chunks)")
+    return entries, vectors
@@ -22,7 +22,7 @@ CURRENCY_RATES = {
 }
 
 @tool
-def rag_search(query: str) -> str:
+async def rag_search(query: str) -> str:
     """
     Ищет информацию в документах Сбербанка (условия кредитов, вкладов и других банковских продуктов).
     
@@ -33,7 +33,8 @@ def rag_search(query: str) -> str:
     """
     try:
         # Получаем релевантные документы через RAG (retrieval + reranking)
-        documents = rag.retrieve_documents(query)
+        # Async версия: поиск не блокирует event loop бота
+        documents = await rag.aretrieve_documents(query)
         
         if not documents:
             return json.dumps({"sources": []}, ensure_ascii=False)
@@ -1,6 +1,8 @@
+import asyncio
 import logging
 from langchain_community.retrievers import BM25Retriever
 from langchain_classic.retrievers import EnsembleRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -11,11 +13,27 @@ retriever = None
 chunks = None  # Для BM25 retriever
 cross_encoder = None  # Для reranking (lazy loading)
 
+class ThreadedVectorStoreRetriever(VectorStoreRetriever):
+    """
+    Semantic retriever, не блокирующий event loop
+
+    InMemoryVectorStore.asimilarity_search асинхронно считает только embedding запроса,
+    а косинусную близость по всем векторам выполняет прямо в event loop.
+    Здесь поиск по вектору вынесен в отдельный поток.
+    """
+
+    async def _aget_relevant_documents(self, query, *, run_manager, **kwargs):
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        return await asyncio.to_thread(
+            self.vectorstore.similarity_search_by_vector, embedding, **(self.search_kwargs | kwargs)
+        )
+
 def create_semantic_retriever():
     """Создание semantic retriever из vector store"""
     if vector_store is None:
         raise ValueError("Vector store not initialized")
-    return vector_store.as_retriever(
+    return ThreadedVectorStoreRetriever(
+        vectorstore=vector_store,
         search_kwargs={'k': config.SEMANTIC_RETRIEVER_K}
     )
 
@@ -151,6 +169,34 @@ def retrieve_documents(query: str):
         # Для semantic и hybrid - прямой вызов retriever
         return retriever.invoke(query)
 
+async def aretrieve_documents(query: str):
+    """
+    Async версия retrieve_documents для инструмента rag_search
+    
+    Retriever вызывается через ainvoke (embedding запроса - асинхронный HTTP вызов),
+    поиск по векторам и CPU-работа cross-encoder выполняются в отдельных потоках.
+    Медленный поиск одного пользователя не блокирует event loop и остальные чаты.
+    
+    Args:
+        query: Поисковый запрос
+    
+    Returns:
+        list[Document]: Список найденных документов
+    """
+    if retriever is None:
+        raise ValueError("Retriever not initialized")
+    
+    mode = config.RETRIEVAL_MODE.lower()
+    
+    if mode == "hybrid_reranker":
+        ensemble_docs = await retriever.ainvoke(query)
+        if not ensemble_docs:
+            return []
+        reranked = await asyncio.to_thread(rerank_documents, query, ensemble_docs, config.RERANKER_TOP_K)
+        return [doc for doc, score in reranked]
+    else:
+        return await retriever.ainvoke(query)
+
 def get_vector_store_stats():
     """Возвращает статистику векторного хранилища с полной информацией о конфигурации"""
     stats = {
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк search_products: прежний полный проход vs индексированный каталог
+
+Генерирует каталог из N продуктов (по образцу data/bank_products.json), затем для набора
+типичных запросов агента сравнивает:
+- прежнюю схему: чтение JSON на каждый вызов + фильтрация списка (list comprehension)
+- только фильтрацию списка (JSON уже в памяти)
+- ProductCatalog: индекс в памяти, bisect и пересечение множеств
+
+Результаты индекса сверяются с полным проходом.
+
+Запуск: make bench (или uv run python benchmark_catalog.py --products 100000)
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from catalog import ProductCatalog
+
+DATA_PATH = Path(__file__).parent / "data" / "bank_products.json"
+LIMIT = 10
+
+EXTRA_WORDS = [
+    "онлайн", "кешбэк", "пополнение", "снятие", "капитализация", "льготный", "ипотека",
+    "бизнес", "премиум", "молодежный", "пенсионный", "доставка", "бесплатно", "мили",
+    "процент", "досрочно", "страховка", "семейный", "цифровой", "накопительный",
+]
+
+QUERIES = [
+    {"product_type": "deposit"},
+    {"product_type": "deposit", "min_rate": 15.0},
+    {"product_type": "credit", "max_amount": 1000000},
+    {"keyword": "кешбэк"},
+    {"product_type": "credit_card", "keyword": "без %"},
+    {"currency": "USD", "min_amount": 1000},
+    {"product_type": "deposit", "currency": "RUB", "min_amount": 50000, "min_rate": 16.0},
+    {"keyword": "онлайн пополнение", "max_rate": 20.0},
+    {"min_rate": 25.0, "max_rate": 26.0},
+    {"keyword": "несуществующее слово"},
+]
+
+
+def scan_filter(products, product_type=None, keyword=None, min_amount=None, max_amount=None,
+                min_rate=None, max_rate=None, currency=None):
+    """Прежняя реализация filter_products из server.py (полный проход по списку)"""
+    filtered = products
+    if product_type:
+        filtered = [p for p in filtered if p.get('product_type') == product_type]
+    if keyword:
+        keyword_lower = keyword.lower()
+        filtered = [
+            p for p in filtered
+            if keyword_lower in p.get('name', '').lower() or
+               keyword_lower in p.get('description', '').lower()
+        ]
+    if min_amount is not None:
+        filtered = [p for p in filtered if p.get('amount_min', 0) <= min_amount]
+    if max_amount is not None:
+        filtered = [p for p in filtered if p.get('amount_max', float('inf')) >= max_amount]
+    if min_rate is not None:
+        filtered = [p for p in filtered if p.get('rate_max', 0) >= min_rate]
+    if max_rate is not None:
+        filtered = [p for p in filtered if p.get('rate_min', float('inf')) <= max_rate]
+    if currency:
+        filtered = [p for p in filtered if currency in p.get('currency', '')]
+    return filtered
+
+
+def generate_products(count: int, seed: int = 42) -> list[dict]:
+    """Синтетический каталог: реальные продукты со случайными ставками, суммами и словами"""
+    rng = random.Random(seed)
+    with open(DATA_PATH, "r", encoding="utf-8") as f:
+        templates = json.load(f)
+
+    products = []
+    for i in range(count):
+        product = dict(rng.choice(templates))
+        product["id"] = f"{product['id']}_{i}"
+        product["name"] = f"{product['name']} {rng.choice(EXTRA_WORDS)}"
+        product["description"] = f"{product['description']} {' '.join(rng.sample(EXTRA_WORDS, 3))}"
+        if "rate_min" in product:
+            rate_min = round(rng.uniform(0, 30), 1)
+            product["rate_min"] = rate_min
+            product["rate_max"] = round(rate_min + rng.uniform(0, 5), 1)
+        if "amount_min" in product:
+            amount_min = rng.choice([0, 1000, 10000, 50000, 100000, 300000])
+            product["amount_min"] = amount_min
+            product["amount_max"] = amount_min + rng.choice([100000, 1000000, 5000000, 30000000])
+        product["currency"] = rng.choice(["RUB", "RUB", "RUB,USD,EUR", "USD", "EUR", "CNY"])
+        products.append(product)
+    return products
+
+
+def measure(func, repeats: int) -> list[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name: str, times: list[float]):
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print(f"  {name:<28} p50 {statistics.median(times):9.3f} ms   p95 {p95:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark product catalog search")
+    parser.add_argument("--products", type=int, default=100_000, help="Размер каталога")
+    parser.add_argument("--repeats", type=int, default=20, help="Повторов каждого запроса")
+    args = parser.parse_args()
+
+    print(f"📦 Generating {args.products} products...")
+    products = generate_products(args.products)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bank_products.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(products, f, ensure_ascii=False)
+        print(f"   JSON size: {path.stat().st_size / 1024 / 1024:.1f} MB")
+
+        catalog = ProductCatalog(path)
+        start = time.perf_counter()
+        index = catalog.get()
+        print(f"   Catalog load + index build: {(time.perf_counter() - start) * 1000:.0f} ms (once per file change)\n")
+
+        def load_and_scan(query):
+            with open(path, "r", encoding="utf-8") as f:
+                return scan_filter(json.load(f), **query)
+
+        # Прежняя схема слишком медленная для многих повторов
+        old_repeats = max(1, args.repeats // 10)
+        totals = {"load + scan (old)": [], "scan only": [], "catalog index": []}
+
+        for query in QUERIES:
+            expected = scan_filter(products, **query)[:LIMIT]
+            actual = catalog.get().filter(**query, limit=LIMIT)
+            status = "✅" if [p["id"] for p in actual] == [p["id"] for p in expected] else "❌ MISMATCH"
+            print(f"🔎 {query}  ->  {len(scan_filter(products, **query))} matches {status}")
+
+            runs = {
+                "load + scan (old)": measure(lambda: load_and_scan(query)[:LIMIT], old_repeats),
+                "scan only": measure(lambda: scan_filter(index.products, **query)[:LIMIT], args.repeats),
+                "catalog index": measure(lambda: catalog.get().filter(**query, limit=LIMIT), args.repeats),
+            }
+            for name, times in runs.items():
+                report(name, times)
+                totals[name].append(statistics.median(times))
+            print()
+
+        print("📊 Mean of per-query p50:")
+        for name, medians in totals.items():
+            print(f"  {name:<28} {statistics.mean(medians):9.3f} ms")
+        speedup = statistics.mean(totals["scan only"]) / statistics.mean(totals["catalog index"])
+        print(f"\n⚡ Index vs in-memory scan: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Каталог продуктов банка с индексами для search_products
+
+Раньше каждый вызов инструмента заново читал JSON и фильтровал весь список.
+ProductCatalog:
+- загружает JSON один раз и перечитывает только при изменении файла (mtime/size,
+  проверка не чаще CATALOG_RELOAD_CHECK_SECONDS); при ошибке чтения остается прежний каталог
+- хранит индексы:
+  - product_type, currency -> множество номеров продуктов
+  - amount_min, amount_max, rate_min, rate_max -> отсортированные пары (значение, номер) для bisect
+  - слово из названия/описания -> множество номеров продуктов (inverted index)
+- фильтры - bisect и пересечение множеств: сначала самый селективный фильтр,
+  остальные проверяются только для его кандидатов; если все фильтры широкие, каталог
+  просматривается по порядку до первых limit совпадений
+
+Семантика фильтров совпадает с прежней filter_products (в т.ч. поиск keyword как подстроки).
+"""
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from pathlib import Path
+
+logger = logging.getLogger("mcp-bank-agent")
+
+CATALOG_RELOAD_CHECK_SECONDS = float(os.getenv("CATALOG_RELOAD_CHECK_SECONDS", "1.0"))
+
+WORD_RE = re.compile(r"\w+")
+
+INF = float("inf")
+
+
+def _words(text: str) -> set[str]:
+    return set(WORD_RE.findall(text.lower()))
+
+
+class ProductIndex:
+    """Неизменяемый индекс над списком продуктов (порядок продуктов сохраняется)"""
+
+    def __init__(self, products: list[dict]):
+        self.products = products
+        self.size = len(products)
+
+        self.by_type: dict[str, set[int]] = {}
+        self.by_currency: dict[str, set[int]] = {}
+        self.by_word: dict[str, set[int]] = {}
+        # Колонки с теми же значениями по умолчанию, что в прежних фильтрах
+        self.amount_min = [p.get("amount_min", 0) for p in products]
+        self.amount_max = [p.get("amount_max", INF) for p in products]
+        self.rate_min = [p.get("rate_min", INF) for p in products]
+        self.rate_max = [p.get("rate_max", 0) for p in products]
+        # Текст для проверки keyword как подстроки
+        self.text = [
+            (p.get("name", "").lower(), p.get("description", "").lower()) for p in products
+        ]
+
+        for i, product in enumerate(products):
+            self.by_type.setdefault(product.get("product_type"), set()).add(i)
+            for currency in product.get("currency", "").split(","):
+                self.by_currency.setdefault(currency.strip(), set()).add(i)
+            name, description = self.text[i]
+            for word in _words(name) | _words(description):
+                self.by_word.setdefault(word, set()).add(i)
+
+        self.vocabulary = sorted(self.by_word)
+        self._sorted = {
+            column: sorted((value, i) for i, value in enumerate(getattr(self, column)))
+            for column in ("amount_min", "amount_max", "rate_min", "rate_max")
+        }
+        self._sorted_values = {column: [value for value, _ in pairs] for column, pairs in self._sorted.items()}
+
+    # ---------- Кандидаты по отдельным фильтрам ----------
+
+    def _at_most(self, column: str, bound) -> tuple[int, callable]:
+        """Продукты с column <= bound: (число, функция получения множества)"""
+        end = bisect_right(self._sorted_values[column], bound)
+        return end, lambda: {i for _, i in self._sorted[column][:end]}
+
+    def _at_least(self, column: str, bound) -> tuple[int, callable]:
+        """Продукты с column >= bound: (число, функция получения множества)"""
+        start = bisect_left(self._sorted_values[column], bound)
+        return self.size - start, lambda: {i for _, i in self._sorted[column][start:]}
+
+    def _keyword_candidates(self, keyword: str) -> set[int] | None:
+        """
+        Продукты, у которых каждое слово keyword входит в какое-то слово названия/описания
+
+        Это надмножество точного совпадения подстроки - точная проверка выполняется потом
+        только для кандидатов. None - в keyword нет слов (индекс не помогает).
+        """
+        words = WORD_RE.findall(keyword)
+        if not words:
+            return None
+        candidates = None
+        # Длинные слова обычно реже - начинаем с них
+        for word in sorted(words, key=len, reverse=True):
+            matched = set()
+            for token in self.vocabulary:
+                if word in token:
+                    matched |= self.by_word[token]
+            candidates = matched if candidates is None else candidates & matched
+            if not candidates:
+                return set()
+        return candidates
+
+    # ---------- Поиск ----------
+
+    def filter(
+        self,
+        product_type: str | None = None,
+        keyword: str | None = None,
+        min_amount: int | None = None,
+        max_amount: int | None = None,
+        min_rate: float | None = None,
+        max_rate: float | None = None,
+        currency: str | None = None,
+        limit: int | None = None,
+    ) -> list[dict]:
+        """Продукты, подходящие под все фильтры, в исходном порядке каталога"""
+        # (размер, получение множества кандидатов, проверка одного продукта)
+        filters = []
+        if product_type:
+            ids = self.by_type.get(product_type, set())
+            filters.append((len(ids), lambda ids=ids: ids, lambda i, ids=ids: i in ids))
+        if currency:
+            ids = self._currency_ids(currency)
+            filters.append((len(ids), lambda ids=ids: ids, lambda i, ids=ids: i in ids))
+        if min_amount is not None:
+            size, get = self._at_most("amount_min", min_amount)
+            filters.append((size, get, lambda i: self.amount_min[i] <= min_amount))
+        if max_amount is not None:
+            size, get = self._at_least("amount_max", max_amount)
+            filters.append((size, get, lambda i: self.amount_max[i] >= max_amount))
+        if min_rate is not None:
+            size, get = self._at_least("rate_max", min_rate)
+            filters.append((size, get, lambda i: self.rate_max[i] >= min_rate))
+        if max_rate is not None:
+            size, get = self._at_most("rate_min", max_rate)
+            filters.append((size, get, lambda i: self.rate_min[i] <= max_rate))
+
+        keyword_lower = keyword.lower() if keyword else None
+        if keyword_lower:
+            ids = self._keyword_candidates(keyword_lower)
+            if ids is not None:
+                filters.append((len(ids), lambda ids=ids: ids, lambda i, ids=ids: i in ids))
+
+        filters.sort(key=lambda f: f[0])
+        exact = []
+        if keyword_lower:
+            # Точная проверка подстроки (слова keyword могут стоять в тексте не подряд)
+            exact.append(lambda i: keyword_lower in self.text[i][0] or keyword_lower in self.text[i][1])
+
+        if not filters:
+            matched = (i for i in range(self.size) if all(check(i) for check in exact))
+            return [self.products[i] for i in islice(matched, limit)]
+
+        smallest, get_candidates, _ = filters[0]
+        result = []
+        scanned = 0
+        if limit is not None and smallest * smallest > limit * self.size:
+            # Фильтры не селективны: проход в порядке каталога до первых limit совпадений
+            # (ожидаемо ~limit * size / smallest проверок) дешевле, чем собирать множество кандидатов.
+            # Если совпадения все же редкие (фильтры коррелируют), после smallest проверок
+            # переходим к множеству кандидатов
+            checks = [check for _, _, check in filters] + exact
+            while scanned < self.size and len(result) < limit and scanned < smallest:
+                if all(check(scanned) for check in checks):
+                    result.append(scanned)
+                scanned += 1
+            if len(result) >= limit or scanned >= self.size:
+                return [self.products[i] for i in result]
+
+        checks = [check for _, _, check in filters[1:]] + exact
+        matched = (i for i in get_candidates() if i >= scanned and all(check(i) for check in checks))
+        # Первые limit в порядке каталога - без сортировки всех найденных
+        if limit is None:
+            result = sorted(matched)
+        else:
+            result += heapq.nsmallest(limit - len(result), matched)
+        return [self.products[i] for i in result]
+
+    def _currency_ids(self, currency: str) -> set[int]:
+        """Валюта как подстрока поля currency (как в прежнем фильтре): точные значения + редкие частичные"""
+        ids = set(self.by_currency.get(currency, set()))
+        for value, value_ids in self.by_currency.items():
+            if value != currency and currency in value:
+                ids |= value_ids
+        return ids
+
+
+class ProductCatalog:
+    """Каталог из JSON файла с перезагрузкой при изменении файла"""
+
+    def __init__(self, path: Path, check_interval: float = CATALOG_RELOAD_CHECK_SECONDS):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._index = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload(self, signature):
+        start = time.perf_counter()
+        with open(self.path, "r", encoding="utf-8") as f:
+            products = json.load(f)
+        self._index = ProductIndex(products)
+        self._signature = signature
+        logger.info(
+            f"Loaded {len(products)} products from database, "
+            f"index built in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    def get(self) -> ProductIndex | None:
+        """Актуальный индекс (None - базу продуктов не удалось загрузить)"""
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self.check_interval:
+            return self._index
+
+        with self._lock:
+            self._checked_at = now
+            try:
+                signature = self._file_signature()
+                if signature != self._signature:
+                    self._reload(signature)
+            except FileNotFoundError:
+                logger.error(f"Products database not found at {self.path}")
+            except Exception as e:
+                # Файл в процессе записи или поврежден - продолжаем с прежним каталогом
+                logger.error(f"Error loading products: {e}")
+        return self._index
@@ -0,0 +1,159 @@
+"""
+Курсы валют ЦБ РФ для currency_converter
+
+Раньше каждый вызов инструмента делал блокирующий requests.get внутри async tool:
+event loop сервера стоял до ответа API, а при недоступности API конвертация не работала.
+RateProvider:
+- async запросы через один httpx.AsyncClient (пул соединений)
+- курсы в памяти на RATES_TTL_SECONDS; после истечения TTL возвращаются сразу,
+  а обновление идет в фоне (stale-while-revalidate), одновременно не более одного запроса
+- последние успешно полученные курсы сохраняются на диск (RATES_SNAPSHOT_PATH)
+  и используются после перезапуска и при недоступности API
+- блокирующее ожидание API только при холодном старте без snapshot
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import httpx
+
+logger = logging.getLogger("mcp-bank-agent")
+
+RATES_TTL_SECONDS = float(os.getenv("RATES_TTL_SECONDS", "3600"))
+RATES_TIMEOUT_SECONDS = float(os.getenv("RATES_TIMEOUT_SECONDS", "5"))
+# Пауза перед повторным запросом после ошибки (чтобы не нагружать недоступный API)
+RATES_RETRY_SECONDS = float(os.getenv("RATES_RETRY_SECONDS", "60"))
+# Курсы старше - помечаются в ответе как устаревшие
+RATES_MAX_AGE_HOURS = float(os.getenv("RATES_MAX_AGE_HOURS", "48"))
+RATES_SNAPSHOT_PATH = Path(os.getenv(
+    "RATES_SNAPSHOT_PATH", str(Path(__file__).parent / "storage" / "rates_snapshot.json")
+))
+
+
+class RateProvider:
+    """Кеш курсов с фоновым обновлением и snapshot на диске"""
+
+    def __init__(
+        self,
+        url: str,
+        ttl_seconds: float = RATES_TTL_SECONDS,
+        timeout: float = RATES_TIMEOUT_SECONDS,
+        snapshot_path: Path | None = RATES_SNAPSHOT_PATH,
+    ):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._client = None
+        self._rates: dict = {}
+        self._date = None           # дата курсов по данным ЦБ
+        self._fetched_at = 0.0      # unix время получения
+        self._snapshot_loaded = False
+        self._refresh_task = None
+        self._retry_at = 0.0
+
+    # ---------- HTTP ----------
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def _fetch(self):
+        """Запрос к API ЦБ; при ошибке остаются прежние курсы"""
+        start = time.perf_counter()
+        try:
+            response = await self._get_client().get(self.url)
+            response.raise_for_status()
+            data = response.json()
+            rates = data.get('rates', {})
+            if not rates:
+                raise ValueError("empty rates in response")
+        except Exception as e:
+            self._retry_at = time.monotonic() + RATES_RETRY_SECONDS
+            logger.error(f"Error fetching exchange rates: {e}")
+            return
+
+        self._rates = rates
+        self._date = data.get('date')
+        self._fetched_at = time.time()
+        logger.info(
+            f"Exchange rates updated: {len(rates)} currencies, date {self._date} "
+            f"({(time.perf_counter() - start) * 1000:.0f} ms)"
+        )
+        await asyncio.to_thread(self._save_snapshot)
+
+    def _refresh(self) -> asyncio.Task:
+        """Единственная задача обновления (повторные вызовы ждут ту же)"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return self._refresh_task
+
+    # ---------- Snapshot ----------
+
+    def _save_snapshot(self):
+        if self.snapshot_path is None:
+            return
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.snapshot_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"rates": self._rates, "date": self._date, "fetched_at": self._fetched_at}, f)
+            # Атомарная замена - при сбое на диске остается прежний snapshot
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logger.warning(f"Failed to save exchange rates snapshot: {e}")
+
+    def _load_snapshot(self):
+        self._snapshot_loaded = True
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._rates = data.get("rates", {})
+            self._date = data.get("date")
+            self._fetched_at = data.get("fetched_at", 0.0)
+            logger.info(f"Exchange rates loaded from snapshot: date {self._date}")
+        except Exception as e:
+            logger.warning(f"Failed to load exchange rates snapshot: {e}")
+
+    # ---------- Публичный API ----------
+
+    async def get_rates(self) -> dict:
+        """
+        Курсы относительно рубля (base: RUB)
+
+        Returns:
+            dict: {"USD": 0.0124, ...}; пустой dict - курсы не удалось получить ни разу
+        """
+        if not self._snapshot_loaded:
+            self._load_snapshot()
+
+        if not self._rates:
+            # Холодный старт без snapshot - ждем API (shield: отмена вызова не отменяет общий запрос)
+            await asyncio.shield(self._refresh())
+        elif self.age_seconds() >= self.ttl_seconds:
+            # Устаревшие курсы отдаем сразу, обновляем в фоне
+            if time.monotonic() >= self._retry_at:
+                self._refresh()
+        return self._rates
+
+    def age_seconds(self) -> float:
+        """Возраст курсов в секундах"""
+        return time.time() - self._fetched_at
+
+    def is_outdated(self) -> bool:
+        """Курсы старше RATES_MAX_AGE_HOURS (API долго недоступен)"""
+        return bool(self._rates) and self.age_seconds() > RATES_MAX_AGE_HOURS * 3600
+
+    @property
+    def date(self) -> str | None:
+        return self._date
+
@@ -9,16 +9,17 @@ Bank Agent MCP Server
 Транспорт: streamable-http (HTTP MCP server)
 Порт: 8000 (по умолчанию для FastMCP)
 """
-import json
 import logging
 import os
 from pathlib import Path
 from typing import Annotated, Literal
-import requests
 from pydantic import Field
 
 from mcp.server.fastmcp import FastMCP
 
+from catalog import ProductCatalog
+from rates import RateProvider
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("mcp-bank-agent")
@@ -26,81 +27,24 @@ logger = logging.getLogger("mcp-bank-agent")
 # Path to the products database
 PRODUCTS_DB_PATH = Path(__file__).parent / "data" / "bank_products.json"
 
-# CBR API endpoint
-CBR_API_URL = "https://www.cbr-xml-daily.ru/latest.js"
+# CBR API endpoint (переопределяется для локального stub сервера)
+CBR_API_URL = os.getenv("CBR_API_URL", "https://www.cbr-xml-daily.ru/latest.js")
 
 # Mock номер карты для демонстрации (константа)
 MOCK_CARD_NUMBER = "5105-1051-0510-5100"
 
 
-def load_products() -> list[dict]:
-    """Загрузка продуктов банка из JSON файла."""
-    try:
-        if not PRODUCTS_DB_PATH.exists():
-            logger.error(f"Products database not found at {PRODUCTS_DB_PATH}")
-            return []
-        
-        with open(PRODUCTS_DB_PATH, 'r', encoding='utf-8') as f:
-            products = json.load(f)
-        
-        logger.info(f"Loaded {len(products)} products from database")
-        return products
-    except Exception as e:
-        logger.error(f"Error loading products: {e}")
-        return []
-
-
-def filter_products(
-    products: list[dict],
-    product_type: str | None = None,
-    keyword: str | None = None,
-    min_amount: int | None = None,
-    max_amount: int | None = None,
-    min_rate: float | None = None,
-    max_rate: float | None = None,
-    currency: str | None = None
-) -> list[dict]:
-    """
-    Фильтрация продуктов по параметрам
-    
-    Использует list comprehension для простоты (следуя принципу KISS).
-    """
-    filtered = products
-    
-    # Фильтр по типу продукта
-    if product_type:
-        filtered = [p for p in filtered if p.get('product_type') == product_type]
-    
-    # Поиск по ключевому слову (в названии и описании)
-    if keyword:
-        keyword_lower = keyword.lower()
-        filtered = [
-            p for p in filtered
-            if keyword_lower in p.get('name', '').lower() or 
-               keyword_lower in p.get('description', '').lower()
-        ]
-    
-    # Фильтр по минимальной сумме
-    if min_amount is not None:
-        filtered = [p for p in filtered if p.get('amount_min', 0) <= min_amount]
-    
-    # Фильтр по максимальной сумме
-    if max_amount is not None:
-        filtered = [p for p in filtered if p.get('amount_max', float('inf')) >= max_amount]
-    
-    # Фильтр по минимальной ставке
-    if min_rate is not None:
-        filtered = [p for p in filtered if p.get('rate_max', 0) >= min_rate]
-    
-    # Фильтр по максимальной ставке
-    if max_rate is not None:
-        filtered = [p for p in filtered if p.get('rate_min', float('inf')) <= max_rate]
-    
-    # Фильтр по валюте
-    if currency:
-        filtered = [p for p in filtered if currency in p.get('currency', '')]
-    
-    return filtered
+# Каталог продуктов: загружается один раз, перечитывается при изменении файла, с индексами для фильтров
+catalog = ProductCatalog(PRODUCTS_DB_PATH)
+
+# Курсы ЦБ: async запросы, кеш в памяти с фоновым обновлением, snapshot на диске
+rate_provider = RateProvider(CBR_API_URL)
+
+# Сколько продуктов search_products возвращает агенту
+SEARCH_RESULTS_LIMIT = 10
+
+# Максимум сценариев в одном вызове deposit_comparison (таблица для LLM не должна быть огромной)
+DEPOSIT_COMPARISON_MAX_SCENARIOS = 60
 
 
 def format_products(products: list[dict], limit: int = 10) -> str:
@@ -154,23 +98,6 @@ def format_products(products: list[dict], limit: int = 10) -> str:
     return result
 
 
-def get_exchange_rates() -> dict:
-    """
-    Получение курсов валют от ЦБ РФ
-    
-    API возвращает курсы относительно рубля (base: RUB).
-    Например: {"USD": 0.0124} означает 1 RUB = 0.0124 USD (или 1 USD ≈ 80.6 RUB)
-    """
-    try:
-        response = requests.get(CBR_API_URL, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('rates', {})
-    except requests.RequestException as e:
-        logger.error(f"Error fetching exchange rates: {e}")
-        return {}
-
-
 def convert_currency(
     from_currency: str,
     to_currency: str,
@@ -264,53 +191,61 @@ def calculate_compound_interest(
     amount: float,
     rate: float,
     term_months: int,
-    capitalization_months: int = 1
+    capitalization_months: int = 1,
+    detailed: bool = True
 ) -> tuple[float, float, list]:
     """
     Расчет сложного процента с капитализацией
     
     Логика: начисляем проценты каждые capitalization_months месяцев
-    и добавляем их к основной сумме для следующего периода
+    и добавляем их к основной сумме для следующего периода.
+    Итог считается по формуле без цикла:
+    итог = сумма * (1 + ставка * период / 12) ^ число_периодов * (1 + ставка * остаток / 12)
     
     Args:
         amount: начальная сумма
         rate: годовая ставка в процентах
         term_months: срок вклада в месяцах
         capitalization_months: период капитализации (1, 3, 6, 12)
+        detailed: строить разбивку по периодам
     
     Returns:
-        (income, total, breakdown) - доход, итоговая сумма, помесячная разбивка
+        (income, total, breakdown) - доход, итоговая сумма, разбивка по периодам
+        (пустая, если detailed=False)
     """
-    current_amount = amount
-    breakdown = []
-    
-    # Начисляем проценты пошагово
     periods = term_months // capitalization_months
     remaining_months = term_months % capitalization_months
+    period_factor = 1 + (rate / 100) * (capitalization_months / 12)
+    remaining_factor = 1 + (rate / 100) * (remaining_months / 12)
+    
+    total = amount * period_factor ** periods * remaining_factor
+    
+    breakdown = []
+    if detailed:
+        # Разбивка по периодам - только по запросу
+        current_amount = amount
+        for period in range(periods):
+            period_income = current_amount * (period_factor - 1)
+            current_amount += period_income
+            breakdown.append({
+                "period": period + 1,
+                "months": capitalization_months,
+                "income": period_income,
+                "total": current_amount
+            })
+        
+        # Остаток месяцев (если есть)
+        if remaining_months > 0:
+            period_income = current_amount * (remaining_factor - 1)
+            current_amount += period_income
+            breakdown.append({
+                "period": periods + 1,
+                "months": remaining_months,
+                "income": period_income,
+                "total": current_amount
+            })
     
-    for period in range(periods):
-        period_income = current_amount * (rate / 100) * (capitalization_months / 12)
-        current_amount += period_income
-        breakdown.append({
-            "period": period + 1,
-            "months": capitalization_months,
-            "income": period_income,
-            "total": current_amount
-        })
-    
-    # Остаток месяцев (если есть)
-    if remaining_months > 0:
-        period_income = current_amount * (rate / 100) * (remaining_months / 12)
-        current_amount += period_income
-        breakdown.append({
-            "period": periods + 1,
-            "months": remaining_months,
-            "income": period_income,
-            "total": current_amount
-        })
-    
-    total_income = current_amount - amount
-    return total_income, current_amount, breakdown
+    return total - amount, total, breakdown
 
 
 def calculate_tax(income: float) -> float:
@@ -383,8 +318,90 @@ def format_deposit_calculation(
     return result
 
 
+def calculate_deposit_grid(
+    amounts: list[float],
+    rates: list[float],
+    terms_months: list[int],
+    capitalization_options: list[int],
+    include_tax: bool = False
+) -> list[dict]:
+    """
+    Расчет всех сочетаний параметров вклада (без разбивки по периодам)
+    
+    Args:
+        amounts: суммы вклада
+        rates: годовые ставки
+        terms_months: сроки в месяцах
+        capitalization_options: 0 - без капитализации, 1/3/6/12 - период капитализации
+        include_tax: учитывать НДФЛ
+    
+    Returns:
+        список сценариев с доходом, налогом и итоговой суммой
+    """
+    scenarios = []
+    for amount in amounts:
+        for rate in rates:
+            for term_months in terms_months:
+                for capitalization in capitalization_options:
+                    if capitalization:
+                        income, total, _ = calculate_compound_interest(
+                            amount, rate, term_months, capitalization, detailed=False
+                        )
+                    else:
+                        income, total = calculate_simple_interest(amount, rate, term_months)
+                    tax = calculate_tax(income) if include_tax else 0.0
+                    scenarios.append({
+                        "amount": amount,
+                        "rate": rate,
+                        "term_months": term_months,
+                        "capitalization_months": capitalization,
+                        "income": income,
+                        "tax": tax,
+                        "total": total - tax,
+                    })
+    return scenarios
+
+
+def format_deposit_comparison(scenarios: list[dict], detailed: bool = False) -> str:
+    """
+    Таблица сравнения сценариев вклада для агента
+    
+    Сценарии сортируются по чистому доходу. При detailed=True для лучшего сценария
+    с капитализацией добавляется разбивка по периодам.
+    """
+    scenarios = sorted(scenarios, key=lambda s: s["income"] - s["tax"], reverse=True)
+    show_tax = any(s["tax"] > 0 for s in scenarios)
+    
+    result = f"**Сравнение вариантов вклада ({len(scenarios)} сценариев)**\n\n"
+    header = "| # | Сумма | Ставка | Срок | Капитализация | Доход |"
+    if show_tax:
+        header += " Налог | Чистый доход |"
+    header += " Итоговая сумма |"
+    result += header + "\n" + "|" + "---|" * (header.count("|") - 1) + "\n"
+    
+    for i, s in enumerate(scenarios, 1):
+        capitalization = f"{s['capitalization_months']} мес." if s["capitalization_months"] else "нет"
+        row = (f"| {i} | {s['amount']:,.0f}₽ | {s['rate']}% | {s['term_months']} мес. | "
+               f"{capitalization} | {s['income']:,.2f}₽ |")
+        if show_tax:
+            row += f" {s['tax']:,.2f}₽ | {s['income'] - s['tax']:,.2f}₽ |"
+        row += f" {s['total']:,.2f}₽ |"
+        result += row + "\n"
+    
+    best = scenarios[0]
+    if detailed and best["capitalization_months"]:
+        _, _, breakdown = calculate_compound_interest(
+            best["amount"], best["rate"], best["term_months"], best["capitalization_months"]
+        )
+        result += f"\n**Разбивка по периодам для варианта 1:**\n"
+        for b in breakdown:
+            result += f"Период {b['period']} ({b['months']} мес.): +{b['income']:,.2f}₽ = {b['total']:,.2f}₽\n"
+    
+    return result
+
+
 # Create FastMCP server
-mcp = FastMCP("mcp-bank-agent", dependencies=["requests>=2.31.0"])
+mcp = FastMCP("mcp-bank-agent", dependencies=["httpx>=0.27.0"])
 
 
 @mcp.tool(
@@ -469,25 +486,25 @@ async def search_products(
     logger.info(f"search_products called with: type={product_type}, keyword={keyword}, "
                 f"amount={min_amount}-{max_amount}, rate={min_rate}-{max_rate}, currency={currency}")
     
-    # Загружаем продукты
-    products = load_products()
-    if not products:
+    # Каталог из памяти (файл перечитывается только при изменении)
+    index = catalog.get()
+    if index is None or not index.size:
         return "Не удалось загрузить базу продуктов банка"
     
-    # Фильтруем
-    filtered = filter_products(
-        products,
+    # Фильтруем по индексам
+    filtered = index.filter(
         product_type=product_type,
         keyword=keyword,
         min_amount=min_amount,
         max_amount=max_amount,
         min_rate=min_rate,
         max_rate=max_rate,
-        currency=currency
+        currency=currency,
+        limit=SEARCH_RESULTS_LIMIT
     )
     
     # Форматируем результат
-    return format_products(filtered)
+    return format_products(filtered, limit=SEARCH_RESULTS_LIMIT)
 
 
 @mcp.tool(
@@ -532,8 +549,8 @@ async def currency_converter(
     """
     logger.info(f"currency_converter called: {amount} {from_currency} -> {to_currency}")
     
-    # Получаем актуальные курсы
-    rates = get_exchange_rates()
+    # Курсы из кеша (API ЦБ вызывается в фоне после истечения TTL)
+    rates = await rate_provider.get_rates()
     
     # Конвертируем
     converted_amount, result_str = convert_currency(from_currency, to_currency, amount, rates)
@@ -541,12 +558,15 @@ async def currency_converter(
     if converted_amount is None:
         return result_str  # Сообщение об ошибке
     
+    if rate_provider.is_outdated():
+        result_str += f"\n\n⚠️ API ЦБ РФ недоступен, использованы последние полученные курсы (на {rate_provider.date})"
+    
     return result_str
 
 
 @mcp.tool(
     name="deposit_income_calculator",
-    description="Расчет доходности по вкладу с учетом простого или сложного процента и опциональных налогов",
+    description="Расчет доходности по вкладу с учетом простого или сложного процента и опциональных налогов. Для сравнения нескольких вариантов используй deposit_comparison",
 )
 async def deposit_income_calculator(
     amount: Annotated[
@@ -612,7 +632,7 @@ async def deposit_income_calculator(
         breakdown = None
     else:  # compound
         income, total, breakdown = calculate_compound_interest(
-            amount, rate, term_months, capitalization_months
+            amount, rate, term_months, capitalization_months, detailed
         )
     
     # Налоги
@@ -630,6 +650,71 @@ async def deposit_income_calculator(
     return result
 
 
+@mcp.tool(
+    name="deposit_comparison",
+    description="Сравнение нескольких вариантов вклада за один вызов: все сочетания сумм, ставок, сроков и капитализации в одной таблице",
+)
+async def deposit_comparison(
+    amounts: Annotated[
+        list[Annotated[float, Field(ge=1000)]],
+        Field(description="Суммы вклада в рублях", min_length=1, examples=[[500000], [100000, 500000]])
+    ],
+    rates: Annotated[
+        list[Annotated[float, Field(ge=0.1, le=100)]],
+        Field(description="Процентные ставки годовых", min_length=1, examples=[[15.0, 16.5, 18.0]])
+    ],
+    terms_months: Annotated[
+        list[Annotated[int, Field(ge=1, le=120)]],
+        Field(description="Сроки вклада в месяцах", min_length=1, examples=[[6, 12, 24]])
+    ],
+    capitalization_months: Annotated[
+        list[Literal[0, 1, 3, 6, 12]],
+        Field(description="Варианты капитализации: 0 - без капитализации, 1/3/6/12 - период в месяцах")
+    ] = [0, 1],
+    include_tax: Annotated[
+        bool,
+        Field(description="Учитывать НДФЛ 13% на доход свыше 150,000₽")
+    ] = False,
+    detailed: Annotated[
+        bool,
+        Field(description="Добавить разбивку по периодам для лучшего варианта")
+    ] = False
+) -> str:
+    """
+    Сравнение вариантов вклада
+    
+    Вместо нескольких вызовов deposit_income_calculator подряд (каждый - отдельный
+    MCP запрос и шаг LLM) считает все сочетания параметров за один вызов.
+    Сложный процент считается по формуле, разбивка по периодам - только при detailed.
+    
+    Args:
+        amounts: Суммы вклада
+        rates: Процентные ставки годовых
+        terms_months: Сроки вклада в месяцах
+        capitalization_months: Варианты капитализации (0 - простой процент)
+        include_tax: Учитывать налоги
+        detailed: Разбивка по периодам для лучшего варианта
+    
+    Returns:
+        Таблица сценариев, отсортированная по чистому доходу
+    """
+    logger.info(f"deposit_comparison called: amounts={amounts}, rates={rates}, "
+                f"terms={terms_months}, capitalization={capitalization_months}, tax={include_tax}")
+    
+    # Повторяющиеся значения не дают новых сценариев
+    amounts, rates = list(dict.fromkeys(amounts)), list(dict.fromkeys(rates))
+    terms_months = list(dict.fromkeys(terms_months))
+    capitalization_months = list(dict.fromkeys(capitalization_months)) or [0]
+    
+    count = len(amounts) * len(rates) * len(terms_months) * len(capitalization_months)
+    if count > DEPOSIT_COMPARISON_MAX_SCENARIOS:
+        return (f"Слишком много сочетаний параметров ({count}). "
+                f"Сократите списки: не более {DEPOSIT_COMPARISON_MAX_SCENARIOS} сценариев за вызов.")
+    
+    scenarios = calculate_deposit_grid(amounts, rates, terms_months, capitalization_months, include_tax)
+    return format_deposit_comparison(scenarios, detailed)
+
+
 @mcp.tool(
     name="open_credit_card",
     description="Открытие новой дебетовой или кредитной карты для клиента",
@@ -0,0 +1,176 @@
+"""
+Тесты RateProvider на локальном stub сервере API ЦБ
+
+Stub - http.server в отдельном потоке: ответ, код и задержку задает тест,
+счетчик requests показывает, сколько раз провайдер реально обращался к API.
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import rates
+from rates import RateProvider
+
+RATES_V1 = {"USD": 0.0125, "EUR": 0.0108}
+RATES_V2 = {"USD": 0.0111, "EUR": 0.0099}
+
+
+class StubCbr:
+    """Управляемый stub API курсов"""
+
+    def __init__(self):
+        self.status = 200
+        self.delay = 0.0
+        self.payload = {"date": "2025-01-01", "rates": RATES_V1}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                body = json.dumps(stub.payload).encode() if stub.status == 200 else b"error"
+                try:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент ушел по таймауту
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def stub():
+    cbr = StubCbr()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), cbr.handler())
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    cbr.url = f"http://127.0.0.1:{server.server_address[1]}/latest.js"
+    yield cbr
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+async def make_provider(stub, tmp_path):
+    """Фабрика провайдеров на stub сервере со snapshot во временной папке"""
+    providers = []
+
+    def factory(**kwargs):
+        kwargs.setdefault("snapshot_path", tmp_path / "rates_snapshot.json")
+        kwargs.setdefault("timeout", 1.0)
+        provider = RateProvider(stub.url, **kwargs)
+        providers.append(provider)
+        return provider
+
+    yield factory
+    for provider in providers:
+        if provider._refresh_task is not None:
+            await asyncio.gather(provider._refresh_task, return_exceptions=True)
+        if provider._client is not None:
+            await provider._client.aclose()
+
+
+async def test_concurrent_cold_calls_share_one_fetch(stub, make_provider):
+    stub.delay = 0.2
+    provider = make_provider()
+
+    results = await asyncio.gather(*(provider.get_rates() for _ in range(10)))
+
+    assert stub.requests == 1
+    assert all(result == RATES_V1 for result in results)
+
+
+async def test_stale_rates_returned_immediately_and_refreshed_in_background(stub, make_provider):
+    provider = make_provider(ttl_seconds=60)
+    assert await provider.get_rates() == RATES_V1
+
+    # Курсы устарели, API отвечает медленно и уже с новыми курсами
+    provider._fetched_at -= 120
+    stub.delay = 0.5
+    stub.payload = {"date": "2025-01-02", "rates": RATES_V2}
+
+    start = time.perf_counter()
+    assert await provider.get_rates() == RATES_V1
+    assert time.perf_counter() - start < 0.2
+
+    await provider._refresh_task
+    assert stub.requests == 2
+    assert await provider.get_rates() == RATES_V2
+    assert provider.date == "2025-01-02"
+
+
+async def test_snapshot_used_on_upstream_error(stub, make_provider):
+    assert await make_provider().get_rates() == RATES_V1
+
+    # Перезапуск сервера: API отвечает 5xx, курсы берутся из snapshot
+    stub.status = 503
+    provider = make_provider(ttl_seconds=0)
+    assert await provider.get_rates() == RATES_V1
+
+    await provider._refresh_task
+    assert stub.requests == 2
+    assert await provider.get_rates() == RATES_V1
+
+
+async def test_snapshot_used_on_upstream_timeout(stub, make_provider):
+    assert await make_provider().get_rates() == RATES_V1
+
+    stub.delay = 1.0
+    stub.payload = {"date": "2025-01-02", "rates": RATES_V2}
+    provider = make_provider(ttl_seconds=0, timeout=0.2)
+    assert await provider.get_rates() == RATES_V1
+
+    await provider._refresh_task
+    assert await provider.get_rates() == RATES_V1
+    assert provider.date == "2025-01-01"
+
+
+async def test_cold_start_without_snapshot_and_api_returns_empty(stub, make_provider):
+    stub.status = 500
+    provider = make_provider()
+
+    assert await provider.get_rates() == {}
+    assert not provider.is_outdated()
+
+
+async def test_retry_backoff_after_error(stub, make_provider, monkeypatch):
+    monkeypatch.setattr(rates, "RATES_RETRY_SECONDS", 60)
+    provider = make_provider(ttl_seconds=0)
+    assert await provider.get_rates() == RATES_V1
+
+    # Ошибка API: следующий запрос не раньше чем через RATES_RETRY_SECONDS
+    stub.status = 500
+    await provider.get_rates()
+    await provider._refresh_task
+    assert stub.requests == 2
+    assert provider._retry_at > time.monotonic() + 50
+
+    for _ in range(5):
+        assert await provider.get_rates() == RATES_V1
+    assert provider._refresh_task.done()
+    assert stub.requests == 2
+
+    # Пауза прошла - запрос повторяется
+    stub.status = 200
+    provider._retry_at = time.monotonic() - 1
+    await provider.get_rates()
+    await provider._refresh_task
+    assert stub.requests == 3
@@ -20,12 +20,13 @@ from langchain.agents.middleware import (
     # ModelCallLimitMiddleware,  # Временно отключено - требует проверки API
     # ToolCallLimitMiddleware    # Временно отключено - требует проверки API
 )
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import ToolMessage
+from langchain_core.messages import AIMessageChunk, ToolMessage
 from langchain_mcp_adapters.client import MultiServerMCPClient
 
 from config import config
-from tools import rag_search
+from tools import expand_sources, rag_search
+import checkpointer as checkpoints
+import history_middleware
 
 logger = logging.getLogger(__name__)
 
@@ -87,8 +88,9 @@ async def create_bank_agent():
     3. currency_converter - конвертация валют (MCP)
     
     Returns:
-        Скомпилированный агент LangChain 1.0 с MemorySaver для сохранения истории диалогов
+        Скомпилированный агент LangChain 1.0 с checkpointer для сохранения истории диалогов
     """
+    global history_budget
     logger.info("Creating bank agent using create_agent()...")
     
     # Загружаем системный промпт из файла (удобнее редактировать отдельно)
@@ -134,9 +136,12 @@ async def create_bank_agent():
     else:
         logger.info("ℹ️  MCP is disabled (MCP_ENABLED=false), agent will use only rag_search")
     
-    # MemorySaver - сохраняет историю диалога в памяти (для многошагового диалога)
-    # Каждый chat_id получает свою независимую историю
-    checkpointer = MemorySaver()
+    # Checkpointer - сохраняет историю диалога и HITL interrupts (SQLite/Postgres/memory)
+    # Каждый chat_id получает свою независимую историю, старые checkpoints удаляет compaction
+    checkpointer = await checkpoints.get_checkpointer()
+    
+    # Ограничение истории, которую модель получает на каждом шаге
+    history_budget = history_middleware.create_history_middleware()
     
     # create_agent() - API LangChain 1.0
     # Автоматически создает ReAct loop (цикл рассуждения и действий)
@@ -147,6 +152,10 @@ async def create_bank_agent():
         system_prompt=system_prompt,
         checkpointer=checkpointer,
         middleware=[
+            # ✂️ История в запросе к модели: бюджет токенов, без старых результатов rag_search,
+            # старые ходы заменяются summary (состояние агента в checkpointer не меняется)
+            history_budget,
+            
             # 🔒 Layer 1-2: Overflow Protection
             # Защита от переполнения реализована в _run_agent_stream():
             # - Максимум 10 вызовов модели за один запуск
@@ -186,6 +195,8 @@ async def create_bank_agent():
 
 # Глобальный экземпляр агента (создается один раз при старте бота)
 bank_agent = None
+# Middleware ограничения истории (для статистики в /index_status)
+history_budget = None
 
 
 async def initialize_agent():
@@ -241,6 +252,9 @@ def _extract_documents_from_current_request(messages):
     """
     Извлекает documents из всех ToolMessage с rag_search после последнего HumanMessage
     
+    ToolMessage содержит только компактный результат (id чанков и урезанный текст),
+    полные документы восстанавливаются через tools.expand_sources().
+    
     ВАЖНО: Берем только текущий turn (после последнего вопроса пользователя),
     НЕ всю историю диалога! Это нужно для:
     1. Показа источников только для текущего ответа (SHOW_SOURCES)
@@ -268,16 +282,43 @@ def _extract_documents_from_current_request(messages):
         for msg in messages[last_human_idx:]:
             if isinstance(msg, ToolMessage) and msg.name == "rag_search":
                 try:
-                    data = json.loads(msg.content)
-                    sources = data.get("sources", [])
-                    documents.extend(sources)
+                    # Полные тексты берутся из source_store (в prompt - компактный результат)
+                    documents.extend(expand_sources(msg.content))
                 except json.JSONDecodeError:
                     logger.warning("Failed to parse rag_search result as JSON")
     
     return documents
 
 
-async def _run_agent_stream(inputs, agent_config, chat_id: int):
+# Хвост текста из цифр/пробелов/дефисов - возможно, недописанный номер карты
+_TRAILING_DIGITS_RE = re.compile(r'[\d\s-]+$')
+
+
+async def _forward_token(event, stream_state: dict, on_token):
+    """
+    Передача токенов ответа модели в on_token (stream_mode="messages")
+    
+    - учитываются только сообщения узла модели; вызовы инструментов не показываются
+    - новый вызов модели (другой id сообщения) начинает текст заново
+    - номера карт маскируются, недописанный хвост из цифр придерживается до следующих токенов
+    """
+    chunk, metadata = event
+    if metadata.get("langgraph_node") != "model" or not isinstance(chunk, AIMessageChunk):
+        return
+    if chunk.id != stream_state.get("id"):
+        stream_state.update(id=chunk.id, text="", tool_call=False)
+    if chunk.tool_call_chunks:
+        stream_state["tool_call"] = True
+    if stream_state["tool_call"] or not isinstance(chunk.content, str) or not chunk.content:
+        return
+    
+    stream_state["text"] += chunk.content
+    visible = _TRAILING_DIGITS_RE.sub("", stream_state["text"])
+    if visible:
+        await on_token(mask_credit_card_numbers(visible))
+
+
+async def _run_agent_stream(inputs, agent_config, chat_id: int, on_token=None, raise_errors: bool = False):
     """
     Общая функция для обработки agent stream (для agent_answer и agent_resume)
     
@@ -293,6 +334,8 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
         inputs: dict с messages или Command объект для resume
         agent_config: конфигурация агента с thread_id
         chat_id: ID чата для логирования
+        on_token: async callback(текст ответа на данный момент) для потокового вывода
+        raise_errors: пробрасывать исключения вместо текста ошибки в ответе (для evaluation)
     
     Returns:
         dict: {
@@ -320,8 +363,19 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
     # Обработка stream с проверкой на interrupts
     # astream() возвращает каждый шаг агента асинхронно
     # ВАЖНО: используем astream() т.к. MCP инструменты асинхронные
+    # С on_token дополнительно получаем токены модели (stream_mode="messages")
+    stream_mode = ["updates", "messages"] if on_token else "updates"
+    stream_state = {}
+    
     try:
-        async for step in bank_agent.astream(inputs, config=agent_config):
+        async for item in bank_agent.astream(inputs, config=agent_config, stream_mode=stream_mode):
+            if on_token:
+                mode, step = item
+                if mode == "messages":
+                    await _forward_token(step, stream_state, on_token)
+                    continue
+            else:
+                step = item
             step_count += 1
             
             # 🔒 Защита от бесконечных циклов
@@ -391,6 +445,8 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
     except Exception as e:
         error_msg = str(e)
         logger.error(f"❌ Error in agent stream for chat {chat_id}: {error_msg}", exc_info=True)
+        if raise_errors:
+            raise
         
         # Проверяем на ошибку с None/пустыми сообщениями
         if "NoneType" in error_msg or "None" in error_msg or "empty" in error_msg.lower():
@@ -422,7 +478,7 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
     # Получаем полное состояние агента после завершения
     # ВАЖНО: final_state из stream содержит только последнее обновление,
     # но нам нужны ВСЕ сообщения для извлечения documents
-    full_state = bank_agent.get_state(agent_config)
+    full_state = await bank_agent.aget_state(agent_config)
     all_messages = full_state.values["messages"]
     
     # 🔒 Очистка сообщений от None и пустых значений
@@ -473,7 +529,7 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
     }
 
 
-async def agent_answer(messages, chat_id: int):
+async def agent_answer(messages, chat_id: int | str, on_token=None, raise_errors: bool = False):
     """
     Получить ответ от ReAct агента с поддержкой Human-in-the-Loop
     
@@ -484,11 +540,13 @@ async def agent_answer(messages, chat_id: int):
     4. Если инструмент критичный (open_credit_card) - создается interrupt
     5. Формирует финальный ответ на основе контекста
     
-    История диалога сохраняется в MemorySaver по chat_id.
+    История диалога сохраняется в checkpointer по chat_id.
     
     Args:
         messages: Список LangChain messages (без SystemMessage, он уже в агенте)
-        chat_id: ID чата для сохранения состояния диалога
+        chat_id: ID чата (или другой уникальный id, например UUID в evaluation) для сохранения состояния диалога
+        on_token: async callback для потокового вывода ответа (опционально)
+        raise_errors: пробрасывать исключения (evaluation повторяет запрос при rate limit)
     
     Returns:
         dict: {
@@ -527,10 +585,23 @@ async def agent_answer(messages, chat_id: int):
     
     logger.info(f"🤖 Agent starting for chat {chat_id}...")
     
-    return await _run_agent_stream(inputs, agent_config, chat_id)
+    return await _run_agent_stream(inputs, agent_config, chat_id, on_token, raise_errors)
+
+
+async def has_pending_interrupt(chat_id: int) -> bool:
+    """
+    Ожидает ли агент решения пользователя (HITL) в этом чате
+    
+    Interrupt хранится в checkpointer, поэтому переживает перезапуск бота
+    (в отличие от pending_interrupts в handlers).
+    """
+    if bank_agent is None:
+        return False
+    state = await bank_agent.aget_state({"configurable": {"thread_id": str(chat_id)}})
+    return bool(state.interrupts)
 
 
-async def agent_resume(chat_id: int, decision: str, message: str = None):
+async def agent_resume(chat_id: int, decision: str, message: str = None, on_token=None):
     """
     Возобновить выполнение агента после Human-in-the-Loop interrupt
     
@@ -541,6 +612,7 @@ async def agent_resume(chat_id: int, decision: str, message: str = None):
         chat_id: ID чата для восстановления контекста диалога
         decision: "approve" или "reject" - решение пользователя
         message: Сообщение при reject (причина отклонения), опционально
+        on_token: async callback для потокового вывода ответа (опционально)
     
     Returns:
         dict: аналогично agent_answer - {answer, documents, interrupt}
@@ -564,4 +636,4 @@ async def agent_resume(chat_id: int, decision: str, message: str = None):
         })
     
     # Продолжаем выполнение агента с решением пользователя
-    return await _run_agent_stream(command, agent_config, chat_id)
+    return await _run_agent_stream(command, agent_config, chat_id, on_token)
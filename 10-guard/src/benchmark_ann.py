@@ -0,0 +1,129 @@
+"""
+Бенчмарк recall@k приближенного поиска (HNSW) относительно точного поиска
+
+Корпус - сохраненный индекс из INDEX_DIR (наши PDF + JSON, после запуска бота или /index).
+Запросы:
+- вопросы из датасета (datasets/*.json) - embeddings через create_embeddings() (с кешем)
+- иначе случайные чанки корпуса с небольшим шумом
+
+Для каждого значения ef_search считаются recall@k (доля точного top-k, найденная HNSW)
+и латентность p50/p95. --synthetic N добавляет к корпусу N случайных векторов,
+чтобы оценить поведение на сотнях тысяч чанков.
+
+Пример:
+    uv run python src/benchmark_ann.py --k 10 --ef 16 32 64 128 256
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import FakeEmbeddings
+
+from config import config
+import index_storage
+from vector_store import HnswVectorStore, MatrixVectorStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_corpus(synthetic: int):
+    """Векторы корпуса из INDEX_DIR (+ синтетические при --synthetic)"""
+    saved = index_storage.load_index(config.INDEX_DIR)
+    if saved is None:
+        raise SystemExit(f"No saved index in {config.INDEX_DIR}. Start the bot or run /index first.")
+    _, entries, vectors = saved
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    if synthetic > 0:
+        rng = np.random.default_rng(42)
+        extra = rng.standard_normal((synthetic, vectors.shape[1]), dtype=np.float32)
+        vectors = np.vstack([vectors, extra])
+        entries = entries + [
+            {"id": f"synthetic-{i}", "text": "", "metadata": {}} for i in range(synthetic)
+        ]
+    return entries, vectors
+
+
+def load_queries(dataset_path: str, num_queries: int, vectors: np.ndarray) -> np.ndarray:
+    """Векторы запросов: вопросы датасета или зашумленные чанки корпуса"""
+    path = Path(dataset_path)
+    if path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            questions = [qa["question"] for qa in json.load(f) if qa.get("question")]
+        if questions:
+            import indexer
+            logger.info(f"Embedding {len(questions[:num_queries])} questions from {path}")
+            embeddings = indexer.create_embeddings()
+            # embed_query: у части провайдеров (e5, instruct-модели) запрос и документ кодируются по-разному
+            return np.asarray(
+                [embeddings.embed_query(question) for question in questions[:num_queries]], dtype=np.float32
+            )
+
+    logger.info("Dataset not found, using noisy corpus chunks as queries")
+    rng = np.random.default_rng(7)
+    rows = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    noise = rng.standard_normal((len(rows), vectors.shape[1]), dtype=np.float32) * 0.05
+    return vectors[rows] + noise
+
+
+def measure(store, queries: np.ndarray, k: int):
+    """Результаты поиска (списки id) и латентности в мс"""
+    results = []
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        docs = store.similarity_search_by_vector(query.tolist(), k=k)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append([doc.id for doc in docs])
+    return results, np.array(timings)
+
+
+def main():
+    """Main CLI function"""
+    parser = argparse.ArgumentParser(description="Recall@k of HNSW vs exact search on the saved index")
+    parser.add_argument("--k", type=int, default=config.SEMANTIC_RETRIEVER_K, help="Top-k")
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256], help="ef_search values")
+    parser.add_argument("--m", type=int, default=config.HNSW_M, help="HNSW M")
+    parser.add_argument("--ef-construction", type=int, default=config.HNSW_EF_CONSTRUCTION, help="HNSW ef_construction")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--dataset", default="datasets/06-rag-qa-dataset.json", help="Dataset with questions")
+    parser.add_argument("--synthetic", type=int, default=0, help="Extra random vectors to add to the corpus")
+    args = parser.parse_args()
+
+    entries, vectors = load_corpus(args.synthetic)
+    queries = load_queries(args.dataset, args.queries, vectors)
+    # Запросы уже векторы - embeddings провайдера не нужны
+    embedding = FakeEmbeddings(size=vectors.shape[1])
+    logger.info(f"Corpus: {len(entries)} chunks, dim={vectors.shape[1]}, queries: {len(queries)}")
+
+    exact = MatrixVectorStore.from_entries(entries, vectors, embedding)
+    exact_results, exact_timings = measure(exact, queries, args.k)
+
+    start = time.perf_counter()
+    hnsw = HnswVectorStore.from_entries(
+        entries, vectors, embedding, m=args.m, ef_construction=args.ef_construction
+    )
+    build_seconds = time.perf_counter() - start
+    logger.info(f"HNSW graph built in {build_seconds:.1f}s (M={args.m}, ef_construction={args.ef_construction})")
+
+    print()
+    print(f"{'search':<16} {'recall@' + str(args.k):>10} {'p50 ms':>10} {'p95 ms':>10}")
+    print(f"{'exact':<16} {1.0:>10.3f} {np.percentile(exact_timings, 50):>10.3f} {np.percentile(exact_timings, 95):>10.3f}")
+
+    for ef in args.ef:
+        hnsw.ef_search = ef
+        hnsw._graph.set_ef(ef)
+        results, timings = measure(hnsw, queries, args.k)
+        recall = np.mean([
+            len(set(found) & set(expected)) / max(len(expected), 1)
+            for found, expected in zip(results, exact_results)
+        ])
+        print(f"{'hnsw ef=' + str(ef):<16} {recall:>10.3f} {np.percentile(timings, 50):>10.3f} {np.percentile(timings, 95):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Бенчмарк качества и скорости retrieval без генерации ответа и RAGAS
+
+Корпус - сохраненный индекс из INDEX_DIR (после запуска бота или /index), запросы -
+вопросы датасета (make dataset). Для каждого режима RETRIEVAL_MODE (semantic, hybrid,
+hybrid_reranker) вызывается тот же путь, что и в боте: rag.set_index() + rag.retrieve_documents().
+Поиск выполняется один раз на глубину max(k), метрики для меньших k - по префиксу выдачи.
+
+Релевантные чанки запроса - чанки того же файла (и страницы для PDF), текст которых
+пересекается с эталонным контекстом датасета не меньше чем на --overlap (доля токенов чанка):
+границы чанков при синтезе датасета и при индексации могут не совпадать.
+
+Метрики: recall@k, MRR@k, nDCG@k (бинарная релевантность), латентность p50/p95/p99
+и RSS процесса. Embeddings запросов считаются заранее (кеш embeddings), поэтому
+латентность не включает запрос к провайдеру.
+
+Пример:
+    uv run python src/benchmark_retrieval.py --k 1 3 5 10 --json storage/retrieval_benchmark.json
+"""
+import argparse
+import json
+import logging
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config import config
+import bm25_index
+import index_storage
+import indexer
+import rag
+import reranker
+from benchmark_vector_store import current_rss_mb
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ["semantic", "hybrid", "hybrid_reranker"]
+
+
+def load_dataset(dataset_path: str) -> list[dict]:
+    """Вопросы с эталонными контекстами"""
+    path = Path(dataset_path)
+    if not path.exists():
+        raise SystemExit(f"Dataset {path} not found. Create it with: make dataset")
+    with open(path, 'r', encoding='utf-8') as f:
+        return [qa for qa in json.load(f) if qa.get("question") and qa.get("contexts")]
+
+
+def find_relevant(qa: dict, chunks: list, overlap: float) -> set:
+    """id чанков индекса, соответствующих эталонным контекстам вопроса"""
+    metadata = qa.get("metadata", {})
+    source = Path(str(metadata.get("source") or "")).name
+    page = metadata.get("page")
+    # Сначала чанки того же файла/страницы, если файл не найден - весь корпус
+    candidates = [doc for doc in chunks if Path(str(doc.metadata.get("source", ""))).name == source]
+    if page is not None and page >= 0:
+        candidates = [doc for doc in candidates if doc.metadata.get("page") == page] or candidates
+    if not candidates:
+        candidates = chunks
+
+    context_tokens = set()
+    for context in qa["contexts"]:
+        context_tokens.update(bm25_index.tokenize(context))
+
+    relevant = set()
+    for doc in candidates:
+        tokens = set(bm25_index.tokenize(doc.page_content))
+        if tokens and len(tokens & context_tokens) / len(tokens) >= overlap:
+            relevant.add(doc.id)
+    return relevant
+
+
+def ranking_metrics(found: list, relevant: set, k: int) -> dict:
+    """recall@k, MRR@k и nDCG@k для одного запроса"""
+    top = found[:k]
+    hits = [doc_id in relevant for doc_id in top]
+    first_hit = hits.index(True) + 1 if any(hits) else None
+    dcg = sum(1 / math.log2(rank + 1) for rank, hit in enumerate(hits, start=1) if hit)
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return {
+        "recall": sum(hits) / len(relevant),
+        "mrr": 1 / first_hit if first_hit else 0.0,
+        "ndcg": dcg / ideal if ideal else 0.0,
+    }
+
+
+def run_mode(mode: str, depth: int, store, chunks: list, bm25, questions: list[str]):
+    """Поиск всех вопросов в режиме mode: списки id чанков и латентности в мс"""
+    config.RETRIEVAL_MODE = mode
+    config.SEMANTIC_RETRIEVER_K = depth
+    config.BM25_RETRIEVER_K = depth
+    config.RERANKER_TOP_K = depth
+    if not rag.set_index(store, chunks, bm25):
+        raise SystemExit(f"Failed to build retriever for mode {mode}")
+    if mode == "hybrid_reranker":
+        # Загрузка модели cross-encoder не входит в латентность запросов
+        reranker.service.warmup()
+
+    results = []
+    timings = []
+    for question in questions:
+        start = time.perf_counter()
+        docs = rag.retrieve_documents(question)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append([doc.id for doc in docs])
+    return results, np.array(timings)
+
+
+def main():
+    """Main CLI function"""
+    parser = argparse.ArgumentParser(description="Retrieval quality and latency for every RETRIEVAL_MODE")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES, help="Retrieval modes")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10], help="Cutoffs for metrics")
+    parser.add_argument("--dataset", default=config.LOCAL_DATASET_PATH, help="Dataset with questions and contexts")
+    parser.add_argument("--overlap", type=float, default=0.5, help="Min token overlap of a chunk with the gold context")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file (for CI trend tracking)")
+    args = parser.parse_args()
+
+    saved = index_storage.load_index(config.INDEX_DIR)
+    if saved is None:
+        raise SystemExit(f"No saved index in {config.INDEX_DIR}. Start the bot or run /index first.")
+    _, entries, vectors = saved
+    embeddings = indexer.create_embeddings()
+    store, chunks = indexer.restore_vector_store(entries, vectors, embeddings)
+    bm25 = bm25_index.load_or_build(chunks, config.INDEX_DIR)
+
+    dataset = load_dataset(args.dataset)
+    queries = []
+    for qa in dataset:
+        relevant = find_relevant(qa, chunks, args.overlap)
+        if relevant:
+            queries.append((qa["question"], relevant))
+    logger.info(f"Corpus: {len(chunks)} chunks, queries with relevant chunks: {len(queries)}/{len(dataset)}")
+    if not queries:
+        raise SystemExit("No dataset question matches the indexed chunks (try a lower --overlap)")
+    questions = [question for question, _ in queries]
+
+    # Embeddings запросов в кеш: дальше измеряется только retrieval
+    for question in questions:
+        embeddings.embed_query(question)
+
+    ks = sorted(set(args.k))
+    depth = max(ks)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "dataset": args.dataset,
+        "chunks": len(chunks),
+        "queries": len(queries),
+        "overlap": args.overlap,
+        "vector_backend": config.VECTOR_BACKEND,
+        "modes": {},
+    }
+
+    for mode in args.modes:
+        rss_before = current_rss_mb()
+        results, timings = run_mode(mode, depth, store, chunks, bm25, questions)
+        rss_after = current_rss_mb()
+        metrics = {}
+        for k in ks:
+            per_query = [ranking_metrics(found, relevant, k) for found, (_, relevant) in zip(results, queries)]
+            metrics[k] = {name: float(np.mean([m[name] for m in per_query])) for name in ("recall", "mrr", "ndcg")}
+        report["modes"][mode] = {
+            "metrics": metrics,
+            "latency_ms": {
+                "p50": float(np.percentile(timings, 50)),
+                "p95": float(np.percentile(timings, 95)),
+                "p99": float(np.percentile(timings, 99)),
+            },
+            "rss_mb": rss_after,
+            "rss_delta_mb": rss_after - rss_before,
+        }
+
+    print()
+    print(f"{'mode':<16} {'k':>3} {'recall':>8} {'mrr':>8} {'ndcg':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8}")
+    for mode, result in report["modes"].items():
+        latency = result["latency_ms"]
+        for k, values in result["metrics"].items():
+            print(
+                f"{mode:<16} {k:>3} {values['recall']:>8.3f} {values['mrr']:>8.3f} {values['ndcg']:>8.3f} "
+                f"{latency['p50']:>9.2f} {latency['p95']:>9.2f} {latency['p99']:>9.2f} {result['rss_mb']:>8.0f}"
+            )
+
+    if args.json:
+        path = Path(args.json)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Бенчмарк векторных хранилищ: InMemoryVectorStore vs MatrixVectorStore
+
+Сравнивает латентность поиска top-k и прирост RSS процесса на синтетических
+нормализованных векторах (без вызовов embeddings провайдера).
+
+Пример:
+    uv run python src/benchmark_vector_store.py --sizes 10000 100000 1000000 --dim 768
+"""
+import argparse
+import gc
+import logging
+import resource
+import time
+
+import numpy as np
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from vector_store import MatrixVectorStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def current_rss_mb() -> float:
+    """Текущий RSS процесса в MB (Linux /proc, иначе пиковый RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        # macOS: ru_maxrss в байтах, Linux: в KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_vectors(size: int, dim: int, seed: int = 42) -> np.ndarray:
+    """Синтетические нормализованные векторы"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((size, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_entries(size: int) -> list:
+    """Синтетические чанки (10 файлов - для проверки фильтров по метаданным)"""
+    return [
+        {"id": str(i), "text": f"chunk {i}", "metadata": {"source": f"file_{i % 10}.pdf", "page": i % 100}}
+        for i in range(size)
+    ]
+
+
+def build_in_memory(entries: list, vectors: np.ndarray, embedding):
+    """InMemoryVectorStore: dict с отдельным списком float на каждый документ"""
+    store = InMemoryVectorStore(embedding=embedding)
+    for entry, vector in zip(entries, vectors.tolist()):
+        store.store[entry["id"]] = {
+            "id": entry["id"],
+            "vector": vector,
+            "text": entry["text"],
+            "metadata": entry["metadata"],
+        }
+    return store
+
+
+def measure_latency(store, queries: np.ndarray, k: int, filter=None) -> dict:
+    """Латентность similarity_search_by_vector в миллисекундах (p50/p95/mean)"""
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        if filter is None:
+            store.similarity_search_by_vector(query.tolist(), k=k)
+        else:
+            store.similarity_search_by_vector(query.tolist(), k=k, filter=filter)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "mean_ms": float(timings.mean()),
+    }
+
+
+def run_benchmark(size: int, dim: int, num_queries: int, k: int, dtype: str, baseline_max: int) -> list:
+    """Бенчмарк одного размера корпуса, возвращает строки результатов"""
+    embedding = FakeEmbeddings(size=dim)
+    entries = make_entries(size)
+    vectors = make_vectors(size, dim)
+    queries = make_vectors(num_queries, dim, seed=7)
+    results = []
+
+    gc.collect()
+    rss_before = current_rss_mb()
+    matrix_store = MatrixVectorStore.from_entries(entries, vectors, embedding, dtype=dtype)
+    gc.collect()
+    row = {"store": f"matrix[{dtype}]", "size": size, "rss_mb": current_rss_mb() - rss_before}
+    row.update(measure_latency(matrix_store, queries, k))
+    row["filtered_p50_ms"] = measure_latency(matrix_store, queries, k, filter={"source": "file_3.pdf"})["p50_ms"]
+    results.append(row)
+    del matrix_store
+    gc.collect()
+
+    if size <= baseline_max:
+        rss_before = current_rss_mb()
+        memory_store = build_in_memory(entries, vectors, embedding)
+        gc.collect()
+        row = {"store": "in_memory", "size": size, "rss_mb": current_rss_mb() - rss_before}
+        # InMemoryVectorStore считает cosine по всем документам - меньше запросов для больших корпусов
+        row.update(measure_latency(memory_store, queries[:max(1, num_queries // 10)], k))
+        row["filtered_p50_ms"] = measure_latency(
+            memory_store, queries[:max(1, num_queries // 10)], k,
+            filter=lambda doc: doc.metadata.get("source") == "file_3.pdf"
+        )["p50_ms"]
+        results.append(row)
+        del memory_store
+        gc.collect()
+    else:
+        logger.info(f"Skipping InMemoryVectorStore for size={size} (> --baseline-max {baseline_max})")
+
+    return results
+
+
+def main():
+    """Main CLI function"""
+    parser = argparse.ArgumentParser(description="Benchmark InMemoryVectorStore vs MatrixVectorStore")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Corpus sizes")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries per size")
+    parser.add_argument("--k", type=int, default=10, help="Top-k")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="MatrixVectorStore dtype")
+    parser.add_argument(
+        "--baseline-max", type=int, default=100_000,
+        help="Max corpus size for InMemoryVectorStore (1M x 768 python floats needs ~25GB RAM)"
+    )
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        logger.info(f"=== size={size}, dim={args.dim} ===")
+        rows.extend(run_benchmark(size, args.dim, args.queries, args.k, args.dtype, args.baseline_max))
+
+    print()
+    print(f"{'store':<18} {'size':>10} {'RSS MB':>10} {'p50 ms':>10} {'p95 ms':>10} {'filtered p50':>14}")
+    for row in rows:
+        print(
+            f"{row['store']:<18} {row['size']:>10} {row['rss_mb']:>10.1f} "
+            f"{row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f} {row['filtered_p50_ms']:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
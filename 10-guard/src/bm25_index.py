@@ -0,0 +1,267 @@
+"""
+BM25 с инвертированным индексом
+
+Вместо BM25Retriever.from_documents() (токенизация всего корпуса при каждом создании
+retriever и цикл Python по всем документам на каждый запрос):
+- индекс строится один раз при индексации и сохраняется рядом с векторным индексом
+- term -> postings (id документов + tf) в CSR-массивах NumPy
+- скоринг запроса затрагивает только postings терминов запроса (векторно)
+- токенизация с учетом русского языка: ё -> е, стоп-слова, стемминг Snowball (Портер)
+"""
+import json
+import logging
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+ARRAYS_FILE = "bm25.npz"
+META_FILE = "bm25_meta.json"
+
+# ---------- Токенизация ----------
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+RUSSIAN_STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до
+его ее если есть еще же за здесь и из или им их к как ко когда кто ли либо мне может мы на над
+надо наш не него нее нет ни них но ну о об однако он она они оно от очень по под при с со так
+также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что чтобы чье чья
+эта эти это я
+""".split())
+
+# Стеммер Snowball для русского языка (алгоритм Портера)
+_VOWELS = "аеиоуыэюя"
+_RV_RE = re.compile(rf"^(.*?[{_VOWELS}])(.*)$")
+_PERFECTIVE_GERUND = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN = re.compile(r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$")
+_DERIVATIONAL = re.compile(rf".*[^{_VOWELS}]+[{_VOWELS}].*ость?$")
+_DER = re.compile(r"ость?$")
+_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+_I = re.compile(r"и$")
+_SOFT_SIGN = re.compile(r"ь$")
+_NN = re.compile(r"нн$")
+
+
+@lru_cache(maxsize=200_000)
+def stem_russian(word: str) -> str:
+    """Стемминг русского слова (для латиницы и чисел возвращает слово как есть)"""
+    match = _RV_RE.match(word)
+    if not match:
+        return word
+
+    prefix, rv = match.groups()
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = _I.sub('', rv, 1)
+    if _DERIVATIONAL.match(rv):
+        rv = _DER.sub('', rv, 1)
+
+    stripped = _SOFT_SIGN.sub('', rv, 1)
+    if stripped == rv:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        rv = _NN.sub('н', rv, 1)
+    else:
+        rv = stripped
+
+    return prefix + rv
+
+
+def tokenize(text: str) -> list[str]:
+    """Токены для BM25: нижний регистр, ё -> е, без стоп-слов, со стеммингом"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace('ё', 'е')):
+        if token in RUSSIAN_STOPWORDS:
+            continue
+        tokens.append(stem_russian(token))
+    return tokens
+
+
+# ---------- Индекс ----------
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 (Okapi) в CSR-массивах
+
+    postings термина t: doc_ids[indptr[t]:indptr[t + 1]] и tfs[indptr[t]:indptr[t + 1]]
+    """
+
+    def __init__(self, vocabulary: dict, indptr, doc_ids, tfs, doc_lengths,
+                 chunk_ids: list, k1: float = 1.5, b: float = 0.75):
+        self.vocabulary = vocabulary
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.tfs = np.asarray(tfs, dtype=np.float32)
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.chunk_ids = chunk_ids
+        self.k1 = k1
+        self.b = b
+        self._precompute()
+
+    def _precompute(self):
+        """IDF терминов и нормировка длины документов (не зависят от запроса)"""
+        num_docs = len(self.doc_lengths)
+        avgdl = float(self.doc_lengths.mean()) if num_docs else 0.0
+        doc_freq = np.diff(self.indptr).astype(np.float32)
+        # IDF в варианте Lucene (всегда положительный)
+        self.idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        self.length_norm = (
+            self.k1 * (1 - self.b + self.b * self.doc_lengths / avgdl) if avgdl > 0
+            else np.full(num_docs, self.k1, dtype=np.float32)
+        ).astype(np.float32)
+
+    @classmethod
+    def build(cls, documents: list, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Построение индекса по списку Document (id берется из doc.id)"""
+        vocabulary = {}
+        postings = []  # postings[term_id] = [(doc_idx, tf), ...]
+        doc_lengths = []
+
+        for doc_idx, doc in enumerate(documents):
+            tokens = tokenize(doc.page_content)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_idx, tf))
+
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.fromiter((d for p in postings for d, _ in p), dtype=np.int32, count=int(indptr[-1]))
+        tfs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.float32, count=int(indptr[-1]))
+
+        logger.info(f"BM25 index built: {len(documents)} docs, {len(vocabulary)} terms, {int(indptr[-1])} postings")
+        return cls(vocabulary, indptr, doc_ids, tfs, doc_lengths, [doc.id for doc in documents], k1, b)
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """
+        Top-k документов по BM25: [(индекс документа, score), ...] по убыванию score
+
+        Работа пропорциональна числу postings терминов запроса, а не размеру корпуса.
+        """
+        term_ids = [self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary]
+        if not term_ids or k <= 0:
+            return []
+
+        postings_docs = []
+        postings_scores = []
+        # Повторяющиеся термины запроса учитываются с весом (как в rank_bm25)
+        for term_id, query_tf in Counter(term_ids).items():
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            postings_docs.append(docs)
+            postings_scores.append(
+                query_tf * self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+            )
+
+        all_docs = np.concatenate(postings_docs)
+        all_scores = np.concatenate(postings_scores)
+        candidates, inverse = np.unique(all_docs, return_inverse=True)
+        totals = np.zeros(len(candidates), dtype=np.float32)
+        np.add.at(totals, inverse, all_scores)
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-totals, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        top = top[np.argsort(-totals[top])]
+        return [(int(candidates[i]), float(totals[i])) for i in top]
+
+    # ---------- Сохранение ----------
+
+    def save(self, index_dir: str):
+        """Сохранение индекса рядом с векторным индексом"""
+        index_path = Path(index_dir)
+        index_path.mkdir(parents=True, exist_ok=True)
+
+        arrays_tmp = index_path / (ARRAYS_FILE + ".tmp")
+        with open(arrays_tmp, 'wb') as f:
+            np.savez(f, indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths)
+        os.replace(arrays_tmp, index_path / ARRAYS_FILE)
+
+        meta_tmp = index_path / (META_FILE + ".tmp")
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
+            terms = sorted(self.vocabulary, key=self.vocabulary.get)
+            json.dump({"k1": self.k1, "b": self.b, "terms": terms, "chunk_ids": self.chunk_ids}, f, ensure_ascii=False)
+        os.replace(meta_tmp, index_path / META_FILE)
+        logger.info(f"BM25 index saved to {index_path}")
+
+    @classmethod
+    def load(cls, index_dir: str, chunk_ids: list, k1: float, b: float) -> "BM25Index | None":
+        """Загрузка индекса (None если его нет или он построен для других чанков/параметров)"""
+        index_path = Path(index_dir)
+        if not (index_path / ARRAYS_FILE).exists() or not (index_path / META_FILE).exists():
+            return None
+        try:
+            with open(index_path / META_FILE, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta["chunk_ids"] != chunk_ids or (meta["k1"], meta["b"]) != (k1, b):
+                logger.info("Saved BM25 index is stale, rebuilding")
+                return None
+            arrays = np.load(index_path / ARRAYS_FILE)
+            vocabulary = {term: term_id for term_id, term in enumerate(meta["terms"])}
+            index = cls(vocabulary, arrays["indptr"], arrays["doc_ids"], arrays["tfs"],
+                        arrays["doc_lengths"], meta["chunk_ids"], k1, b)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Failed to load BM25 index: {e}")
+            return None
+        logger.info(f"BM25 index loaded from {index_path} ({len(vocabulary)} terms)")
+        return index
+
+
+def load_or_build(documents: list, index_dir: str | None = None) -> BM25Index:
+    """BM25 индекс для чанков: загрузка с диска, если актуален, иначе построение и сохранение"""
+    chunk_ids = [doc.id for doc in documents]
+    if index_dir is not None:
+        index = BM25Index.load(index_dir, chunk_ids, config.BM25_K1, config.BM25_B)
+        if index is not None:
+            return index
+
+    index = BM25Index.build(documents, k1=config.BM25_K1, b=config.BM25_B)
+    if index_dir is not None:
+        try:
+            index.save(index_dir)
+        except OSError as e:
+            logger.error(f"Failed to save BM25 index: {e}")
+    return index
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """LangChain retriever поверх BM25Index (замена BM25Retriever)"""
+
+    index: Any
+    documents: list[Document]
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return [self.documents[doc_idx] for doc_idx, _ in self.index.search(query, self.k)]
@@ -5,7 +5,7 @@
 1. Настройка логирования
 2. Индексация документов (PDF + JSON) в векторное хранилище
 3. Инициализация RAG retriever (semantic/hybrid/hybrid_reranker)
-4. Создание ReAct агента с MemorySaver
+4. Создание ReAct агента с checkpointer (SQLite по умолчанию) и compaction
 5. Запуск Telegram bot polling
 """
 import os
@@ -23,7 +23,9 @@ from handlers import router
 from config import config
 import indexer
 import rag
+import reranker
 import agent
+import checkpointer
 
 # Создаем директорию для логов
 log_dir = Path("logs")
@@ -61,33 +63,42 @@ async def main():
         logger.info(f"  Ensemble weights: {config.ENSEMBLE_SEMANTIC_WEIGHT}/{config.ENSEMBLE_BM25_WEIGHT}")
     if config.RETRIEVAL_MODE == "hybrid_reranker":
         logger.info(f"  Cross-encoder: {config.CROSS_ENCODER_MODEL}")
-        logger.info(f"  Reranker top-k: {config.RERANKER_TOP_K}")
+        logger.info(f"  Reranker top-k: {config.RERANKER_TOP_K}, backend: {config.RERANKER_BACKEND}")
     
     logger.info(f"  LangSmith tracing: {config.LANGSMITH_TRACING_V2}")
     logger.info(f"  Show sources: {config.SHOW_SOURCES}")
     logger.info("-" * 70)
     
     # Индексация документов при старте
-    # Загружаем PDF и JSON, создаем chunks, генерируем embeddings, сохраняем в FAISS
+    # Если документы не изменились - индекс загружается с диска (INDEX_DIR) без embeddings,
+    # иначе embeddings считаются только для новых/измененных чанков и индекс сохраняется
     logger.info("📚 Starting indexing...")
-    result = await indexer.reindex_all()
-    if result and result[0] is not None:
-        rag.vector_store, rag.chunks = result
-        # Инициализируем retriever (semantic/hybrid/hybrid_reranker в зависимости от конфига)
-        rag.initialize_retriever()
+    # reindex_all сам устанавливает индекс и retriever (rag.set_index)
+    if await indexer.reindex_all():
         stats = rag.get_vector_store_stats()
         logger.info(f"✅ Indexing completed: {stats['count']} documents indexed")
     else:
         logger.warning("⚠️  Indexing completed with no documents - bot will run but cannot answer questions")
     
+    # Прогрев cross-encoder: загрузка модели при старте, а не на первом вопросе пользователя
+    if config.RETRIEVAL_MODE == "hybrid_reranker" and config.RERANKER_WARMUP:
+        logger.info("🔥 Warming up cross-encoder...")
+        try:
+            await asyncio.to_thread(reranker.service.warmup)
+        except Exception as e:
+            logger.error(f"❌ Cross-encoder warmup failed: {e}")
+    
     # Инициализация ReAct агента
     # Создается один раз и переиспользуется для всех пользователей
-    # MemorySaver внутри агента обеспечивает отдельную историю для каждого chat_id
+    # Checkpointer агента обеспечивает отдельную историю для каждого chat_id
     # Подключение к MCP серверу происходит здесь (если сервер запущен)
     logger.info("🤖 Initializing ReAct agent...")
     await agent.initialize_agent()
     logger.info("✅ Agent initialized successfully")
     
+    # Фоновая очистка старых checkpoints и неактивных диалогов
+    checkpointer.start_compaction()
+    
     bot = Bot(token=config.TELEGRAM_TOKEN)
     dp = Dispatcher()
     dp.include_router(router)
@@ -102,6 +113,7 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Bot stopped with error: {e}", exc_info=True)
     finally:
+        await checkpointer.close()
         logger.info("=" * 70)
         logger.info("🛑 Bot shutdown complete")
         logger.info("=" * 70)
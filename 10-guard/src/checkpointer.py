@@ -0,0 +1,270 @@
+"""
+Хранилище checkpoints агента (история диалогов и HITL interrupts)
+
+MemorySaver держит все checkpoints всех чатов в памяти процесса без ограничений
+и теряет их (вместе с ожидающими подтверждения операциями) при перезапуске бота.
+Здесь checkpointer выбирается по CHECKPOINT_BACKEND:
+- sqlite (по умолчанию) - локальный файл CHECKPOINT_SQLITE_PATH, без сервера БД
+- postgres - CHECKPOINT_POSTGRES_URL (нужен extra: uv sync --extra postgres)
+- memory - MemorySaver, как раньше (для разработки)
+
+Retention (фоновая задача compaction раз в CHECKPOINT_COMPACTION_INTERVAL_MINUTES):
+- в каждом thread остаются последние CHECKPOINT_KEEP_LAST checkpoints
+  (агент продолжает работу с последнего, в т.ч. после interrupt)
+- threads без активности дольше CHECKPOINT_THREAD_TTL_HOURS удаляются целиком
+
+Время активности берется из checkpoint_id: LangGraph генерирует uuid6,
+в котором закодировано время создания checkpoint.
+"""
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Смещение между эпохой uuid (15.10.1582) и Unix эпохой в интервалах по 100 нс
+UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_timestamp(checkpoint_id: str) -> float:
+    """Unix время создания checkpoint по его id (uuid6)"""
+    value = int(checkpoint_id.replace("-", ""), 16)
+    timestamp = ((value >> 80) << 12) | ((value >> 64) & 0x0FFF)
+    return (timestamp - UUID_EPOCH_OFFSET) / 10_000_000
+
+
+class CheckpointRetention:
+    """Compaction хранилища checkpoints: последние N на thread и TTL неактивных threads"""
+
+    def __init__(self, saver, keep_last: int, thread_ttl_seconds: float):
+        self.saver = saver
+        self.keep_last = keep_last
+        self.thread_ttl_seconds = thread_ttl_seconds
+        self.stats = {"runs": 0, "checkpoints_deleted": 0, "threads_deleted": 0, "last_run_seconds": 0.0}
+
+    # ---------- Backend ----------
+
+    async def _thread_last_ids(self) -> list[tuple[str, str]]:
+        """(thread_id, id последнего checkpoint) для всех threads"""
+        return []
+
+    async def _trim_threads(self) -> int:
+        """Удаление checkpoints сверх keep_last в каждом thread, возвращает число удаленных"""
+        return 0
+
+    # ---------- Compaction ----------
+
+    async def _delete_idle_threads(self) -> int:
+        cutoff = time.time() - self.thread_ttl_seconds
+        idle = [
+            thread_id for thread_id, last_id in await self._thread_last_ids()
+            if checkpoint_timestamp(last_id) < cutoff
+        ]
+        for thread_id in idle:
+            await self.saver.adelete_thread(thread_id)
+        return len(idle)
+
+    async def compact(self) -> dict:
+        """Один проход compaction"""
+        start = time.perf_counter()
+        threads_deleted = await self._delete_idle_threads()
+        checkpoints_deleted = await self._trim_threads()
+
+        self.stats["runs"] += 1
+        self.stats["threads_deleted"] += threads_deleted
+        self.stats["checkpoints_deleted"] += checkpoints_deleted
+        self.stats["last_run_seconds"] = time.perf_counter() - start
+        logger.info(
+            f"🧹 Checkpoint compaction: {threads_deleted} idle threads and "
+            f"{checkpoints_deleted} old checkpoints deleted in {self.stats['last_run_seconds']:.2f}s"
+        )
+        return {"threads_deleted": threads_deleted, "checkpoints_deleted": checkpoints_deleted}
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["backend"] = config.CHECKPOINT_BACKEND
+        stats["keep_last"] = self.keep_last
+        return stats
+
+
+class MemoryRetention(CheckpointRetention):
+    """MemorySaver: только TTL неактивных threads (промежуточные checkpoints делят blobs каналов)"""
+
+    async def _thread_last_ids(self) -> list[tuple[str, str]]:
+        return [
+            (thread_id, max(checkpoint_id for checkpoints in namespaces.values() for checkpoint_id in checkpoints))
+            for thread_id, namespaces in list(self.saver.storage.items())
+            if any(namespaces.values())
+        ]
+
+
+class SQLiteRetention(CheckpointRetention):
+    """AsyncSqliteSaver: таблицы checkpoints и writes"""
+
+    async def _thread_last_ids(self) -> list[tuple[str, str]]:
+        async with self.saver.lock, self.saver.conn.execute(
+            "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"
+        ) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+    async def _trim_threads(self) -> int:
+        async with self.saver.lock, self.saver.conn.cursor() as cursor:
+            # checkpoint_id (uuid6) возрастает со временем - сортировка по нему = по времени
+            await cursor.execute(
+                "DELETE FROM checkpoints WHERE rowid IN ("
+                " SELECT rowid FROM ("
+                "  SELECT rowid, ROW_NUMBER() OVER ("
+                "   PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn"
+                "  FROM checkpoints)"
+                " WHERE rn > ?)",
+                (self.keep_last,)
+            )
+            deleted = cursor.rowcount
+            # Pending writes удаленных checkpoints
+            await cursor.execute(
+                "DELETE FROM writes WHERE NOT EXISTS ("
+                " SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id"
+                " AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id)"
+            )
+            await self.saver.conn.commit()
+        return deleted
+
+
+class PostgresRetention(CheckpointRetention):
+    """AsyncPostgresSaver: таблицы checkpoints, checkpoint_writes и checkpoint_blobs"""
+
+    async def _thread_last_ids(self) -> list[tuple[str, str]]:
+        async with self.saver.lock, self.saver.conn.cursor() as cursor:
+            await cursor.execute("SELECT thread_id, MAX(checkpoint_id) AS last_id FROM checkpoints GROUP BY thread_id")
+            return [(row["thread_id"], row["last_id"]) for row in await cursor.fetchall()]
+
+    async def _trim_threads(self) -> int:
+        async with self.saver.lock, self.saver.conn.cursor() as cursor:
+            await cursor.execute(
+                "DELETE FROM checkpoints c USING ("
+                " SELECT thread_id, checkpoint_ns, checkpoint_id, ROW_NUMBER() OVER ("
+                "  PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn"
+                " FROM checkpoints) old"
+                " WHERE old.rn > %s AND c.thread_id = old.thread_id"
+                " AND c.checkpoint_ns = old.checkpoint_ns AND c.checkpoint_id = old.checkpoint_id",
+                (self.keep_last,)
+            )
+            deleted = cursor.rowcount
+            await cursor.execute(
+                "DELETE FROM checkpoint_writes w WHERE NOT EXISTS ("
+                " SELECT 1 FROM checkpoints c WHERE c.thread_id = w.thread_id"
+                " AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id)"
+            )
+            # Значения каналов, на версии которых не ссылается ни один оставшийся checkpoint
+            await cursor.execute(
+                "DELETE FROM checkpoint_blobs b WHERE NOT EXISTS ("
+                " SELECT 1 FROM checkpoints c WHERE c.thread_id = b.thread_id"
+                " AND c.checkpoint_ns = b.checkpoint_ns"
+                " AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version)"
+            )
+        return deleted
+
+
+# Общие экземпляры (checkpointer один на процесс, все агенты используют его)
+_exit_stack = None
+saver = None
+retention = None
+_compaction_task = None
+
+
+async def _create_saver(stack: AsyncExitStack):
+    backend = config.CHECKPOINT_BACKEND
+    if backend == "sqlite":
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        path = Path(config.CHECKPOINT_SQLITE_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        new_saver = await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(str(path)))
+        await new_saver.setup()
+        logger.info(f"✓ Checkpointer: SQLite ({path})")
+        return new_saver, SQLiteRetention
+
+    if backend == "postgres":
+        try:
+            from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        except ImportError as e:
+            raise ImportError(
+                "CHECKPOINT_BACKEND=postgres requires langgraph-checkpoint-postgres: uv sync --extra postgres"
+            ) from e
+
+        new_saver = await stack.enter_async_context(AsyncPostgresSaver.from_conn_string(config.CHECKPOINT_POSTGRES_URL))
+        await new_saver.setup()
+        logger.info("✓ Checkpointer: Postgres")
+        return new_saver, PostgresRetention
+
+    logger.info("✓ Checkpointer: memory (history is lost on restart)")
+    return MemorySaver(), MemoryRetention
+
+
+async def get_checkpointer():
+    """Checkpointer агента (создается один раз)"""
+    global _exit_stack, saver, retention
+    if saver is None:
+        stack = AsyncExitStack()
+        try:
+            new_saver, retention_cls = await _create_saver(stack)
+        except BaseException:
+            await stack.aclose()
+            raise
+        _exit_stack, saver = stack, new_saver
+        retention = retention_cls(
+            new_saver,
+            keep_last=config.CHECKPOINT_KEEP_LAST,
+            thread_ttl_seconds=config.CHECKPOINT_THREAD_TTL_HOURS * 3600,
+        )
+    return saver
+
+
+async def _compaction_loop(interval_seconds: float):
+    while True:
+        try:
+            await retention.compact()
+        except Exception as e:
+            logger.error(f"Checkpoint compaction failed: {e}", exc_info=True)
+        await asyncio.sleep(interval_seconds)
+
+
+def start_compaction():
+    """Запуск фоновой задачи compaction (вызывается после get_checkpointer())"""
+    global _compaction_task
+    if retention is None or config.CHECKPOINT_COMPACTION_INTERVAL_MINUTES <= 0:
+        return
+    if _compaction_task is None or _compaction_task.done():
+        _compaction_task = asyncio.create_task(
+            _compaction_loop(config.CHECKPOINT_COMPACTION_INTERVAL_MINUTES * 60)
+        )
+        logger.info(
+            f"🧹 Checkpoint compaction every {config.CHECKPOINT_COMPACTION_INTERVAL_MINUTES} min "
+            f"(keep last {config.CHECKPOINT_KEEP_LAST}, thread TTL {config.CHECKPOINT_THREAD_TTL_HOURS}h)"
+        )
+
+
+async def close():
+    """Остановка compaction и закрытие соединения с БД"""
+    global _exit_stack, saver, retention, _compaction_task
+    if _compaction_task is not None:
+        _compaction_task.cancel()
+        try:
+            await _compaction_task
+        except asyncio.CancelledError:
+            pass
+        _compaction_task = None
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+    _exit_stack, saver, retention = None, None, None
+
+
+def get_stats() -> dict:
+    """Статистика compaction"""
+    return retention.get_stats() if retention else {}
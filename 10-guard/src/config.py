@@ -20,16 +20,69 @@ class Config:
     HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "intfloat/multilingual-e5-base")
     HUGGINGFACE_DEVICE = os.getenv("HUGGINGFACE_DEVICE", "cpu")  # cpu/cuda/mps
     
+    # Indexing Configuration
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+    INDEX_DIR = os.getenv("INDEX_DIR", "index")  # Директория для сохраненного индекса
+    VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")  # float32/float16 (матрица embeddings в памяти)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "exact")  # exact/hnsw
+    
+    # HNSW (приближенный поиск, VECTOR_BACKEND=hnsw)
+    HNSW_M = int(os.getenv("HNSW_M", "16"))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    
+    # Embedding Cache Configuration (общий для индексации и RAGAS)
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    
     # Retrieval Configuration
     RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic")  # semantic/hybrid/hybrid_reranker
     SEMANTIC_RETRIEVER_K = int(os.getenv("SEMANTIC_RETRIEVER_K", "10"))
     BM25_RETRIEVER_K = int(os.getenv("BM25_RETRIEVER_K", "10"))
     ENSEMBLE_SEMANTIC_WEIGHT = float(os.getenv("ENSEMBLE_SEMANTIC_WEIGHT", "0.5"))
     ENSEMBLE_BM25_WEIGHT = float(os.getenv("ENSEMBLE_BM25_WEIGHT", "0.5"))
+    BM25_K1 = float(os.getenv("BM25_K1", "1.5"))  # Насыщение term frequency
+    BM25_B = float(os.getenv("BM25_B", "0.75"))   # Нормировка по длине документа
     
     # Cross-Encoder Reranking Configuration
     CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
     RERANKER_TOP_K = int(os.getenv("RERANKER_TOP_K", "3"))
+    RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")  # torch/onnx/onnx_int8
+    RERANKER_ONNX_DIR = os.getenv("RERANKER_ONNX_DIR", "cache/reranker_onnx")  # Локально квантованная модель
+    RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "64"))  # Макс. пар в одном батче
+    RERANKER_BATCH_WAIT_MS = float(os.getenv("RERANKER_BATCH_WAIT_MS", "5"))  # Ожидание других запросов
+    RERANKER_CACHE_SIZE = int(os.getenv("RERANKER_CACHE_SIZE", "20000"))  # LRU кеш score
+    RERANKER_WARMUP = os.getenv("RERANKER_WARMUP", "true").lower() == "true"
+    
+    # Потоковый вывод ответа (правки одного сообщения Telegram)
+    STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # Мин. секунд между правками
+    STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "40"))  # Мин. прирост текста для правки
+    
+    # Checkpointer агента (история диалогов и HITL interrupts)
+    CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")  # sqlite/postgres/memory
+    CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "storage/checkpoints.sqlite")
+    CHECKPOINT_POSTGRES_URL = os.getenv("CHECKPOINT_POSTGRES_URL", "")
+    CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))  # Checkpoints на thread
+    CHECKPOINT_THREAD_TTL_HOURS = float(os.getenv("CHECKPOINT_THREAD_TTL_HOURS", "168"))  # Удаление неактивных
+    CHECKPOINT_COMPACTION_INTERVAL_MINUTES = float(os.getenv("CHECKPOINT_COMPACTION_INTERVAL_MINUTES", "60"))  # 0 - выключено
+    
+    # Планировщик запусков агента (очередь по chat_id, лимит параллельности)
+    SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", "8"))  # Одновременных запусков агента
+    SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))  # Ожидающих, остальным - отказ
+    SCHEDULER_SUPERSEDE = os.getenv("SCHEDULER_SUPERSEDE", "true").lower() == "true"  # Новое сообщение отменяет старое
+    
+    # Результат rag_search в prompt агента (полные тексты - в source_store)
+    RAG_TOOL_MAX_TOKENS = int(os.getenv("RAG_TOOL_MAX_TOKENS", "1500"))  # На один вызов
+    RAG_TOOL_CHUNK_MAX_TOKENS = int(os.getenv("RAG_TOOL_CHUNK_MAX_TOKENS", "500"))  # На один чанк
+    RAG_SOURCE_STORE_SIZE = int(os.getenv("RAG_SOURCE_STORE_SIZE", "5000"))  # Полных документов в памяти (LRU)
+    
+    # История диалога в запросе к модели (HistoryBudgetMiddleware)
+    HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "3000"))  # Бюджет на историю (текущий ход - целиком)
+    HISTORY_SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+    HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "")  # Пусто - MODEL
     
     # Отображение источников
     SHOW_SOURCES = os.getenv("SHOW_SOURCES", "false").lower() == "true"
@@ -51,10 +104,35 @@ class Config:
     # RAGAS evaluation настройки (фиксированные модели для единообразной оценки)
     RAGAS_LLM_MODEL = os.getenv("RAGAS_LLM_MODEL", "gpt-4o")
     RAGAS_EMBEDDING_MODEL = os.getenv("RAGAS_EMBEDDING_MODEL", "text-embedding-3-large")
+    # OpenAI-совместимый endpoint судьи (пусто - как у агента, OPENAI_BASE_URL)
+    RAGAS_LLM_BASE_URL = os.getenv("RAGAS_LLM_BASE_URL")
+    RAGAS_LLM_API_KEY = os.getenv("RAGAS_LLM_API_KEY")
     RAGAS_EMBEDDING_PROVIDER = os.getenv("RAGAS_EMBEDDING_PROVIDER", EMBEDDING_PROVIDER)  # По умолчанию = основному провайдеру
     # Для HuggingFace используем те же настройки что и для основных embeddings
     RAGAS_HUGGINGFACE_EMBEDDING_MODEL = os.getenv("RAGAS_HUGGINGFACE_EMBEDDING_MODEL", HUGGINGFACE_EMBEDDING_MODEL)
     RAGAS_HUGGINGFACE_DEVICE = os.getenv("RAGAS_HUGGINGFACE_DEVICE", HUGGINGFACE_DEVICE)
+    # Кеш оценок RAGAS: неизменившиеся примеры не оцениваются судьей повторно
+    RAGAS_CACHE_ENABLED = os.getenv("RAGAS_CACHE_ENABLED", "true").lower() == "true"
+    RAGAS_CACHE_PATH = os.getenv("RAGAS_CACHE_PATH", "cache/ragas_scores.sqlite")
+    RAGAS_CACHE_MAX_ENTRIES = int(os.getenv("RAGAS_CACHE_MAX_ENTRIES", "100000"))
+    # Загрузка оценок в LangSmith: пул потоков, повторы, spool файл для незагруженных
+    FEEDBACK_UPLOAD_WORKERS = int(os.getenv("FEEDBACK_UPLOAD_WORKERS", "8"))
+    FEEDBACK_UPLOAD_RETRIES = int(os.getenv("FEEDBACK_UPLOAD_RETRIES", "4"))
+    FEEDBACK_SPOOL_PATH = os.getenv("FEEDBACK_SPOOL_PATH", "storage/feedback_spool.jsonl")
+    
+    # Запуск агента на примерах датасета: параллельность и повторы при rate limit
+    EVAL_MAX_CONCURRENCY = int(os.getenv("EVAL_MAX_CONCURRENCY", "8"))
+    EVAL_MAX_RETRIES = int(os.getenv("EVAL_MAX_RETRIES", "5"))
+    EVAL_BACKOFF_SECONDS = float(os.getenv("EVAL_BACKOFF_SECONDS", "2"))
+    # Offline evaluation (без LangSmith): локальный датасет и история прогонов
+    LOCAL_DATASET_PATH = os.getenv("LOCAL_DATASET_PATH", "datasets/06-rag-qa-dataset.json")
+    
+    # Синтез датасета (make dataset): параллельные запросы к LLM, checkpoint для продолжения
+    SYNTHESIS_CONCURRENCY = int(os.getenv("SYNTHESIS_CONCURRENCY", "8"))
+    SYNTHESIS_MAX_RETRIES = int(os.getenv("SYNTHESIS_MAX_RETRIES", "5"))
+    SYNTHESIS_STRUCTURED_OUTPUT = os.getenv("SYNTHESIS_STRUCTURED_OUTPUT", "json_schema")  # json_schema/function_calling/json_mode
+    SYNTHESIS_CHECKPOINT_PATH = os.getenv("SYNTHESIS_CHECKPOINT_PATH", "datasets/synthesis_checkpoint.jsonl")
+    EVAL_RESULTS_DIR = os.getenv("EVAL_RESULTS_DIR", "storage/eval_results")
     
     @classmethod
     def load_prompt(cls, filename: str) -> str:
@@ -75,6 +153,55 @@ class Config:
                 f"Must be one of: {', '.join(valid_retrieval_modes)}"
             )
         
+        # Валидация VECTOR_DTYPE
+        valid_vector_dtypes = ["float32", "float16"]
+        if cls.VECTOR_DTYPE not in valid_vector_dtypes:
+            raise ValueError(
+                f"Invalid VECTOR_DTYPE: {cls.VECTOR_DTYPE}. "
+                f"Must be one of: {', '.join(valid_vector_dtypes)}"
+            )
+        
+        # Валидация VECTOR_BACKEND
+        valid_vector_backends = ["exact", "hnsw"]
+        if cls.VECTOR_BACKEND not in valid_vector_backends:
+            raise ValueError(
+                f"Invalid VECTOR_BACKEND: {cls.VECTOR_BACKEND}. "
+                f"Must be one of: {', '.join(valid_vector_backends)}"
+            )
+        
+        # Валидация RERANKER_BACKEND
+        valid_reranker_backends = ["torch", "onnx", "onnx_int8"]
+        if cls.RERANKER_BACKEND not in valid_reranker_backends:
+            raise ValueError(
+                f"Invalid RERANKER_BACKEND: {cls.RERANKER_BACKEND}. "
+                f"Must be one of: {', '.join(valid_reranker_backends)}"
+            )
+        
+        # Валидация CHECKPOINT_BACKEND
+        valid_checkpoint_backends = ["sqlite", "postgres", "memory"]
+        if cls.CHECKPOINT_BACKEND not in valid_checkpoint_backends:
+            raise ValueError(
+                f"Invalid CHECKPOINT_BACKEND: {cls.CHECKPOINT_BACKEND}. "
+                f"Must be one of: {', '.join(valid_checkpoint_backends)}"
+            )
+        if cls.CHECKPOINT_BACKEND == "postgres" and not cls.CHECKPOINT_POSTGRES_URL:
+            raise ValueError("CHECKPOINT_POSTGRES_URL is required for CHECKPOINT_BACKEND=postgres")
+        if cls.CHECKPOINT_KEEP_LAST < 1:
+            raise ValueError("CHECKPOINT_KEEP_LAST must be >= 1 (the last checkpoint holds pending interrupts)")
+        
+        if cls.EVAL_MAX_CONCURRENCY < 1:
+            raise ValueError("EVAL_MAX_CONCURRENCY must be >= 1")
+        if cls.FEEDBACK_UPLOAD_WORKERS < 1:
+            raise ValueError("FEEDBACK_UPLOAD_WORKERS must be >= 1")
+        if cls.SYNTHESIS_CONCURRENCY < 1:
+            raise ValueError("SYNTHESIS_CONCURRENCY must be >= 1")
+        valid_structured_output = ["json_schema", "function_calling", "json_mode"]
+        if cls.SYNTHESIS_STRUCTURED_OUTPUT not in valid_structured_output:
+            raise ValueError(
+                f"Invalid SYNTHESIS_STRUCTURED_OUTPUT: {cls.SYNTHESIS_STRUCTURED_OUTPUT}. "
+                f"Must be one of: {', '.join(valid_structured_output)}"
+            )
+        
         # Валидация EMBEDDING_PROVIDER
         valid_embedding_providers = ["openai", "huggingface"]
         if cls.EMBEDDING_PROVIDER not in valid_embedding_providers:
@@ -1,54 +1,87 @@
+import asyncio
 import json
 import logging
 import random
 from pathlib import Path
 from typing import List, Dict, Any
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langsmith import Client
+from pydantic import BaseModel
 from config import config
+import index_storage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_and_sample_pdf_chunks(data_dir: str, samples_per_file: int = 2) -> List:
+class QAPair(BaseModel):
+    question: str
+    answer: str
+
+class QAPairs(BaseModel):
+    """Схема ответа LLM (structured output вместо разбора JSON из markdown)"""
+    qa_pairs: List[QAPair]
+
+def load_pdf_chunks(data_dir: str) -> Dict[str, List[Dict[str, Any]]]:
     """
-    Загрузка PDF документов и выборка чанков для синтеза вопросов
+    Чанки PDF документов по файлам: из сохраненного индекса (INDEX_DIR), если файл не менялся
     
-    Args:
-        data_dir: путь к директории с PDF файлами
-        samples_per_file: количество чанков для выборки из каждого файла
+    PDF парсится заново (indexer.load_source_file) только если его нет в индексе
+    или хеш файла не совпадает с манифестом индекса.
     
     Returns:
-        Список чанков с метаданными
+        {имя файла: [{"id", "text", "metadata"}]}
     """
-    data_path = Path(data_dir)
-    pdf_files = list(data_path.glob("*.pdf"))
-    
+    pdf_files = sorted(Path(data_dir).glob("*.pdf"))
     if not pdf_files:
         logger.warning(f"No PDF files found in {data_dir}")
-        return []
+        return {}
     
-    logger.info(f"Found {len(pdf_files)} PDF files")
-    
-    all_sampled_chunks = []
+    saved = index_storage.load_index(config.INDEX_DIR)
+    manifest, entries = (saved[0], saved[1]) if saved is not None else ({}, [])
+    saved_sources = manifest.get("sources", {})
+    entries_by_file = {}
+    for entry in entries:
+        entries_by_file.setdefault(entry["file"], []).append(entry)
     
+    chunks_by_file = {}
     for pdf_file in pdf_files:
-        # Загружаем PDF
-        loader = PyPDFLoader(str(pdf_file))
-        pages = loader.load()
-        
-        # Разбиваем на чанки
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50
-        )
-        chunks = text_splitter.split_documents(pages)
+        if pdf_file.name in entries_by_file and saved_sources.get(pdf_file.name) == index_storage.file_sha256(pdf_file):
+            chunks_by_file[pdf_file.name] = entries_by_file[pdf_file.name]
+            continue
         
+        import indexer
+        logger.info(f"{pdf_file.name} is not in the saved index, parsing")
+        chunks_by_file[pdf_file.name] = [
+            {"id": index_storage.chunk_hash(doc.page_content, doc.metadata), "text": doc.page_content, "metadata": doc.metadata}
+            for doc in indexer.load_source_file(pdf_file)
+        ]
+    
+    return chunks_by_file
+
+def load_and_sample_pdf_chunks(data_dir: str, samples_per_file: int = 2) -> List[Dict[str, Any]]:
+    """
+    Выборка чанков PDF документов для синтеза вопросов
+    
+    Выборка равномерная и детерминированная: при повторном запуске выбираются
+    те же чанки, и уже синтезированные пары берутся из checkpoint.
+    
+    Args:
+        data_dir: путь к директории с PDF файлами
+        samples_per_file: количество чанков для выборки из каждого файла
+    
+    Returns:
+        Список чанков {"id", "text", "metadata"}
+    """
+    chunks_by_file = load_pdf_chunks(data_dir)
+    if chunks_by_file:
+        logger.info(f"Found {len(chunks_by_file)} PDF files")
+    
+    all_sampled_chunks = []
+    
+    for file_name, chunks in chunks_by_file.items():
         if not chunks:
-            logger.warning(f"No chunks created from {pdf_file.name}")
+            logger.warning(f"No chunks created from {file_name}")
             continue
         
         # Равномерная выборка чанков
@@ -57,7 +90,7 @@ def load_and_sample_pdf_chunks(data_dir: str, samples_per_file: int = 2) -> List
         sampled_chunks = [chunks[i * step] for i in range(num_samples)]
         
         all_sampled_chunks.extend(sampled_chunks)
-        logger.info(f"Sampled {len(sampled_chunks)} chunks from {pdf_file.name}")
+        logger.info(f"Sampled {len(sampled_chunks)} chunks from {file_name}")
     
     return all_sampled_chunks
 
@@ -110,13 +143,63 @@ def load_json_qa_pairs(data_dir: str, samples_per_file: int = 2) -> List[Dict[st
     
     return all_qa_pairs
 
-def synthesize_qa_pairs_from_pdf(chunks: List, llm_model: str = "gpt-4o") -> List[Dict[str, Any]]:
+class SynthesisCheckpoint:
+    """
+    JSONL файл с уже синтезированными парами (по строке на пару, с id чанка)
+    
+    Каждая пара дописывается сразу после ответа LLM: прерванный синтез продолжается
+    с необработанных чанков. Для чанка без годных пар пишется маркер
+    {"metadata": {"chunk_id", "type": "empty"}}, чтобы он не запрашивался снова.
+    """
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+    
+    def load(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Пары по id чанка"""
+        done = {}
+        if not self.path.exists():
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    qa_pair = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка (процесс остановлен во время записи)
+                    continue
+                pairs = done.setdefault(qa_pair["metadata"]["chunk_id"], [])
+                if qa_pair["metadata"].get("type") != "empty":
+                    pairs.append(qa_pair)
+        return done
+    
+    def append(self, chunk_id: str, qa_pairs: List[Dict[str, Any]]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        records = qa_pairs or [{"metadata": {"chunk_id": chunk_id, "type": "empty"}}]
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for qa_pair in records:
+                f.write(json.dumps(qa_pair, ensure_ascii=False) + "\n")
+    
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+async def synthesize_qa_pairs_from_pdf(
+    chunks: List[Dict[str, Any]],
+    llm_model: str = "gpt-4o",
+    concurrency: int | None = None,
+) -> List[Dict[str, Any]]:
     """
     Синтез вопросов и ответов из PDF чанков через LLM
     
+    Чанки обрабатываются параллельно (не более concurrency запросов к LLM одновременно),
+    ответ LLM - structured output по схеме QAPairs. Пары чанков из checkpoint
+    (SYNTHESIS_CHECKPOINT_PATH) не синтезируются повторно.
+    
     Args:
-        chunks: список чанков документов
+        chunks: список чанков {"id", "text", "metadata"}
         llm_model: модель для синтеза
+        concurrency: одновременных запросов (по умолчанию SYNTHESIS_CONCURRENCY)
     
     Returns:
         Список Q&A пар в формате: {question, ground_truth, contexts, metadata}
@@ -124,7 +207,13 @@ def synthesize_qa_pairs_from_pdf(chunks: List, llm_model: str = "gpt-4o") -> Lis
     if not chunks:
         return []
     
-    llm = ChatOpenAI(model=llm_model, temperature=0.7)
+    concurrency = concurrency or config.SYNTHESIS_CONCURRENCY
+    checkpoint = SynthesisCheckpoint(config.SYNTHESIS_CHECKPOINT_PATH)
+    done = checkpoint.load()
+    
+    # Повторы при rate limit и сетевых ошибках - в клиенте OpenAI (экспоненциальная пауза)
+    llm = ChatOpenAI(model=llm_model, temperature=0.7, max_retries=config.SYNTHESIS_MAX_RETRIES)
+    structured_llm = llm.with_structured_output(QAPairs, method=config.SYNTHESIS_STRUCTURED_OUTPUT)
     
     synthesis_prompt = ChatPromptTemplate.from_messages([
         ("system", """
@@ -138,87 +227,82 @@ def synthesize_qa_pairs_from_pdf(chunks: List, llm_model: str = "gpt-4o") -> Lis
 - На русском языке
 
 Для вопроса также создай краткий точный ответ на основе текста.
-
-ВАЖНО: Верни ТОЛЬКО валидный JSON без дополнительного текста:
-{{
-  "qa_pairs": [
-    {{"question": "...", "answer": "..."}}
-  ]
-}}
+Ответ верни в JSON: список qa_pairs с полями question и answer.
         """),
         ("human", "Текст:\n{chunk_text}")
     ])
     
-    qa_pairs = []
-    
-    for i, chunk in enumerate(chunks):
-        if len(chunk.page_content.strip()) < 100:
-            logger.warning(f"Chunk {i} too short, skipping")
+    pending = []
+    for chunk in chunks:
+        if chunk["id"] in done:
             continue
-        
-        try:
-            response = llm.invoke(
-                synthesis_prompt.format_messages(
-                    chunk_text=chunk.page_content[:2000]
+        if len(chunk["text"].strip()) < 100:
+            logger.warning(f"Chunk {chunk['id'][:12]} too short, skipping")
+            continue
+        pending.append(chunk)
+    if done:
+        logger.info(f"Checkpoint {checkpoint.path}: {len(done)} chunks already synthesized, {len(pending)} left")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    completed = 0
+    
+    async def synthesize_chunk(chunk: Dict[str, Any]):
+        nonlocal completed
+        async with semaphore:
+            try:
+                response = await structured_llm.ainvoke(
+                    synthesis_prompt.format_messages(chunk_text=chunk["text"][:2000])
                 )
-            )
-            
-            # Парсим JSON ответ
-            content = response.content.strip()
-            
-            # Извлекаем JSON из ответа (может быть обернут в markdown)
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                parts = content.split("```")
-                if len(parts) >= 2:
-                    content = parts[1].strip()
-                    if content.startswith("json"):
-                        content = content[4:].strip()
-            
-            # Убираем возможные префиксы/суффиксы
-            content = content.strip()
-            if not content.startswith("{"):
-                idx = content.find("{")
-                if idx >= 0:
-                    content = content[idx:]
-            
-            data = json.loads(content)
-            
-            for qa in data.get("qa_pairs", []):
-                if "question" in qa and "answer" in qa:
-                    qa_pairs.append({
-                        "question": qa["question"],
-                        "ground_truth": qa["answer"],
-                        "contexts": [chunk.page_content],
+                # function_calling возвращает None, если модель не вызвала инструмент
+                if response is None:
+                    raise ValueError("no structured output in LLM response")
+                qa_pairs = [
+                    {
+                        "question": qa.question,
+                        "ground_truth": qa.answer,
+                        "contexts": [chunk["text"]],
                         "metadata": {
-                            "source": chunk.metadata.get("source", "unknown"),
-                            "page": chunk.metadata.get("page", -1),
-                            "type": "synthesized"
+                            "source": chunk["metadata"].get("source", "unknown"),
+                            "page": chunk["metadata"].get("page", -1),
+                            "type": "synthesized",
+                            "chunk_id": chunk["id"],
                         }
-                    })
-            
-            if (i + 1) % 5 == 0:
-                logger.info(f"Processed {i + 1}/{len(chunks)} chunks, created {len(qa_pairs)} Q&A pairs")
+                    }
+                    for qa in response.qa_pairs
+                    if qa.question.strip() and qa.answer.strip()
+                ]
+            except Exception as e:
+                # Чанк считается неудачным и будет запрошен снова при следующем запуске
+                logger.error(f"Error processing chunk {chunk['id'][:12]}: {e}")
+                return
         
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error for chunk {i}: {e}")
-            logger.debug(f"LLM response: {content[:200]}...")
-            continue
-        except Exception as e:
-            logger.error(f"Error processing chunk {i}: {e}")
-            continue
-    
-    logger.info(f"Total synthesized {len(qa_pairs)} Q&A pairs from PDF")
+        # Сразу в checkpoint - при остановке процесса пара не теряется
+        checkpoint.append(chunk["id"], qa_pairs)
+        done[chunk["id"]] = qa_pairs
+        
+        completed += 1
+        if completed % 10 == 0:
+            logger.info(f"Processed {completed}/{len(pending)} chunks")
+    
+    await asyncio.gather(*[synthesize_chunk(chunk) for chunk in pending])
+    
+    # Порядок пар - как порядок чанков (не зависит от порядка завершения запросов)
+    qa_pairs = [qa_pair for chunk in chunks for qa_pair in done.get(chunk["id"], [])]
+    failed = sum(1 for chunk in pending if chunk["id"] not in done)
+    logger.info(
+        f"Total synthesized {len(qa_pairs)} Q&A pairs from PDF"
+        + (f" ({failed} chunks failed, rerun to retry)" if failed else "")
+    )
     return qa_pairs
 
-def create_dataset(data_dir: str, samples_per_file: int = 2) -> List[Dict[str, Any]]:
+def create_dataset(data_dir: str, samples_per_file: int = 2, concurrency: int | None = None) -> List[Dict[str, Any]]:
     """
     Создание полного датасета: синтез из PDF + готовые из JSON
     
     Args:
         data_dir: путь к директории с документами
         samples_per_file: количество примеров на файл
+        concurrency: одновременных запросов к LLM (по умолчанию SYNTHESIS_CONCURRENCY)
     
     Returns:
         Объединенный список Q&A пар
@@ -228,7 +312,7 @@ def create_dataset(data_dir: str, samples_per_file: int = 2) -> List[Dict[str, A
     # 1. Синтезируем из PDF
     logger.info("\n=== Synthesizing Q&A pairs from PDF ===")
     pdf_chunks = load_and_sample_pdf_chunks(data_dir, samples_per_file)
-    pdf_qa_pairs = synthesize_qa_pairs_from_pdf(pdf_chunks)
+    pdf_qa_pairs = asyncio.run(synthesize_qa_pairs_from_pdf(pdf_chunks, concurrency=concurrency))
     
     # 2. Загружаем готовые из JSON
     logger.info("\n=== Loading Q&A pairs from JSON ===")
@@ -330,17 +414,21 @@ def main():
     parser.add_argument("--create", action="store_true", help="Create and save dataset locally")
     parser.add_argument("--upload", action="store_true", help="Upload existing dataset to LangSmith")
     parser.add_argument("--samples", type=int, default=2, help="Number of samples per file")
+    parser.add_argument("--concurrency", type=int, default=None, help="Parallel LLM requests (default: SYNTHESIS_CONCURRENCY)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the synthesis checkpoint and start over")
     args = parser.parse_args()
     
     # Пути
     data_dir = config.DATA_DIR
-    dataset_path = "datasets/06-rag-qa-dataset.json"
+    dataset_path = config.LOCAL_DATASET_PATH
     dataset_name = config.LANGSMITH_DATASET
     
     # Создание датасета
     if args.create:
         logger.info("=== Creating dataset ===")
-        qa_pairs = create_dataset(data_dir, samples_per_file=args.samples)
+        if args.fresh:
+            SynthesisCheckpoint(config.SYNTHESIS_CHECKPOINT_PATH).clear()
+        qa_pairs = create_dataset(data_dir, samples_per_file=args.samples, concurrency=args.concurrency)
         save_dataset(qa_pairs, dataset_path)
     
     # Загрузка в LangSmith
@@ -0,0 +1,251 @@
+"""
+Кеш embeddings на диске (content-addressed)
+
+Ключ записи - SHA-256 от (провайдер, модель, флаг нормализации, тип запроса, текст),
+значение - вектор float32. Кеш общий для индексации (indexer.py) и RAGAS (evaluation.py):
+одинаковые тексты не отправляются провайдеру повторно между перезапусками и прогонами.
+
+Хранилище - SQLite файл с ограничением по количеству записей (вытеснение LRU по времени
+последнего обращения). Чтение не пишет на диск: время обращения копится в памяти
+и записывается пачкой (в set_many или при накоплении ACCESS_FLUSH_SIZE ключей),
+число записей тоже хранится в памяти. CachedEmbeddings прозрачно оборачивает OpenAIEmbeddings
+и HuggingFaceEmbeddings и реализует тот же интерфейс Embeddings.
+"""
+import asyncio
+import atexit
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Глобальная статистика по всем обернутым embeddings
+_stats = {
+    "hits": 0,          # тексты, найденные в кеше
+    "misses": 0,        # тексты, отправленные провайдеру
+    "saved_calls": 0,   # вызовы провайдера, полностью обслуженные кешем
+    "provider_calls": 0,
+}
+_stats_lock = threading.Lock()
+
+# Общие экземпляры кеша (по пути к файлу)
+_caches = {}
+
+# Сколько обращений к записям копить в памяти до записи last_access на диск
+ACCESS_FLUSH_SIZE = 1000
+
+
+class EmbeddingCache:
+    """Хранилище векторов в SQLite с LRU-вытеснением"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # check_same_thread=False - доступ из потоков RAGAS/индексации защищен self._lock
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        # Полный подсчет один раз при открытии, дальше счетчик ведется в set_many
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        # key -> время последнего обращения, еще не записанное на диск
+        self._pending_access = {}
+
+    def _flush_access(self):
+        """Запись накопленных last_access (вызывается под self._lock)"""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE embeddings SET last_access = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._pending_access.items()]
+        )
+        self._pending_access.clear()
+
+    def flush(self):
+        """Сброс накопленных обращений на диск"""
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+
+    def get_many(self, keys: list) -> dict:
+        """Поиск векторов по ключам, время обращения запоминается в памяти"""
+        if not keys:
+            return {}
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite ограничивает число параметров в запросе - читаем пачками
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            now = time.time()
+            for key in found:
+                self._pending_access[key] = now
+            if len(self._pending_access) >= ACCESS_FLUSH_SIZE:
+                self._flush_access()
+                self._conn.commit()
+        return found
+
+    def set_many(self, items: dict):
+        """Сохранение векторов и вытеснение самых старых записей сверх лимита"""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            # Время обращений нужно на диске до вытеснения, иначе LRU удалит недавно прочитанное
+            self._flush_access()
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            ).rowcount
+            if inserted < len(rows):
+                # Часть ключей уже была в кеше - обновляем их на месте
+                self._conn.executemany(
+                    "UPDATE embeddings SET vector = ?, last_access = ? WHERE key = ?",
+                    [(blob, accessed, key) for key, blob, accessed in rows]
+                )
+            self._count += inserted
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+                self._count -= evicted
+                logger.info(f"Embedding cache: evicted {evicted} least recently used entries")
+            self._conn.commit()
+
+    def count(self) -> int:
+        return self._count
+
+
+def get_cache() -> EmbeddingCache:
+    """Общий экземпляр кеша для пути из конфига"""
+    path = config.EMBEDDING_CACHE_PATH
+    if path not in _caches:
+        _caches[path] = EmbeddingCache(path, config.EMBEDDING_CACHE_MAX_ENTRIES)
+        atexit.register(_caches[path].flush)
+        logger.info(f"Embedding cache opened: {path} (max {config.EMBEDDING_CACHE_MAX_ENTRIES} entries)")
+    return _caches[path]
+
+
+def _record(hits: int, misses: int, provider_called: bool):
+    with _stats_lock:
+        _stats["hits"] += hits
+        _stats["misses"] += misses
+        if provider_called:
+            _stats["provider_calls"] += 1
+        else:
+            _stats["saved_calls"] += 1
+
+
+class CachedEmbeddings(Embeddings):
+    """Обертка над любыми LangChain Embeddings с кешем на диске"""
+
+    def __init__(self, underlying: Embeddings, namespace: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.namespace = namespace
+        self.cache = cache
+
+    def _key(self, text: str, kind: str) -> str:
+        payload = f"{self.namespace}\x00{kind}\x00{text}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+
+        keys = [self._key(text, "document") for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Тексты без векторов в кеше (дубликаты отправляем провайдеру один раз)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.set_many(computed)
+            found.update(computed)
+
+        _record(hits=len(texts) - len(missing), misses=len(missing), provider_called=bool(missing))
+        return [list(found[key]) for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key(text, "query")
+        found = self.cache.get_many([key])
+        if key in found:
+            _record(hits=1, misses=0, provider_called=False)
+            return found[key]
+
+        vector = self.underlying.embed_query(text)
+        self.cache.set_many({key: vector})
+        _record(hits=0, misses=1, provider_called=True)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        # Обращения к SQLite - в отдельном потоке: во время /index lock кеша держат
+        # пачки индексации, и ожидание на нем остановило бы event loop бота
+        key = self._key(text, "query")
+        found = await asyncio.to_thread(self.cache.get_many, [key])
+        if key in found:
+            _record(hits=1, misses=0, provider_called=False)
+            return found[key]
+
+        vector = await self.underlying.aembed_query(text)
+        await asyncio.to_thread(self.cache.set_many, {key: vector})
+        _record(hits=0, misses=1, provider_called=True)
+        return vector
+
+
+def wrap(embeddings: Embeddings, provider: str, model: str, normalize: bool) -> Embeddings:
+    """
+    Оборачивает embeddings кешем (если EMBEDDING_CACHE_ENABLED=true)
+
+    Args:
+        embeddings: исходные OpenAIEmbeddings / HuggingFaceEmbeddings
+        provider, model, normalize: параметры, от которых зависит вектор (часть ключа кеша)
+    """
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    namespace = f"{provider}|{model}|normalize={normalize}"
+    return CachedEmbeddings(embeddings, namespace, get_cache())
+
+
+def get_stats() -> dict:
+    """Статистика кеша: попадания, промахи, hit rate и сэкономленные вызовы провайдера"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    stats["enabled"] = config.EMBEDDING_CACHE_ENABLED
+    if config.EMBEDDING_CACHE_ENABLED and config.EMBEDDING_CACHE_PATH in _caches:
+        stats["entries"] = _caches[config.EMBEDDING_CACHE_PATH].count()
+    return stats
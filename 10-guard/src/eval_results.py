@@ -0,0 +1,141 @@
+"""
+Локальное хранилище результатов offline evaluation
+
+Каждый прогон - JSON файл в EVAL_RESULTS_DIR: настройки (модель агента, retrieval, судья),
+средние метрики, оценки по примерам и время выполнения. Новый прогон сравнивается
+с предыдущим прогоном того же датасета: изменение средних метрик и примеры,
+оценки которых изменились сильнее всего.
+"""
+import hashlib
+import json
+import logging
+import math
+import time
+from pathlib import Path
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько самых изменившихся примеров показывать в сравнении
+TOP_CHANGES = 5
+# Изменение метрики меньше - не считается изменением
+DIFF_EPSILON = 0.01
+
+
+def example_id(question: str) -> str:
+    """Id примера для сравнения прогонов (по тексту вопроса)"""
+    return hashlib.sha1(question.encode('utf-8')).hexdigest()[:12]
+
+
+def _clean(value):
+    """NaN -> None (NaN не является валидным JSON)"""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def _run_files(dataset_name: str) -> list[Path]:
+    directory = Path(config.EVAL_RESULTS_DIR)
+    if not directory.exists():
+        return []
+    return sorted(directory.glob(f"{dataset_name}__*.json"))
+
+
+def load_previous(dataset_name: str) -> dict | None:
+    """Последний сохраненный прогон датасета"""
+    files = _run_files(dataset_name)
+    if not files:
+        return None
+    with open(files[-1], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_run(dataset_name: str, settings: dict, metrics: dict, examples: list[dict], latency: dict) -> Path:
+    """
+    Сохранение прогона
+
+    Args:
+        examples: [{"question", "answer", "scores": {metric: score}}]
+    """
+    created_at = time.strftime("%Y%m%d-%H%M%S")
+    record = {
+        "dataset": dataset_name,
+        "created_at": created_at,
+        "settings": settings,
+        "metrics": {name: _clean(value) for name, value in metrics.items()},
+        "latency": latency,
+        "examples": [
+            {
+                "id": example_id(example["question"]),
+                "question": example["question"],
+                "answer": example["answer"],
+                "scores": {name: _clean(value) for name, value in example["scores"].items()},
+            }
+            for example in examples
+        ],
+    }
+    path = Path(config.EVAL_RESULTS_DIR) / f"{dataset_name}__{created_at}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    logger.info(f"Evaluation results saved to {path}")
+    return path
+
+
+def diff_runs(previous: dict, metrics: dict, examples: list[dict]) -> dict:
+    """
+    Сравнение текущего прогона с предыдущим
+
+    Returns:
+        dict: {
+            "previous": время предыдущего прогона,
+            "metrics": {metric: {"previous", "current", "delta"}},
+            "changed_examples": [{"question", "metric", "previous", "current", "delta"}] - по убыванию |delta|
+        }
+    """
+    metric_diff = {}
+    for name, current in metrics.items():
+        before = previous["metrics"].get(name)
+        current = _clean(current)
+        delta = current - before if before is not None and current is not None else None
+        metric_diff[name] = {"previous": before, "current": current, "delta": delta}
+
+    previous_scores = {example["id"]: example["scores"] for example in previous["examples"]}
+    changes = []
+    for example in examples:
+        before_scores = previous_scores.get(example_id(example["question"]))
+        if before_scores is None:
+            continue
+        for name, current in example["scores"].items():
+            before, current = before_scores.get(name), _clean(current)
+            if before is None or current is None or abs(current - before) < DIFF_EPSILON:
+                continue
+            changes.append({
+                "question": example["question"], "metric": name,
+                "previous": before, "current": current, "delta": current - before,
+            })
+    changes.sort(key=lambda change: abs(change["delta"]), reverse=True)
+
+    return {
+        "previous": previous["created_at"],
+        "metrics": metric_diff,
+        "changed_examples": changes[:TOP_CHANGES],
+        "changed_total": len(changes),
+    }
+
+
+def format_diff(diff: dict) -> str:
+    """Текстовый отчет о сравнении (для лога и CLI)"""
+    lines = [f"Сравнение с прогоном {diff['previous']}:"]
+    for name, values in diff["metrics"].items():
+        if values["delta"] is None:
+            lines.append(f"  {name}: {values['current']} (было {values['previous']})")
+            continue
+        arrow = "⬆️" if values["delta"] > DIFF_EPSILON else "⬇️" if values["delta"] < -DIFF_EPSILON else "➡️"
+        lines.append(f"  {arrow} {name}: {values['previous']:.3f} -> {values['current']:.3f} ({values['delta']:+.3f})")
+    if diff["changed_examples"]:
+        lines.append(f"Изменившиеся оценки примеров: {diff['changed_total']}, самые большие:")
+        for change in diff["changed_examples"]:
+            lines.append(
+                f"  {change['delta']:+.2f} {change['metric']}: {change['question'][:80]}"
+            )
+    return "\n".join(lines)
@@ -1,10 +1,18 @@
+import asyncio
 import logging
 import os
+import random
+import time
+import uuid
 from typing import Optional, Dict, Any
 
+import numpy as np
+import pandas as pd
+
 # Подавляем ошибку Git для ragas (если Git не установлен)
 os.environ.setdefault('GIT_PYTHON_REFRESH', 'quiet')
 
+import ragas
 from langsmith import Client
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -23,6 +31,10 @@ from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.run_config import RunConfig
 from config import config
+import embedding_cache
+import eval_results
+import feedback_uploader
+import ragas_cache
 
 logger = logging.getLogger(__name__)
 
@@ -34,20 +46,25 @@ def create_ragas_embeddings():
     """
     Фабрика для создания RAGAS embeddings по провайдеру из конфига
     Поддерживает: openai, huggingface
+    
+    Использует общий кеш embeddings (embedding_cache.py): ответы и эталоны,
+    не изменившиеся между прогонами, не отправляются провайдеру повторно
     """
     provider = config.RAGAS_EMBEDDING_PROVIDER.lower()
     
     if provider == "openai":
         logger.info(f"Creating RAGAS OpenAI embeddings: {config.RAGAS_EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        embeddings = OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        return embedding_cache.wrap(embeddings, provider, config.RAGAS_EMBEDDING_MODEL, False)
     
     elif provider == "huggingface":
         logger.info(f"Creating RAGAS HuggingFace embeddings: {config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL} on {config.RAGAS_HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.RAGAS_HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
         )
+        return embedding_cache.wrap(embeddings, provider, config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL, True)
     
     else:
         raise ValueError(f"Unknown RAGAS embedding provider: {provider}. Use 'openai' or 'huggingface'")
@@ -66,7 +83,14 @@ def init_ragas_metrics():
     logger.info("Initializing RAGAS metrics...")
     
     # Настройка LLM и embeddings для RAGAS (фиксированные модели для единообразной оценки)
-    langchain_llm = ChatOpenAI(model=config.RAGAS_LLM_MODEL, temperature=0)
+    # Судья: по умолчанию тот же OpenAI-совместимый API, что и у агента;
+    # RAGAS_LLM_BASE_URL - другой endpoint (например, локальный vLLM/Ollama или stub)
+    judge_kwargs = {}
+    if config.RAGAS_LLM_BASE_URL:
+        judge_kwargs["base_url"] = config.RAGAS_LLM_BASE_URL
+    if config.RAGAS_LLM_API_KEY:
+        judge_kwargs["api_key"] = config.RAGAS_LLM_API_KEY
+    langchain_llm = ChatOpenAI(model=config.RAGAS_LLM_MODEL, temperature=0, **judge_kwargs)
     langchain_embeddings = create_ragas_embeddings()
     
     # Создаем метрики
@@ -102,7 +126,7 @@ def init_ragas_metrics():
     _ragas_run_config = run_config
     
     logger.info(f"✓ RAGAS metrics initialized: {', '.join([m.name for m in metrics])}")
-    logger.info(f"✓ RAGAS LLM: {config.RAGAS_LLM_MODEL}")
+    logger.info(f"✓ RAGAS LLM: {config.RAGAS_LLM_MODEL}" + (f" ({config.RAGAS_LLM_BASE_URL})" if config.RAGAS_LLM_BASE_URL else ""))
     logger.info(f"✓ RAGAS Embedding Provider: {config.RAGAS_EMBEDDING_PROVIDER}")
     if config.RAGAS_EMBEDDING_PROVIDER == "openai":
         logger.info(f"✓ RAGAS Embedding Model: {config.RAGAS_EMBEDDING_MODEL}")
@@ -111,6 +135,202 @@ def init_ragas_metrics():
     
     return _ragas_metrics, _ragas_run_config
 
+def _is_rate_limit(error: Exception) -> bool:
+    """Ошибка rate limit API модели (HTTP 429)"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "rate limit" in str(error).lower()
+
+
+class RateLimitBackoff:
+    """
+    Общая пауза при rate limit для всех параллельных примеров
+    
+    Пример, получивший 429, ждет экспоненциально растущую паузу (с jitter),
+    и остальные примеры не отправляют новые запросы до ее окончания.
+    """
+    
+    def __init__(self, base_seconds: float, max_retries: int):
+        self.base_seconds = base_seconds
+        self.max_retries = max_retries
+        self._resume_at = 0.0
+        self.retries = 0
+    
+    async def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def backoff(self, attempt: int):
+        delay = self.base_seconds * 2 ** attempt * random.uniform(1, 1.5)
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        self.retries += 1
+        await self.wait()
+
+
+async def answer_example(question: str, backoff: RateLimitBackoff) -> tuple[dict, float]:
+    """
+    Ответ агента на вопрос примера (так же как в боте) с повторами при rate limit
+    
+    Важно: каждый вопрос должен быть в изолированном контексте (без истории).
+    Уникальный thread для каждого примера (и каждой попытки):
+    1. Вопросы не влияют друг на друга (нет истории диалога)
+    2. Одинаковые вопросы в датасете не делят историю
+    
+    Returns:
+        ({"answer", "documents"}, время выполнения в секундах)
+    """
+    from langchain_core.messages import HumanMessage
+    import agent
+    
+    start = time.perf_counter()
+    for attempt in range(backoff.max_retries + 1):
+        await backoff.wait()
+        thread_id = f"eval-{uuid.uuid4()}"
+        try:
+            result = await agent.agent_answer([HumanMessage(content=question)], thread_id, raise_errors=True)
+            break
+        except Exception as e:
+            if not _is_rate_limit(e) or attempt == backoff.max_retries:
+                raise
+            logger.warning(f"Rate limit on evaluation example (attempt {attempt + 1}), backing off")
+            await backoff.backoff(attempt)
+        finally:
+            # История примера больше не нужна
+            try:
+                await agent.bank_agent.checkpointer.adelete_thread(thread_id)
+            except Exception as e:
+                logger.warning(f"Failed to delete evaluation thread {thread_id}: {e}")
+    
+    # Возвращаем answer и documents для дальнейшей оценки
+    return {
+        "answer": result["answer"],
+        "documents": result["documents"]  # Содержит page_content для RAGAS
+    }, time.perf_counter() - start
+
+
+def document_text(doc) -> str:
+    """Текст источника: dict из expand_sources() или Document"""
+    if isinstance(doc, dict):
+        return doc.get("page_content", "")
+    return doc.page_content if hasattr(doc, 'page_content') else str(doc)
+
+
+def latency_report(latencies: list[float], wall_seconds: float) -> Dict[str, float]:
+    """Время выполнения эксперимента: общее и распределение по примерам"""
+    report = {"wall_seconds": wall_seconds, "examples": len(latencies)}
+    if latencies:
+        values = np.array(latencies)
+        report.update({
+            "mean_seconds": float(values.mean()),
+            "p50_seconds": float(np.percentile(values, 50)),
+            "p90_seconds": float(np.percentile(values, 90)),
+            "p95_seconds": float(np.percentile(values, 95)),
+            "max_seconds": float(values.max()),
+        })
+    return report
+
+
+# Примерное число вызовов LLM-судьи на один пример (для отчета о сэкономленных вызовах)
+# None - по вызову на каждый контекст
+JUDGE_LLM_CALLS = {
+    "faithfulness": 2,          # выделение утверждений + проверка по контексту
+    "answer_relevancy": 1,      # генерация вопроса по ответу (strictness=1)
+    "answer_correctness": 1,
+    "answer_similarity": 0,     # только embeddings
+    "context_recall": 1,
+    "context_precision": None,
+}
+
+
+def run_ragas_incremental(questions, answers, contexts_list, ground_truths, metrics, run_config):
+    """
+    RAGAS evaluation только для примеров, оценок которых нет в кеше
+    
+    Оценки (метрика, пример) берутся из ragas_cache; судья запускается только для
+    недостающих - примеры группируются по набору недостающих метрик, на каждую группу
+    один вызов evaluate(). Новые оценки (кроме NaN - ошибка судьи) сохраняются в кеш.
+    
+    Returns:
+        (DataFrame с оценками в порядке примеров, статистика кеша)
+    """
+    cache = ragas_cache.get_cache()
+    namespace = ragas_cache.judge_namespace(ragas.__version__)
+    n = len(questions)
+    
+    keys = {
+        metric.name: [
+            ragas_cache.example_key(metric.name, namespace, questions[i], answers[i],
+                                    contexts_list[i], ground_truths[i])
+            for i in range(n)
+        ]
+        for metric in metrics
+    }
+    cached = cache.get_many([key for metric_keys in keys.values() for key in metric_keys]) if cache else {}
+    
+    scores = {metric.name: [np.nan] * n for metric in metrics}
+    groups = {}  # набор недостающих метрик -> номера примеров
+    saved_calls = 0
+    for i in range(n):
+        missing = []
+        for metric in metrics:
+            key = keys[metric.name][i]
+            if key in cached:
+                scores[metric.name][i] = cached[key]
+                calls = JUDGE_LLM_CALLS.get(metric.name, 1)
+                saved_calls += len(contexts_list[i]) if calls is None else calls
+            else:
+                missing.append(metric.name)
+        if missing:
+            groups.setdefault(tuple(missing), []).append(i)
+    
+    metrics_by_name = {metric.name: metric for metric in metrics}
+    for metric_names, indices in groups.items():
+        logger.info(f"RAGAS: judging {len(indices)} examples on {', '.join(metric_names)}")
+        group_result = evaluate(
+            Dataset.from_dict({
+                "question": [questions[i] for i in indices],
+                "answer": [answers[i] for i in indices],
+                "contexts": [contexts_list[i] for i in indices],
+                "ground_truth": [ground_truths[i] for i in indices],
+            }),
+            metrics=[metrics_by_name[name] for name in metric_names],
+            run_config=run_config,
+        )
+        group_df = group_result.to_pandas()
+        new_scores = {}
+        for row, i in enumerate(indices):
+            for name in metric_names:
+                if name not in group_df.columns:
+                    continue
+                score = float(group_df[name].iloc[row])
+                scores[name][i] = score
+                if not np.isnan(score):
+                    new_scores[keys[name][i]] = (name, score)
+        if cache:
+            cache.set_many(new_scores)
+    
+    total_pairs = n * len(metrics)
+    stats = {
+        "cached_scores": len(cached),
+        "judged_scores": total_pairs - len(cached),
+        "examples_judged": len({i for indices in groups.values() for i in indices}),
+        "saved_judge_calls": saved_calls,
+    }
+    logger.info(
+        f"💾 RAGAS cache: {stats['cached_scores']}/{total_pairs} scores from cache, "
+        f"{stats['examples_judged']}/{n} examples judged, ~{saved_calls} judge LLM calls saved"
+    )
+    
+    ragas_df = pd.DataFrame({
+        "question": questions,
+        "answer": answers,
+        "contexts": contexts_list,
+        "ground_truth": ground_truths,
+        **scores,
+    })
+    return ragas_df, stats
+
+
 def check_dataset_exists(dataset_name: str) -> bool:
     """
     Проверка существования датасета в LangSmith
@@ -160,9 +380,9 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
     if not check_dataset_exists(dataset_name):
         raise ValueError(f"Dataset '{dataset_name}' not found in LangSmith")
     
-    # Инициализируем агента
+    # Инициализируем агента (один экземпляр на все примеры)
     import agent
-    agent.initialize_agent()
+    await agent.initialize_agent()
     logger.info("✓ Agent initialized for evaluation")
     
     # Инициализируем метрики
@@ -171,35 +391,21 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
     client = Client()
     
     # ========== Шаг 1: Запуск эксперимента и сбор данных ==========
-    logger.info("\n[1/3] Running experiment and collecting data...")
+    logger.info(f"\n[1/3] Running experiment and collecting data (concurrency {config.EVAL_MAX_CONCURRENCY})...")
+    
+    backoff = RateLimitBackoff(config.EVAL_BACKOFF_SECONDS, config.EVAL_MAX_RETRIES)
+    latencies = []
     
     # Создаем target функцию для evaluation агента
     async def target(inputs: dict) -> dict:
         """
         Target функция для LangSmith evaluation (async)
         
-        Эта функция вызывается для каждого примера из датасета.
-        Важно: каждый вопрос должен быть в изолированном контексте (без истории).
+        Эта функция вызывается для каждого примера из датасета (до EVAL_MAX_CONCURRENCY одновременно).
         """
-        from langchain_core.messages import HumanMessage
-        import agent
-        
-        question = inputs["question"]
-        
-        # Генерируем уникальный chat_id для каждого evaluation
-        # Это важно чтобы:
-        # 1. Вопросы не влияли друг на друга (нет истории диалога)
-        # 2. Каждый вопрос обрабатывался независимо
-        chat_id = hash(question) % 1000000
-        
-        # Вызываем агента так же как в боте
-        result = await agent.agent_answer([HumanMessage(content=question)], chat_id)
-        
-        # Возвращаем answer и documents для дальнейшей оценки
-        return {
-            "answer": result["answer"],
-            "documents": result["documents"]  # Содержит page_content для RAGAS
-        }
+        result, latency_seconds = await answer_example(inputs["question"], backoff)
+        latencies.append(latency_seconds)
+        return result
     
     # Собираем данные во время выполнения evaluate
     questions = []
@@ -209,10 +415,13 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
     run_ids = []
     
     # aevaluate() возвращает AsyncExperimentResults (async iterator)
+    # max_concurrency по умолчанию 0 - примеры выполнялись бы строго по очереди
+    experiment_start = time.perf_counter()
     experiment_results = await client.aevaluate(
         target,
         data=dataset_name,
         evaluators=[],
+        max_concurrency=config.EVAL_MAX_CONCURRENCY,
         experiment_prefix="rag-evaluation",
         metadata={
             "approach": "RAGAS batch evaluation + LangSmith feedback",
@@ -227,11 +436,16 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
         run = result["run"]
         example = result["example"]
         
+        # Пример завершился ошибкой (например, rate limit после всех повторов)
+        if run.error or not run.outputs:
+            logger.error(f"Evaluation example failed: {run.error}")
+            continue
+        
         # Получаем данные из run (фактический вызов) и example (ожидаемый ответ)
         question = run.inputs.get("question", "")
         answer = run.outputs.get("answer", "")
         documents = run.outputs.get("documents", [])
-        contexts = [doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in documents]
+        contexts = [document_text(doc) for doc in documents]
         ground_truth = example.outputs.get("answer", "") if example else ""
         
         questions.append(question)
@@ -240,28 +454,25 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
         ground_truths.append(ground_truth)
         run_ids.append(str(run.id))
     
+    latency = latency_report(latencies, time.perf_counter() - experiment_start)
+    latency["rate_limit_retries"] = backoff.retries
     logger.info(f"Experiment completed, collected {len(questions)} examples")
+    if latencies:
+        logger.info(
+            f"⏱️ Wall clock {latency['wall_seconds']:.1f}s, per example: "
+            f"p50 {latency['p50_seconds']:.1f}s, p90 {latency['p90_seconds']:.1f}s, "
+            f"p95 {latency['p95_seconds']:.1f}s, max {latency['max_seconds']:.1f}s "
+            f"(rate limit retries: {backoff.retries})"
+        )
     
     # ========== Шаг 2: RAGAS evaluation ==========
     logger.info("\n[2/3] Running RAGAS evaluation...")
     
-    # Создаем Dataset для RAGAS
-    ragas_dataset = Dataset.from_dict({
-        "question": questions,
-        "answer": answers,
-        "contexts": contexts_list,
-        "ground_truth": ground_truths
-    })
-    
-    # Запускаем evaluation
-    ragas_result = evaluate(
-        ragas_dataset,
-        metrics=ragas_metrics,
-        run_config=ragas_run_config,
+    # Судья запускается только для примеров, которых нет в кеше оценок
+    ragas_df, cache_stats = run_ragas_incremental(
+        questions, answers, contexts_list, ground_truths, ragas_metrics, ragas_run_config
     )
     
-    ragas_df = ragas_result.to_pandas()
-    
     logger.info("RAGAS evaluation completed")
     
     # Вычисляем средние значения метрик
@@ -275,26 +486,205 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
     # ========== Шаг 3: Загрузка feedback в LangSmith ==========
     logger.info("\n[3/3] Uploading feedback to LangSmith...")
     
+    feedback = []
     for idx, run_id in enumerate(run_ids):
         row = ragas_df.iloc[idx]
         
         for metric in ragas_metrics:
             if metric.name in row:
-                score = row[metric.name]
-                client.create_feedback(
+                feedback.append(feedback_uploader.make_feedback(
                     run_id=run_id,
                     key=metric.name,
-                    score=float(score),
+                    score=float(row[metric.name]),
                     comment=f"RAGAS metric: {metric.name}"
-                )
+                ))
+    
+    # Параллельно в пуле потоков, с повторами; незагруженное остается в spool файле
+    feedback_stats = await feedback_uploader.upload_feedback(feedback)
     
-    logger.info(f"Feedback uploaded ({len(run_ids)} runs)")
+    return {
+        "dataset_name": dataset_name,
+        "num_examples": len(questions),
+        "metrics": metrics_summary,
+        "ragas_df": ragas_df,
+        "ragas_cache": cache_stats,
+        "feedback": feedback_stats,
+        "run_ids": run_ids,
+        "latency": latency
+    }
+
+
+
+def load_local_dataset(dataset_path: str) -> list[dict]:
+    """Датасет из dataset_synthesizer.save_dataset(): [{"question", "ground_truth", "metadata"}]"""
+    import json
+    
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def ensure_index():
+    """
+    Индекс для агента при запуске evaluation вне бота
+    
+    Как при старте бота: сохраненный индекс из INDEX_DIR загружается с диска,
+    embeddings считаются только для новых/измененных документов.
+    Без индекса rag_search вернул бы пустой контекст, и метрики считались бы по пустым ответам.
+    """
+    import indexer
+    import rag
+    
+    if rag.retriever is not None:
+        return
+    
+    stats = await indexer.reindex_all()
+    if not stats or not stats.get("total"):
+        raise ValueError(
+            f"Index is empty: no documents in {config.DATA_DIR} and no saved index in {config.INDEX_DIR}"
+        )
+    logger.info(f"✓ Index loaded for evaluation: {stats['total']} chunks")
+
+
+async def evaluate_local(dataset_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Offline evaluation: локальный датасет, без LangSmith
+    
+    Агент запускается на примерах параллельно (EVAL_MAX_CONCURRENCY), судья - RAGAS
+    (модель и endpoint из RAGAS_LLM_*), результаты сохраняются в EVAL_RESULTS_DIR
+    и сравниваются с предыдущим прогоном того же датасета.
+    
+    Args:
+        dataset_path: путь к JSON датасету (по умолчанию LOCAL_DATASET_PATH)
+    
+    Returns:
+        dict с метриками, временем выполнения, статистикой кеша и сравнением с прошлым прогоном
+    """
+    if dataset_path is None:
+        dataset_path = config.LOCAL_DATASET_PATH
+    if not os.path.exists(dataset_path):
+        raise ValueError(f"Dataset file '{dataset_path}' not found. Create it with: make dataset")
+    
+    dataset = load_local_dataset(dataset_path)
+    dataset_name = os.path.splitext(os.path.basename(dataset_path))[0]
+    logger.info(f"Starting offline evaluation for {dataset_path} ({len(dataset)} examples)")
+    
+    await ensure_index()
+    
+    import agent
+    await agent.initialize_agent()
+    logger.info("✓ Agent initialized for evaluation")
+    
+    ragas_metrics, ragas_run_config = init_ragas_metrics()
+    
+    # ========== Шаг 1: Ответы агента ==========
+    logger.info(f"\n[1/2] Running agent on dataset (concurrency {config.EVAL_MAX_CONCURRENCY})...")
+    
+    backoff = RateLimitBackoff(config.EVAL_BACKOFF_SECONDS, config.EVAL_MAX_RETRIES)
+    semaphore = asyncio.Semaphore(config.EVAL_MAX_CONCURRENCY)
+    
+    async def run_example(item: dict):
+        async with semaphore:
+            try:
+                return await answer_example(item["question"], backoff)
+            except Exception as e:
+                # Пример завершился ошибкой (например, rate limit после всех повторов)
+                logger.error(f"Evaluation example failed: {e}")
+                return None
+    
+    experiment_start = time.perf_counter()
+    outputs = await asyncio.gather(*[run_example(item) for item in dataset])
+    
+    questions, answers, contexts_list, ground_truths, latencies = [], [], [], [], []
+    for item, output in zip(dataset, outputs):
+        if output is None:
+            continue
+        result, latency_seconds = output
+        questions.append(item["question"])
+        answers.append(result["answer"])
+        contexts_list.append([document_text(doc) for doc in result["documents"]])
+        ground_truths.append(item.get("ground_truth", ""))
+        latencies.append(latency_seconds)
+    
+    latency = latency_report(latencies, time.perf_counter() - experiment_start)
+    latency["rate_limit_retries"] = backoff.retries
+    logger.info(f"Agent completed {len(questions)}/{len(dataset)} examples in {latency['wall_seconds']:.1f}s")
+    
+    # ========== Шаг 2: RAGAS evaluation ==========
+    logger.info("\n[2/2] Running RAGAS evaluation...")
+    
+    ragas_df, cache_stats = run_ragas_incremental(
+        questions, answers, contexts_list, ground_truths, ragas_metrics, ragas_run_config
+    )
+    
+    metrics_summary = {}
+    for metric in ragas_metrics:
+        if metric.name in ragas_df.columns:
+            avg_score = ragas_df[metric.name].mean()
+            metrics_summary[metric.name] = avg_score
+            logger.info(f"  {metric.name}: {avg_score:.3f}")
+    
+    # ========== Сохранение и сравнение с предыдущим прогоном ==========
+    examples = [
+        {
+            "question": question,
+            "answer": answer,
+            "scores": {
+                metric.name: float(ragas_df.iloc[idx][metric.name])
+                for metric in ragas_metrics if metric.name in ragas_df.columns
+            },
+        }
+        for idx, (question, answer) in enumerate(zip(questions, answers))
+    ]
+    settings = {
+        "model": config.MODEL,
+        "embedding_model": config.EMBEDDING_MODEL,
+        "retrieval_mode": config.RETRIEVAL_MODE,
+        "judge_model": config.RAGAS_LLM_MODEL,
+        "judge_base_url": config.RAGAS_LLM_BASE_URL,
+    }
+    
+    previous = eval_results.load_previous(dataset_name)
+    results_path = eval_results.save_run(dataset_name, settings, metrics_summary, examples, latency)
+    diff = eval_results.diff_runs(previous, metrics_summary, examples) if previous else None
+    if diff:
+        logger.info(eval_results.format_diff(diff))
     
     return {
         "dataset_name": dataset_name,
         "num_examples": len(questions),
         "metrics": metrics_summary,
-        "ragas_result": ragas_result,
-        "run_ids": run_ids
+        "ragas_df": ragas_df,
+        "ragas_cache": cache_stats,
+        "latency": latency,
+        "diff": diff,
+        "results_path": str(results_path),
     }
 
+
+def main():
+    """CLI: offline evaluation на локальном датасете"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="RAG evaluation")
+    parser.add_argument("--local", action="store_true", help="Offline evaluation on a local JSON dataset")
+    parser.add_argument("--dataset", default=None, help="Path to dataset JSON (default: LOCAL_DATASET_PATH)")
+    args = parser.parse_args()
+    
+    if not args.local:
+        parser.print_help()
+        logger.error("\nLangSmith evaluation runs from the bot (/evaluate_dataset); use --local for offline mode")
+        return
+    
+    logging.basicConfig(level=logging.INFO)
+    try:
+        result = asyncio.run(evaluate_local(args.dataset))
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    print(f"\n📊 {result['dataset_name']}: {result['num_examples']} examples")
+    for name, score in result["metrics"].items():
+        print(f"  {name}: {score:.3f}")
+    print(f"Results: {result['results_path']}")
+
+
+if __name__ == "__main__":
+    main()
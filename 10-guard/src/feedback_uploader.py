@@ -0,0 +1,200 @@
+"""
+Загрузка RAGAS оценок в LangSmith как feedback
+
+Раньше шаг 3 evaluation вызывал client.create_feedback последовательно внутри async функции:
+(runs x metrics) блокирующих HTTP запросов подряд на event loop бота.
+Здесь:
+- запросы выполняются в пуле из FEEDBACK_UPLOAD_WORKERS потоков (event loop не блокируется)
+- временные ошибки (сеть, 408, 429, 5xx) повторяются с экспоненциальной паузой, до FEEDBACK_UPLOAD_RETRIES раз;
+  остальные 4xx не повторяются
+- у каждого feedback заранее сгенерирован feedback_id - повтор уже принятого запроса не создает дубль
+- перед загрузкой все feedback записываются в spool файл (JSONL, FEEDBACK_SPOOL_PATH),
+  после загрузки в нем остаются только незагруженные; они догружаются при следующем
+  /evaluate_dataset или командой make feedback-resume - без повторного запуска эксперимента
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import requests
+from langsmith import Client
+from langsmith.utils import (
+    LangSmithAuthError,
+    LangSmithConflictError,
+    LangSmithNotFoundError,
+    LangSmithUserError,
+)
+
+from urllib3.util import Retry
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Базовая пауза перед повтором (удваивается с каждой попыткой)
+BACKOFF_SECONDS = 1.0
+
+# Ошибки, которые не исправятся повтором
+PERMANENT_ERRORS = (LangSmithAuthError, LangSmithNotFoundError, LangSmithUserError)
+# 4xx, которые имеет смысл повторить (таймаут запроса и rate limit)
+RETRYABLE_STATUSES = {408, 429}
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Ошибка клиента (4xx), повтор которой даст тот же результат"""
+    if isinstance(error, PERMANENT_ERRORS):
+        return True
+    # Для прочих кодов (400, 403, 422...) LangSmith поднимает общий LangSmithError,
+    # исходный HTTPError с ответом сервера - в __context__
+    context = error.__context__
+    if isinstance(context, requests.HTTPError) and context.response is not None:
+        status = context.response.status_code
+        return 400 <= status < 500 and status not in RETRYABLE_STATUSES
+    return False
+
+
+def create_client() -> Client:
+    """LangSmith client без собственных повторов urllib3 - повторы и паузы в _upload_one"""
+    return Client(retry_config=Retry(total=0))
+
+
+def make_feedback(run_id: str, key: str, score: float, comment: str) -> dict:
+    """Запись feedback с собственным id (для идемпотентных повторов)"""
+    return {"id": str(uuid.uuid4()), "run_id": run_id, "key": key, "score": score, "comment": comment}
+
+
+class FeedbackSpool:
+    """JSONL файл с feedback, которые еще не загружены"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def load(self) -> list[dict]:
+        if not self.path.exists():
+            return []
+        items = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    items.append(json.loads(line))
+        return items
+
+    def save(self, items: list[dict]):
+        """Атомарная перезапись (пустой список - файл удаляется)"""
+        if not items:
+            self.path.unlink(missing_ok=True)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+def _send(client: Client, item: dict):
+    client.create_feedback(
+        run_id=item["run_id"],
+        key=item["key"],
+        score=item["score"],
+        comment=item["comment"],
+        feedback_id=item["id"],
+        # Повторы делаем сами (с общим лимитом и записью в spool)
+        stop_after_attempt=1,
+    )
+
+
+async def _upload_one(client: Client, executor: ThreadPoolExecutor, item: dict, max_retries: int) -> bool:
+    loop = asyncio.get_running_loop()
+    for attempt in range(max_retries + 1):
+        try:
+            await loop.run_in_executor(executor, partial(_send, client, item))
+            return True
+        except LangSmithConflictError:
+            # feedback с этим id уже есть - предыдущая попытка дошла до сервера
+            return True
+        except Exception as e:
+            if _is_permanent(e):
+                logger.error(f"Feedback {item['key']} for run {item['run_id']} rejected: {e}")
+                return False
+            if attempt == max_retries:
+                logger.warning(f"Feedback {item['key']} for run {item['run_id']} failed after {attempt + 1} attempts: {e}")
+                return False
+            await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt * random.uniform(1, 1.5))
+    return False
+
+
+async def upload_feedback(items: list[dict], client: Client | None = None) -> dict:
+    """
+    Загрузка feedback (вместе с оставшимися в spool от прошлых запусков)
+
+    Args:
+        items: новые feedback (make_feedback)
+        client: LangSmith client (по умолчанию - новый)
+
+    Returns:
+        dict: uploaded, failed, resumed (догружено из spool), skipped (NaN оценки), seconds
+    """
+    spool = FeedbackSpool(config.FEEDBACK_SPOOL_PATH)
+    pending = spool.load()
+
+    # NaN (судья не смог оценить) API не принимает - такие оценки не загружаются
+    valid = [item for item in items if not math.isnan(item["score"])]
+    skipped = len(items) - len(valid)
+
+    queue = list({item["id"]: item for item in pending + valid}.values())
+    # Сначала в spool - если процесс упадет во время загрузки, ничего не потеряется
+    spool.save(queue)
+    if not queue:
+        return {"uploaded": 0, "failed": 0, "resumed": 0, "skipped": skipped, "seconds": 0.0}
+    if pending:
+        logger.info(f"📤 Resuming {len(pending)} feedback items from spool {spool.path}")
+
+    client = client or create_client()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config.FEEDBACK_UPLOAD_WORKERS, thread_name_prefix="feedback") as executor:
+        results = await asyncio.gather(*[
+            _upload_one(client, executor, item, config.FEEDBACK_UPLOAD_RETRIES) for item in queue
+        ])
+
+    failed = [item for item, ok in zip(queue, results) if not ok]
+    spool.save(failed)
+
+    stats = {
+        "uploaded": len(queue) - len(failed),
+        "failed": len(failed),
+        "resumed": len(pending),
+        "skipped": skipped,
+        "seconds": time.perf_counter() - start,
+    }
+    logger.info(
+        f"📤 Feedback uploaded: {stats['uploaded']}/{len(queue)} in {stats['seconds']:.1f}s "
+        f"({config.FEEDBACK_UPLOAD_WORKERS} workers)"
+        + (f", {len(failed)} left in spool {spool.path}" if failed else "")
+    )
+    return stats
+
+
+def main():
+    """CLI: догрузка feedback из spool файла"""
+    logging.basicConfig(level=logging.INFO)
+    if not config.LANGSMITH_API_KEY:
+        logger.error("LANGSMITH_API_KEY not set")
+        return
+    pending = FeedbackSpool(config.FEEDBACK_SPOOL_PATH).load()
+    if not pending:
+        logger.info(f"Spool {config.FEEDBACK_SPOOL_PATH} is empty - nothing to upload")
+        return
+    asyncio.run(upload_feedback([]))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ from config import config
 import indexer
 import rag
 import agent
+from streaming import TelegramStreamer
+from scheduler import QueueFull, Superseded, scheduler
 
 # Подавляем ошибку Git для ragas (если Git не установлен)
 os.environ.setdefault('GIT_PYTHON_REFRESH', 'quiet')
@@ -62,7 +64,7 @@ def format_sources(documents):
 async def cmd_start(message: Message):
     logger.info(f"User {message.chat.id} started the bot")
     
-    # История управляется агентом через MemorySaver (thread_id = chat_id)
+    # История управляется агентом через checkpointer (thread_id = chat_id)
     # Здесь только отправляем приветствие
     await message.answer(
         "Привет! Я ReAct Agent ассистент Сбербанка.\n\n"
@@ -88,6 +90,7 @@ async def cmd_help(message: Message):
         "🏦 `search_products` \\- актуальные продукты банка \\(MCP\\)\n"
         "💱 `currency_converter` \\- курсы валют ЦБ РФ \\(MCP\\)\n"
         "💰 `deposit_income_calculator` \\- расчет дохода по вкладу \\(MCP\\)\n"
+        "📊 `deposit_comparison` \\- сравнение вариантов вклада \\(MCP\\)\n"
         "💳 `open_credit_card` \\- открытие карты \\(MCP\\, требует подтверждения\\)\n\n"
         "*📋 Доступные команды:*\n"
         "/start \\- Начать новый диалог\n"
@@ -125,14 +128,16 @@ async def cmd_index(message: Message):
     await message.answer("Начинаю переиндексацию документов...")
     
     try:
-        result = await indexer.reindex_all()
-        if result and result[0] is not None:
-            rag.vector_store, rag.chunks = result
-            rag.initialize_retriever()
+        # Инкрементальная переиндексация: embeddings только для новых/измененных чанков
+        # Параллельные /index выполняются по очереди, индекс применяется внутри reindex_all
+        reindex_stats = await indexer.reindex_all()
+        if reindex_stats:
             stats = rag.get_vector_store_stats()
             await message.answer(
                 f"✅ Переиндексация завершена!\n"
                 f"Проиндексировано документов: {stats['count']}\n"
+                f"Новых/измененных чанков: {reindex_stats.get('embedded', 0)}\n"
+                f"Удалено чанков: {reindex_stats.get('removed', 0)}\n"
                 f"Режим: {stats['retrieval_mode']}\n"
                 f"Провайдер: {stats['embedding_provider']}"
             )
@@ -175,6 +180,12 @@ async def cmd_index_status(message: Message):
             f"• Reranker top k: {stats.get('reranker_top_k', 'N/A')}\n"
             f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]}\n"
         )
+        reranker_stats = stats.get('reranker', {})
+        if reranker_stats:
+            status_text += (
+                f"• Reranker: {reranker_stats['backend']}, "
+                f"кеш score {reranker_stats['cache_hit_rate']:.0%}\n"
+            )
     
     # Информация об embeddings
     status_text += f"\n🧬 *Embeddings: {stats['embedding_provider']}*\n"
@@ -186,6 +197,32 @@ async def cmd_index_status(message: Message):
             f"• Устройство: {stats.get('device', 'N/A')}\n"
         )
     
+    cache_stats = stats.get('embedding_cache', {})
+    if cache_stats.get('enabled'):
+        status_text += (
+            f"• Кеш: hit rate {cache_stats['hit_rate']:.0%}, "
+            f"сэкономлено вызовов {cache_stats['saved_calls']}\n"
+        )
+    
+    # Планировщик запусков агента
+    scheduler_stats = scheduler.get_stats()
+    status_text += (
+        f"\n🚦 *Планировщик*\n"
+        f"• Выполняется: {scheduler_stats['running']}/{scheduler_stats['max_concurrent']}, "
+        f"в очереди: {scheduler_stats['waiting']}\n"
+        f"• Ожидание p50/p95: {scheduler_stats['wait_p50_ms']:.0f}/{scheduler_stats['wait_p95_ms']:.0f} мс\n"
+        f"• Отменено новыми сообщениями: {scheduler_stats['superseded']}, отказов: {scheduler_stats['rejected']}\n"
+    )
+    
+    # История в запросах к модели
+    if agent.history_budget is not None:
+        history_stats = agent.history_budget.get_stats()
+        status_text += (
+            f"\n✂️ *История: бюджет {agent.history_budget.max_tokens} токенов*\n"
+            f"• Урезано вызовов: {history_stats['trimmed_calls']}/{history_stats['calls']}\n"
+            f"• Сэкономлено: ~{history_stats['tokens_saved']} токенов, summary: {history_stats['summaries']}\n"
+        )
+    
     await message.answer(status_text, parse_mode="Markdown")
 
 @router.message(Command("evaluate_dataset"))
@@ -212,7 +249,8 @@ async def cmd_evaluate_dataset(message: Message):
     if not config.LANGSMITH_API_KEY:
         await message.answer(
             "⚠️ LangSmith API key не настроен.\n"
-            "Установите LANGSMITH_API_KEY в .env файле для использования evaluation."
+            "Установите LANGSMITH_API_KEY в .env файле для использования evaluation.\n"
+            "Без LangSmith: make eval-local (offline evaluation на локальном датасете)."
         )
         return
     
@@ -277,7 +315,29 @@ async def cmd_evaluate_dataset(message: Message):
                 emoji = "🔴"
             report += f"{emoji} {desc}: {score:.3f}\n"
         
-        report += "\n💡 Результаты загружены в LangSmith как feedback"
+        cache_stats = result.get("ragas_cache", {})
+        if cache_stats.get("cached_scores"):
+            report += (
+                f"\n💾 Из кеша: {cache_stats['cached_scores']} оценок, "
+                f"судья запускался на {cache_stats['examples_judged']} из {num_examples} примеров "
+                f"(~{cache_stats['saved_judge_calls']} вызовов LLM сэкономлено)\n"
+            )
+        
+        latency = result.get("latency", {})
+        if latency.get("examples"):
+            report += (
+                f"\n⏱️ Время: {latency['wall_seconds']:.0f} с всего, на пример "
+                f"p50 {latency['p50_seconds']:.1f} с / p95 {latency['p95_seconds']:.1f} с\n"
+            )
+        
+        feedback_stats = result.get("feedback", {})
+        if feedback_stats.get("failed"):
+            report += (
+                f"\n⚠️ Feedback загружен не полностью: {feedback_stats['failed']} оценок в spool файле, "
+                f"они будут догружены при следующем запуске (или make feedback-resume)"
+            )
+        else:
+            report += "\n💡 Результаты загружены в LangSmith как feedback"
         
         await message.answer(report)
         logger.info(f"Evaluation completed for user {message.chat.id}")
@@ -316,20 +376,38 @@ async def handle_message(message: Message):
         
         # Получаем ответ через ReAct агента
         # ВАЖНО: Передаем только текущее сообщение, а не всю историю!
-        # История хранится в агенте (MemorySaver) и управляется через chat_id
+        # История хранится в checkpointer агента и управляется через chat_id
         # Агент сам решает:
         # - Нужно ли использовать rag_search
         # - Сколько раз его вызвать
         # - Как сформировать ответ на основе контекста
-        result = await agent.agent_answer(
-            [user_message],
-            message.chat.id
-        )
+        # Потоковый вывод: финальный ответ появляется по мере генерации
+        # Планировщик: сообщения чата - по очереди, новое сообщение отменяет устаревший запуск
+        streamer = TelegramStreamer(message) if config.STREAMING_ENABLED else None
+        try:
+            result = await scheduler.run(
+                message.chat.id,
+                lambda: agent.agent_answer(
+                    [user_message],
+                    message.chat.id,
+                    on_token=streamer.push if streamer else None
+                )
+            )
+        except Superseded:
+            # Пользователь уже отправил следующее сообщение - ответ на него придет отдельно
+            if streamer:
+                await streamer.discard()
+            return
+        except QueueFull:
+            await message.answer("⏳ Сейчас слишком много запросов. Пожалуйста, повторите через минуту.")
+            return
         
         # Проверяем на interrupt (требуется подтверждение пользователя)
         if result.get("interrupt"):
             interrupt_obj = result["interrupt"]
             logger.info(f"🔐 Interrupt detected for chat {message.chat.id}, processing...")
+            if streamer:
+                await streamer.discard()
             
             try:
                 # Сохраняем interrupt для последующей обработки
@@ -398,7 +476,10 @@ async def handle_message(message: Message):
             if sources:
                 final_response = f"{final_response}\n\n{sources}"
         
-        await message.answer(final_response)
+        if streamer:
+            await streamer.finish(final_response)
+        else:
+            await message.answer(final_response)
         
     except ValueError as e:
         logger.error(f"ValueError in handle_message for chat {message.chat.id}: {e}")
@@ -414,16 +495,30 @@ async def handle_message(message: Message):
         )
 
 
+async def _restore_hitl_request(callback: CallbackQuery, text: str, keyboard, chat_id: int, interrupt_obj):
+    """Возврат кнопок подтверждения, если решение не удалось передать агенту"""
+    if interrupt_obj is not None:
+        pending_interrupts[chat_id] = interrupt_obj
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except Exception as e:
+        logger.error(f"Failed to restore HITL buttons for chat {chat_id}: {e}")
+
+
 @router.callback_query(lambda c: c.data and c.data.startswith("hitl_"))
 async def handle_hitl_callback(callback: CallbackQuery):
     """Обработка нажатий на кнопки HITL (Approve/Reject)"""
+    chat_id = None
+    request_text = callback.message.text if callback.message else None
+    keyboard = callback.message.reply_markup if callback.message else None
+    interrupt_obj = None
     try:
         # Парсим callback data
         action, chat_id_str = callback.data.split(":")
         chat_id = int(chat_id_str)
         
-        # Проверяем что interrupt существует
-        if chat_id not in pending_interrupts:
+        # Проверяем что interrupt существует (после перезапуска бота - в checkpointer)
+        if chat_id not in pending_interrupts and not await agent.has_pending_interrupt(chat_id):
             await callback.answer("⚠️ Запрос устарел", show_alert=True)
             return
         
@@ -444,18 +539,33 @@ async def handle_hitl_callback(callback: CallbackQuery):
                 parse_mode="Markdown"
             )
         
-        # Удаляем из pending
-        del pending_interrupts[chat_id]
+        # Удаляем из pending (при ошибке запуска - возвращаем вместе с кнопками)
+        interrupt_obj = pending_interrupts.pop(chat_id, None)
         
         # Уведомляем пользователя о обработке
         processing_msg = await callback.message.answer("⏳ Обрабатываю решение...")
         
         # Резюмим агента
-        result = await agent.agent_resume(
-            chat_id=chat_id,
-            decision=decision,
-            message="Операция отклонена пользователем" if decision == "reject" else None
-        )
+        # Через планировщик (в очереди чата), но без отмены - решение пользователя доводится до конца
+        try:
+            result = await scheduler.run(
+                chat_id,
+                lambda: agent.agent_resume(
+                    chat_id=chat_id,
+                    decision=decision,
+                    message="Операция отклонена пользователем" if decision == "reject" else None
+                ),
+                cancellable=False
+            )
+        except QueueFull:
+            # Решение не передано агенту - interrupt ждет в checkpointer, возвращаем кнопки
+            await processing_msg.delete()
+            await _restore_hitl_request(callback, request_text, keyboard, chat_id, interrupt_obj)
+            await callback.answer(
+                "⏳ Сейчас слишком много запросов. Нажмите кнопку еще раз через минуту.",
+                show_alert=True
+            )
+            return
         
         # Удаляем сообщение о обработке
         await processing_msg.delete()
@@ -475,5 +585,17 @@ async def handle_hitl_callback(callback: CallbackQuery):
         
     except Exception as e:
         logger.error(f"Error in handle_hitl_callback: {e}", exc_info=True)
+        # Если операция все еще ждет решения - возвращаем кнопки для повторной попытки
+        try:
+            still_pending = (
+                chat_id is not None and request_text is not None
+                and await agent.has_pending_interrupt(chat_id)
+            )
+        except Exception:
+            still_pending = False
+        if still_pending:
+            await _restore_hitl_request(callback, request_text, keyboard, chat_id, interrupt_obj)
+            await callback.answer("❌ Ошибка обработки решения, попробуйте еще раз", show_alert=True)
+            return
         await callback.answer("❌ Ошибка обработки решения", show_alert=True)
 
@@ -0,0 +1,219 @@
+"""
+Ограничение истории диалога, которую агент отправляет в LLM
+
+Checkpointer хранит весь thread, и без ограничения каждый вызов модели получает
+всю историю чата: prompt tokens (а с ними latency и стоимость) растут линейно.
+HistoryBudgetMiddleware меняет только запрос к модели, состояние агента не трогает:
+- текущий ход (последний вопрос пользователя и все шаги ReAct после него) передается целиком
+- в предыдущих ходах результаты rag_search (JSON с полным текстом чанков) заменяются короткой пометкой
+- предыдущие ходы добавляются от новых к старым, пока помещаются в HISTORY_MAX_TOKENS
+  (ход целиком - вызов инструмента не отделяется от его результата)
+- вызовы инструментов без результата (запуск отменен планировщиком или ожидал HITL
+  подтверждения, которого не было) закрываются пометкой - иначе API модели отклонит запрос
+- не поместившиеся ходы суммаризируются LLM в фоне, краткое содержание добавляется
+  к системному промпту; текущий вызов модели суммаризацию не ждет
+"""
+import asyncio
+import contextvars
+import logging
+from collections import OrderedDict
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately, get_buffer_string
+from langchain_openai import ChatOpenAI
+from langgraph.config import get_config
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Инструменты, результаты которых не нужны модели после завершения хода
+BULKY_TOOLS = frozenset({"rag_search"})
+
+SUMMARY_PREFIX = "## Краткое содержание предыдущей части диалога"
+
+SUMMARY_PROMPT = (
+    "Кратко изложи предыдущую часть диалога клиента с банковским ассистентом: "
+    "что спрашивал клиент, какие факты (продукты, ставки, суммы, сроки) ему сообщили, "
+    "какие операции выполнены или отклонены. Не добавляй ничего от себя. "
+    "Ответ - не более 10 пунктов."
+)
+
+
+def _turn_starts(messages: list) -> list[int]:
+    """Индексы сообщений пользователя - начала ходов диалога"""
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+def _compact_tool_message(message):
+    """Результат bulky инструмента из прошлого хода -> короткая пометка (tool_call_id сохраняется)"""
+    if not isinstance(message, ToolMessage) or message.name not in BULKY_TOOLS:
+        return message
+    return message.model_copy(update={
+        "content": f"[результат {message.name} из предыдущего хода опущен - при необходимости вызови инструмент снова]"
+    })
+
+
+def _close_tool_calls(turn: list) -> list:
+    """Добавление результата-пометки для вызовов инструментов, которые не были выполнены"""
+    answered = {message.tool_call_id for message in turn if isinstance(message, ToolMessage)}
+    closed = []
+    for message in turn:
+        closed.append(message)
+        if isinstance(message, AIMessage):
+            closed.extend(
+                ToolMessage(content="[вызов не был выполнен]", tool_call_id=call["id"], name=call["name"])
+                for call in message.tool_calls if call["id"] not in answered
+            )
+    return closed
+
+
+class HistoryBudgetMiddleware(AgentMiddleware):
+    """Бюджет токенов на историю в запросе к модели + фоновая суммаризация старых ходов"""
+
+    def __init__(self, max_tokens: int, summary_model: str | None = None, max_threads: int = 10000):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.max_threads = max_threads
+        self._summary_llm = ChatOpenAI(model=summary_model, temperature=0) if summary_model else None
+        # thread_id -> (id последнего суммаризированного сообщения, текст summary)
+        self._summaries = OrderedDict()
+        self._in_progress = set()
+        self._tasks = set()
+        self.stats = {"calls": 0, "trimmed_calls": 0, "tokens_in": 0, "tokens_out": 0, "summaries": 0}
+
+    # ---------- Выбор истории ----------
+
+    def _select(self, messages: list) -> tuple[list, list]:
+        """(не поместившиеся в бюджет сообщения, сообщения для модели)"""
+        starts = _turn_starts(messages)
+        if len(starts) <= 1:
+            return [], messages
+
+        current = messages[starts[-1]:]
+        budget = self.max_tokens - count_tokens_approximately(current)
+        kept_from = starts[-1]
+        previous = []
+        # Предыдущие ходы целиком, от новых к старым
+        for start, end in zip(reversed(starts[:-1]), reversed(starts[1:])):
+            turn = _close_tool_calls([_compact_tool_message(message) for message in messages[start:end]])
+            tokens = count_tokens_approximately(turn)
+            if tokens > budget:
+                break
+            budget -= tokens
+            previous = turn + previous
+            kept_from = start
+        return messages[:kept_from], previous + current
+
+    # ---------- Summary ----------
+
+    @staticmethod
+    def _thread_id() -> str | None:
+        try:
+            return get_config().get("configurable", {}).get("thread_id")
+        except RuntimeError:
+            return None
+
+    def _get_summary(self, thread_id: str | None) -> tuple[str | None, str | None]:
+        if thread_id is None or thread_id not in self._summaries:
+            return None, None
+        self._summaries.move_to_end(thread_id)
+        return self._summaries[thread_id]
+
+    def _pending(self, dropped: list, covered_id: str | None) -> list:
+        """Не поместившиеся сообщения, которых еще нет в summary"""
+        if covered_id is None:
+            return dropped
+        for i, message in enumerate(dropped):
+            if message.id == covered_id:
+                return dropped[i + 1:]
+        # summary покрывает больше, чем сейчас не помещается - обновлять нечего
+        return []
+
+    async def _summarize(self, thread_id: str, previous_summary: str | None, messages: list):
+        try:
+            history = get_buffer_string([_compact_tool_message(message) for message in messages])
+            if previous_summary:
+                history = f"{SUMMARY_PREFIX}:\n{previous_summary}\n\n{history}"
+            response = await self._summary_llm.ainvoke([
+                SystemMessage(content=SUMMARY_PROMPT),
+                HumanMessage(content=history),
+            ])
+            self._summaries[thread_id] = (messages[-1].id, response.content)
+            self._summaries.move_to_end(thread_id)
+            while len(self._summaries) > self.max_threads:
+                self._summaries.popitem(last=False)
+            self.stats["summaries"] += 1
+            logger.info(f"📝 History summary updated for thread {thread_id}: {len(messages)} messages")
+        except Exception as e:
+            logger.warning(f"History summarization failed for thread {thread_id}: {e}")
+        finally:
+            self._in_progress.discard(thread_id)
+
+    def _schedule_summary(self, thread_id: str | None, dropped: list, covered_id: str | None, summary: str | None):
+        if self._summary_llm is None or thread_id is None or thread_id in self._in_progress:
+            return
+        pending = self._pending(dropped, covered_id)
+        if not pending:
+            return
+        self._in_progress.add(thread_id)
+        # Пустой контекст - вызов LLM не попадает в callbacks/stream текущего запуска агента
+        task = asyncio.create_task(self._summarize(thread_id, summary, pending), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ---------- Запрос к модели ----------
+
+    def _prepare(self, request):
+        """Запрос с урезанной историей, не поместившиеся сообщения и summary"""
+        thread_id = self._thread_id()
+        dropped, messages = self._select(request.messages)
+        covered_id, summary = self._get_summary(thread_id)
+
+        self.stats["calls"] += 1
+        if not dropped and messages == request.messages:
+            return request, thread_id, dropped, covered_id, summary
+
+        system_prompt = request.system_prompt
+        if summary and dropped:
+            system_prompt = f"{system_prompt or ''}\n\n{SUMMARY_PREFIX}:\n{summary}".strip()
+
+        tokens_in = count_tokens_approximately(request.messages)
+        tokens_out = count_tokens_approximately(messages)
+        self.stats["trimmed_calls"] += 1
+        self.stats["tokens_in"] += tokens_in
+        self.stats["tokens_out"] += tokens_out
+        logger.info(
+            f"✂️ History budget: {len(request.messages)} -> {len(messages)} messages, "
+            f"~{tokens_in} -> ~{tokens_out} tokens (summary: {'yes' if summary and dropped else 'no'})"
+        )
+        return request.override(messages=messages, system_prompt=system_prompt), thread_id, dropped, covered_id, summary
+
+    def wrap_model_call(self, request, handler):
+        # Sync путь: используется готовый summary, фоновая суммаризация только в async
+        new_request, *_ = self._prepare(request)
+        return handler(new_request)
+
+    async def awrap_model_call(self, request, handler):
+        new_request, thread_id, dropped, covered_id, summary = self._prepare(request)
+        if dropped:
+            self._schedule_summary(thread_id, dropped, covered_id, summary)
+        return await handler(new_request)
+
+    def get_stats(self) -> dict:
+        """Статистика: сколько вызовов урезано и сколько токенов сэкономлено"""
+        stats = dict(self.stats)
+        stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+        stats["threads_with_summary"] = len(self._summaries)
+        return stats
+
+
+def create_history_middleware() -> HistoryBudgetMiddleware:
+    """Middleware по настройкам HISTORY_* из конфига"""
+    summary_model = (config.HISTORY_SUMMARY_MODEL or config.MODEL) if config.HISTORY_SUMMARY_ENABLED else None
+    logger.info(
+        f"History budget: {config.HISTORY_MAX_TOKENS} tokens, "
+        f"summary: {summary_model or 'disabled'}"
+    )
+    return HistoryBudgetMiddleware(max_tokens=config.HISTORY_MAX_TOKENS, summary_model=summary_model)
@@ -0,0 +1,121 @@
+"""
+Гибридный retriever: параллельный semantic + BM25 с Reciprocal Rank Fusion
+
+Вместо EnsembleRetriever (ветки выполняются последовательно, дубликаты
+определяются по равенству page_content):
+- ветки выполняются одновременно: в async режиме semantic ждет embedding запроса
+  через await, BM25 (CPU) считается в потоке; в sync режиме обе ветки - в пуле потоков
+- слияние результатов - взвешенный RRF по id документа: score = sum(w / (c + rank))
+- латентность каждой ветки и слияния логируется и доступна в last_timings
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+# Общий пул для sync вызовов (по потоку на ветку)
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-retriever")
+
+
+def _doc_key(doc: Document) -> str:
+    """Ключ документа для слияния: id чанка (для старых документов без id - текст)"""
+    return doc.id or doc.page_content
+
+
+def reciprocal_rank_fusion(results: list[list[Document]], weights: list[float], c: int = 60) -> list[Document]:
+    """
+    Взвешенный Reciprocal Rank Fusion
+
+    Args:
+        results: списки документов от каждой ветки (в порядке релевантности)
+        weights: вес каждой ветки
+        c: константа сглаживания RRF (60 - как в EnsembleRetriever)
+
+    Returns:
+        list[Document]: объединенный список без дубликатов, по убыванию RRF score
+    """
+    scores = {}
+    documents = {}
+    for docs, weight in zip(results, weights):
+        for rank, doc in enumerate(docs, start=1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (c + rank)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """Semantic + BM25 retriever с параллельным выполнением веток и RRF по id"""
+
+    semantic: BaseRetriever
+    bm25: BaseRetriever
+    semantic_weight: float = 0.5
+    bm25_weight: float = 0.5
+    c: int = 60
+    # Латентность последнего вызова в мс: semantic, bm25, fusion, total
+    last_timings: dict = {}
+
+    def _fuse(self, semantic_docs: list, bm25_docs: list, timings: dict, start: float) -> list[Document]:
+        fusion_start = time.perf_counter()
+        fused = reciprocal_rank_fusion(
+            [semantic_docs, bm25_docs], [self.semantic_weight, self.bm25_weight], self.c
+        )
+        timings["fusion"] = (time.perf_counter() - fusion_start) * 1000
+        timings["total"] = (time.perf_counter() - start) * 1000
+        self.last_timings = timings
+        logger.info(
+            f"Hybrid retrieval: semantic={timings['semantic']:.1f}ms ({len(semantic_docs)} docs), "
+            f"bm25={timings['bm25']:.1f}ms ({len(bm25_docs)} docs), "
+            f"fusion={timings['fusion']:.1f}ms, total={timings['total']:.1f}ms"
+        )
+        return fused
+
+    @staticmethod
+    def _timed(retriever: BaseRetriever, query: str, config: Any) -> tuple[list, float]:
+        start = time.perf_counter()
+        docs = retriever.invoke(query, config)
+        return docs, (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    async def _atimed(coro) -> tuple[list, float]:
+        start = time.perf_counter()
+        docs = await coro
+        return docs, (time.perf_counter() - start) * 1000
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        start = time.perf_counter()
+        semantic_future = _executor.submit(
+            self._timed, self.semantic, query, {"callbacks": run_manager.get_child("semantic")}
+        )
+        bm25_future = _executor.submit(
+            self._timed, self.bm25, query, {"callbacks": run_manager.get_child("bm25")}
+        )
+        semantic_docs, semantic_ms = semantic_future.result()
+        bm25_docs, bm25_ms = bm25_future.result()
+        return self._fuse(semantic_docs, bm25_docs, {"semantic": semantic_ms, "bm25": bm25_ms}, start)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        start = time.perf_counter()
+        # Semantic: await на embedding запроса; BM25: CPU-скоринг в отдельном потоке
+        (semantic_docs, semantic_ms), (bm25_docs, bm25_ms) = await asyncio.gather(
+            self._atimed(self.semantic.ainvoke(query, {"callbacks": run_manager.get_child("semantic")})),
+            self._atimed(asyncio.to_thread(
+                self.bm25.invoke, query, {"callbacks": run_manager.get_sync().get_child("bm25")}
+            )),
+        )
+        return self._fuse(semantic_docs, bm25_docs, {"semantic": semantic_ms, "bm25": bm25_ms}, start)
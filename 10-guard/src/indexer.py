@@ -1,13 +1,20 @@
+import asyncio
 import json
 import logging
 from pathlib import Path
+
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+import bm25_index
+import embedding_cache
+import index_storage
+import rag
+from vector_store import create_vector_store
 
 logger = logging.getLogger(__name__)
 
@@ -24,17 +31,22 @@ def load_pdf_documents(data_dir: str) -> list:
     logger.info(f"Found {len(pdf_files)} PDF files in {data_dir}")
     
     for pdf_file in pdf_files:
-        loader = PyPDFLoader(str(pdf_file))
-        pages.extend(loader.load())
-        logger.info(f"Loaded {pdf_file.name}")
+        pages.extend(load_pdf_file(pdf_file))
     
     return pages
 
+def load_pdf_file(pdf_file: Path) -> list:
+    """Загрузка одного PDF файла постранично"""
+    loader = PyPDFLoader(str(pdf_file))
+    pages = loader.load()
+    logger.info(f"Loaded {pdf_file.name}")
+    return pages
+
 def split_documents(pages: list) -> list:
     """Разбиение документов на чанки"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP
     )
     chunks = text_splitter.split_documents(pages)
     logger.info(f"Split into {len(chunks)} chunks")
@@ -76,16 +88,19 @@ def create_embeddings():
     """
     Фабрика для создания embeddings по провайдеру из конфига
     Поддерживает: openai, huggingface
+    
+    Embeddings оборачиваются кешем на диске (embedding_cache.py),
+    если EMBEDDING_CACHE_ENABLED=true
     """
     provider = config.EMBEDDING_PROVIDER.lower()
     
     if provider == "openai":
         logger.info(f"Creating OpenAI embeddings: {config.EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
+        embeddings = OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
     
     elif provider == "huggingface":
         logger.info(f"Creating HuggingFace embeddings: {config.HUGGINGFACE_EMBEDDING_MODEL} on {config.HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
@@ -93,55 +108,198 @@ def create_embeddings():
     
     else:
         raise ValueError(f"Unknown embedding provider: {provider}. Use 'openai' or 'huggingface'")
+    
+    settings = index_storage.get_embedding_settings()
+    return embedding_cache.wrap(embeddings, settings["provider"], settings["model"], settings["normalize"])
 
-def create_vector_store(chunks: list):
-    """Создание векторного хранилища"""
-    embeddings = create_embeddings()
-    vector_store = InMemoryVectorStore.from_documents(
-        documents=chunks,
-        embedding=embeddings
-    )
-    logger.info(f"Created vector store with {len(chunks)} chunks")
-    return vector_store
+def restore_vector_store(entries: list, vectors, embeddings=None):
+    """
+    Сборка векторного хранилища из готовых векторов (без вызова embeddings)
+    
+    Returns:
+        tuple: (vector_store, chunks)
+    """
+    if embeddings is None:
+        embeddings = create_embeddings()
+    # Для VECTOR_BACKEND=hnsw граф загружается/сохраняется рядом с индексом в INDEX_DIR
+    vector_store = create_vector_store(entries, vectors, embeddings, index_dir=config.INDEX_DIR)
+    chunks = [
+        Document(id=entry["id"], page_content=entry["text"], metadata=entry["metadata"])
+        for entry in entries
+    ]
+    logger.info(f"Built vector store with {len(chunks)} chunks ({config.VECTOR_BACKEND}, {config.VECTOR_DTYPE})")
+    return vector_store, chunks
 
-async def reindex_all():
-    """Полная переиндексация всех документов (PDF + JSON)
+def load_source_file(path: Path) -> list:
+    """Загрузка одного исходного файла (PDF или JSON) в виде чанков"""
+    if path.suffix.lower() == ".pdf":
+        pages = load_pdf_file(path)
+        return split_documents(pages) if pages else []
+    return load_json_documents(str(path))
+
+# Одна индексация за раз: параллельные /index (или /index во время старта) писали бы
+# одни и те же файлы INDEX_DIR из двух потоков, а rag.set_index мог бы применить более старый результат
+_reindex_lock = asyncio.Lock()
+
+def _build_index(force: bool):
+    """
+    Синхронная часть индексации (выполняется в отдельном потоке)
+    
+    Алгоритм:
+    1. Манифест актуален - индекс целиком загружается с диска
+    2. Файл не изменился (хеш совпал) - его чанки и векторы берутся из сохраненного индекса
+    3. Файл изменился или новый - файл парсится заново, но embeddings считаются
+       только для чанков с новым хешем содержимого
+    4. Чанки удаленных файлов просто не попадают в новый индекс
     
     Returns:
-        tuple: (vector_store, chunks) для инициализации retriever
+        tuple: (vector_store, chunks, manifest, rebuilt, stats)
     """
-    logger.info("Starting full reindexing...")
+    source_files = index_storage.get_source_files(config.DATA_DIR)
+    manifest = index_storage.build_manifest(source_files)
     
-    try:
-        # Загрузка PDF документов
-        pages = load_pdf_documents(config.DATA_DIR)
-        pdf_chunks = split_documents(pages) if pages else []
-        logger.info(f"PDF: {len(pdf_chunks)} chunks")
-        
-        # Загрузка JSON Q&A пар
-        json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
-        json_documents = load_json_documents(str(json_file))
-        logger.info(f"JSON: {len(json_documents)} Q&A pairs")
-        
-        # Объединяем все чанки
-        all_chunks = pdf_chunks + json_documents
-        
-        if not all_chunks:
-            logger.warning("No documents found to index")
-            return None, []
-        
-        logger.info(f"Total chunks to index: {len(all_chunks)} (PDF: {len(pdf_chunks)}, JSON: {len(json_documents)})")
-        
-        vector_store = create_vector_store(all_chunks)
-        logger.info("Reindexing completed successfully")
+    saved = None if force else index_storage.load_index(config.INDEX_DIR)
+    if saved is not None and not index_storage.is_manifest_compatible(saved[0], manifest):
+        logger.info("Saved index was built with other embedding settings, rebuilding from scratch")
+        saved = None
+    
+    saved_manifest, saved_entries, saved_vectors = saved if saved is not None else ({}, [], None)
+    embeddings = create_embeddings()
+    
+    # Быстрый путь: ничего не изменилось
+    if saved_entries and index_storage.is_manifest_fresh(saved_manifest, manifest):
+        stats = {
+            "total": len(saved_entries), "reused": len(saved_entries),
+            "embedded": 0, "removed": 0, "changed_files": 0,
+        }
+        return (*restore_vector_store(saved_entries, saved_vectors, embeddings), manifest, False, stats)
+    
+    # Индексы сохраненных векторов: по файлу и по хешу чанка
+    saved_rows_by_file = {}
+    saved_row_by_hash = {}
+    for row, entry in enumerate(saved_entries):
+        saved_rows_by_file.setdefault(entry["file"], []).append(row)
+        saved_row_by_hash.setdefault(entry["hash"], row)
+    
+    # Чанки файла можно взять целиком только если не менялся и splitter
+    same_splitter = saved_manifest.get("splitter") == manifest["splitter"]
+    saved_sources = saved_manifest.get("sources", {})
+    
+    entries = []
+    vectors = []  # np.ndarray для переиспользованных, None для новых чанков
+    changed_files = 0
+    
+    for path in source_files:
+        file_hash = manifest["sources"][path.name]
         
-        # Возвращаем vector_store и chunks для BM25
-        return vector_store, all_chunks
+        if same_splitter and saved_sources.get(path.name) == file_hash and path.name in saved_rows_by_file:
+            for row in saved_rows_by_file[path.name]:
+                entries.append(saved_entries[row])
+                vectors.append(saved_vectors[row])
+            continue
         
-    except FileNotFoundError as e:
-        logger.error(f"File not found: {e}")
-        return None, []
+        changed_files += 1
+        logger.info(f"Source changed: {path.name}")
+        seen_ids = set()
+        for doc in load_source_file(path):
+            digest = index_storage.chunk_hash(doc.page_content, doc.metadata)
+            # Одинаковые чанки внутри файла получают разные id
+            chunk_id = digest
+            suffix = 1
+            while chunk_id in seen_ids:
+                chunk_id = f"{digest}-{suffix}"
+                suffix += 1
+            seen_ids.add(chunk_id)
+            
+            entries.append({
+                "id": chunk_id,
+                "hash": digest,
+                "file": path.name,
+                "text": doc.page_content,
+                "metadata": doc.metadata,
+            })
+            row = saved_row_by_hash.get(digest)
+            vectors.append(saved_vectors[row] if row is not None else None)
+    
+    if not entries:
+        return None, [], manifest, False, {}
+    
+    # Embeddings только для новых и измененных чанков
+    pending = [i for i, vector in enumerate(vectors) if vector is None]
+    if pending:
+        logger.info(f"Embedding {len(pending)} new chunks (reused {len(entries) - len(pending)})")
+        new_vectors = embeddings.embed_documents([entries[i]["text"] for i in pending])
+        for i, vector in zip(pending, new_vectors):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+    
+    matrix = np.vstack(vectors).astype(np.float32)
+    reused = len(entries) - len(pending)
+    stats = {
+        "total": len(entries),
+        "reused": reused,
+        "embedded": len(pending),
+        "removed": len(saved_entries) - len({e["id"] for e in entries} & {e["id"] for e in saved_entries}),
+        "changed_files": changed_files,
+    }
+    
+    vector_store, chunks = restore_vector_store(entries, matrix, embeddings)
+    
+    # Сохраняем индекс на диск (ошибка сохранения не должна ломать запуск бота)
+    try:
+        index_storage.save_index(config.INDEX_DIR, manifest, entries, matrix)
     except Exception as e:
-        logger.error(f"Error during reindexing: {e}", exc_info=True)
-        return None, []
+        logger.error(f"Failed to save index to disk: {e}", exc_info=True)
+    
+    return vector_store, chunks, manifest, True, stats
 
+async def reindex_all(force: bool = False):
+    """Инкрементальная индексация всех документов (PDF + JSON)
+    
+    Для каждого исходного файла хранится хеш содержимого, для каждого чанка - хеш текста
+    и метаданных. Embeddings считаются только для новых и измененных чанков,
+    чанки удаленных файлов отбрасываются. Тяжелая работа выполняется в отдельном потоке,
+    поэтому бот продолжает отвечать во время /index.
+    
+    Индексации выполняются по очереди (_reindex_lock), новый индекс применяется
+    через rag.set_index под той же блокировкой - последним применяется самый свежий.
+    
+    Args:
+        force: принудительная полная переиндексация (игнорировать сохраненный индекс)
+    
+    Returns:
+        dict | None: статистика индексации (total, reused, embedded, removed, changed_files);
+        None - документов нет или индекс не удалось построить
+    """
+    if _reindex_lock.locked():
+        logger.info("Indexing is already running, waiting for it to finish")
+    
+    async with _reindex_lock:
+        logger.info("Starting indexing..." if not force else "Starting full reindexing...")
+        
+        try:
+            vector_store, chunks, _, rebuilt, stats = await asyncio.to_thread(_build_index, force)
+            
+            if vector_store is None:
+                logger.warning("No documents found to index")
+                return None
+            
+            # BM25 индекс сохраняется рядом с векторным и перестраивается только при изменении чанков
+            bm25 = await asyncio.to_thread(bm25_index.load_or_build, chunks, config.INDEX_DIR)
+            
+            logger.info(
+                f"Indexing completed: total={stats['total']}, reused={stats['reused']}, "
+                f"embedded={stats['embedded']}, removed={stats['removed']}, "
+                f"changed_files={stats['changed_files']}, rebuilt={rebuilt}"
+            )
+            
+            # Индекс и retriever (semantic/hybrid/hybrid_reranker в зависимости от конфига)
+            if not rag.set_index(vector_store, chunks, bm25):
+                return None
+            return stats
+            
+        except FileNotFoundError as e:
+            logger.error(f"File not found: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error during reindexing: {e}", exc_info=True)
+            return None
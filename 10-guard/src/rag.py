@@ -1,7 +1,9 @@
 import logging
-from langchain_community.retrievers import BM25Retriever
-from langchain_classic.retrievers import EnsembleRetriever
 from config import config
+import bm25_index
+import embedding_cache
+from hybrid_retriever import HybridRetriever
+import reranker
 
 logger = logging.getLogger(__name__)
 
@@ -9,54 +11,48 @@ logger = logging.getLogger(__name__)
 vector_store = None
 retriever = None
 chunks = None  # Для BM25 retriever
-cross_encoder = None  # Для reranking (lazy loading)
+bm25 = None  # BM25Index (инвертированный индекс, строится при индексации)
 
-def create_semantic_retriever():
-    """Создание semantic retriever из vector store"""
-    if vector_store is None:
+def create_semantic_retriever(store=None):
+    """Создание semantic retriever из vector store (по умолчанию - текущий глобальный)"""
+    store = store if store is not None else vector_store
+    if store is None:
         raise ValueError("Vector store not initialized")
-    return vector_store.as_retriever(
+    return store.as_retriever(
         search_kwargs={'k': config.SEMANTIC_RETRIEVER_K}
     )
 
-def create_bm25_retriever():
-    """Создание BM25 retriever из chunks"""
-    if chunks is None or len(chunks) == 0:
+def create_bm25_retriever(docs=None, index=None):
+    """
+    Создание BM25 retriever из chunks (по умолчанию - текущие глобальные)
+    
+    Использует готовый BM25Index из индексации; если его нет - строит индекс по chunks
+    """
+    docs = docs if docs is not None else chunks
+    if docs is None or len(docs) == 0:
         raise ValueError("Chunks not initialized for BM25")
-    bm25 = BM25Retriever.from_documents(chunks)
-    bm25.k = config.BM25_RETRIEVER_K
-    return bm25
+    if index is None:
+        index = bm25 if docs is chunks and bm25 is not None else bm25_index.load_or_build(docs)
+    return bm25_index.BM25IndexRetriever(index=index, documents=docs, k=config.BM25_RETRIEVER_K)
 
-def create_hybrid_retriever():
-    """Создание гибридного retriever (Semantic + BM25)"""
-    semantic = create_semantic_retriever()
-    bm25 = create_bm25_retriever()
+def create_hybrid_retriever(store=None, docs=None, index=None):
+    """Создание гибридного retriever (Semantic + BM25, ветки параллельно, RRF по id чанков)"""
+    semantic = create_semantic_retriever(store)
+    bm25_retriever = create_bm25_retriever(docs, index)
     
     logger.info(f"Hybrid retriever: semantic_k={config.SEMANTIC_RETRIEVER_K}, bm25_k={config.BM25_RETRIEVER_K}")
     logger.info(f"Ensemble weights: semantic={config.ENSEMBLE_SEMANTIC_WEIGHT}, bm25={config.ENSEMBLE_BM25_WEIGHT}")
     
-    return EnsembleRetriever(
-        retrievers=[semantic, bm25],
-        weights=[config.ENSEMBLE_SEMANTIC_WEIGHT, config.ENSEMBLE_BM25_WEIGHT]
+    return HybridRetriever(
+        semantic=semantic,
+        bm25=bm25_retriever,
+        semantic_weight=config.ENSEMBLE_SEMANTIC_WEIGHT,
+        bm25_weight=config.ENSEMBLE_BM25_WEIGHT
     )
 
-def get_cross_encoder():
-    """Ленивая инициализация cross-encoder для reranking"""
-    global cross_encoder
-    if cross_encoder is None:
-        try:
-            from sentence_transformers import CrossEncoder
-            logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL}")
-            cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL)
-            logger.info("✓ Cross-encoder loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load cross-encoder: {e}", exc_info=True)
-            raise
-    return cross_encoder
-
 def rerank_documents(query: str, documents: list, top_k: int = None):
     """
-    Переранжирование документов с помощью cross-encoder
+    Переранжирование документов с помощью cross-encoder (reranker.py)
     
     Args:
         query: Запрос пользователя
@@ -69,42 +65,36 @@ def rerank_documents(query: str, documents: list, top_k: int = None):
     if top_k is None:
         top_k = config.RERANKER_TOP_K
     
-    if not documents:
-        return []
-    
-    encoder = get_cross_encoder()
-    
-    # Создаем пары (query, document_text) для cross-encoder
-    pairs = [(query, doc.page_content) for doc in documents]
-    
-    # Cross-encoder оценивает релевантность каждой пары
-    scores = encoder.predict(pairs)
-    
-    # Сортируем по убыванию score
-    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
-    
+    ranked = reranker.rerank(query, documents, top_k)
     logger.info(f"Reranked {len(documents)} documents, returning top {top_k}")
+    return ranked
+
+async def arerank_documents(query: str, documents: list, top_k: int = None):
+    """Async версия rerank_documents: пары попадают в общий micro-batch reranker"""
+    if top_k is None:
+        top_k = config.RERANKER_TOP_K
     
-    # Возвращаем top_k наиболее релевантных
-    return ranked[:top_k]
+    ranked = await reranker.arerank(query, documents, top_k)
+    logger.info(f"Reranked {len(documents)} documents, returning top {top_k}")
+    return ranked
 
-def create_retriever():
+def create_retriever(store=None, docs=None, index=None):
     """Фабрика для создания retriever по режиму"""
     mode = config.RETRIEVAL_MODE.lower()
     
     if mode == "semantic":
         logger.info("Creating semantic retriever")
-        return create_semantic_retriever()
+        return create_semantic_retriever(store)
     
     elif mode == "hybrid":
         logger.info("Creating hybrid retriever (Semantic + BM25)")
-        return create_hybrid_retriever()
+        return create_hybrid_retriever(store, docs, index)
     
     elif mode == "hybrid_reranker":
         logger.info("Creating hybrid retriever with reranker (Semantic + BM25 + Cross-encoder)")
         # Для hybrid_reranker используем тот же hybrid retriever
-        # Reranking будет применен в get_rag_chain()
-        return create_hybrid_retriever()
+        # Reranking будет применен в retrieve_documents()
+        return create_hybrid_retriever(store, docs, index)
     
     else:
         raise ValueError(f"Unknown retrieval mode: {mode}. Use 'semantic', 'hybrid', or 'hybrid_reranker'")
@@ -124,6 +114,34 @@ def initialize_retriever():
         logger.error(f"Failed to initialize retriever: {e}", exc_info=True)
         return False
 
+def set_index(new_vector_store, new_chunks, new_bm25=None):
+    """
+    Атомарная замена индекса: vector_store, chunks, BM25 и retriever
+    
+    Новый retriever строится до замены, поэтому параллельные запросы видят
+    либо старый индекс целиком, либо новый (без промежуточного состояния).
+    При ошибке построения retriever текущий индекс остается без изменений.
+    
+    Returns:
+        bool: True если индекс заменен
+    """
+    global vector_store, chunks, bm25, retriever
+    if new_vector_store is None:
+        logger.error("Cannot set index: vector_store is None")
+        return False
+    
+    try:
+        if new_bm25 is None:
+            new_bm25 = bm25_index.load_or_build(new_chunks)
+        new_retriever = create_retriever(new_vector_store, new_chunks, new_bm25)
+    except Exception as e:
+        logger.error(f"Failed to build retriever for new index: {e}", exc_info=True)
+        return False
+    
+    vector_store, chunks, bm25, retriever = new_vector_store, new_chunks, new_bm25, new_retriever
+    logger.info(f"✓ Index swapped, retriever initialized in '{config.RETRIEVAL_MODE}' mode")
+    return True
+
 def retrieve_documents(query: str):
     """
     Базовая функция поиска документов по запросу
@@ -151,6 +169,34 @@ def retrieve_documents(query: str):
         # Для semantic и hybrid - прямой вызов retriever
         return retriever.invoke(query)
 
+async def aretrieve_documents(query: str):
+    """
+    Async версия retrieve_documents для инструмента rag_search
+    
+    Retriever вызывается через ainvoke: embedding запроса ожидается через await,
+    поиск по матрице и BM25 выполняются в потоках, cross-encoder - в потоке reranker.
+    Медленный поиск одного пользователя не блокирует event loop и остальные чаты.
+    
+    Args:
+        query: Поисковый запрос
+    
+    Returns:
+        list[Document]: Список найденных документов
+    """
+    if retriever is None:
+        raise ValueError("Retriever not initialized")
+    
+    mode = config.RETRIEVAL_MODE.lower()
+    
+    if mode == "hybrid_reranker":
+        ensemble_docs = await retriever.ainvoke(query)
+        if not ensemble_docs:
+            return []
+        reranked = await arerank_documents(query, ensemble_docs, config.RERANKER_TOP_K)
+        return [doc for doc, score in reranked]
+    else:
+        return await retriever.ainvoke(query)
+
 def get_vector_store_stats():
     """Возвращает статистику векторного хранилища с полной информацией о конфигурации"""
     stats = {
@@ -161,8 +207,9 @@ def get_vector_store_stats():
     }
     
     if vector_store is not None:
-        doc_count = len(vector_store.store) if hasattr(vector_store, 'store') else 0
-        stats["count"] = doc_count
+        stats["count"] = len(vector_store)
+        stats["vector_dtype"] = config.VECTOR_DTYPE
+        stats["vector_backend"] = config.VECTOR_BACKEND
     
     # Добавляем информацию о моделях в зависимости от провайдера
     if config.EMBEDDING_PROVIDER == "openai":
@@ -186,6 +233,14 @@ def get_vector_store_stats():
         stats["bm25_weight"] = config.ENSEMBLE_BM25_WEIGHT
         stats["cross_encoder_model"] = config.CROSS_ENCODER_MODEL
         stats["reranker_top_k"] = config.RERANKER_TOP_K
+        stats["reranker"] = reranker.service.get_stats()
+    
+    # Латентность веток последнего гибридного поиска (semantic/bm25/fusion, мс)
+    if isinstance(retriever, HybridRetriever) and retriever.last_timings:
+        stats["hybrid_timings_ms"] = dict(retriever.last_timings)
+    
+    # Статистика кеша embeddings (hit rate, сэкономленные вызовы провайдера)
+    stats["embedding_cache"] = embedding_cache.get_stats()
     
     return stats
 
@@ -0,0 +1,162 @@
+"""
+Кеш результатов RAGAS метрик на диске
+
+Каждый /evaluate_dataset заново прогонял все метрики на всех примерах, хотя вопрос,
+ответ, контексты и эталон часто не меняются между прогонами. Здесь для каждой пары
+(метрика, пример) хранится оценка; ключ - SHA-256 от (имя метрики, модели судьи,
+версия ragas, вопрос, ответ, контексты, эталон). Судья (LLM) вызывается только
+для новых или изменившихся примеров.
+
+Хранилище - SQLite файл с LRU-вытеснением, как в embedding_cache.py
+(время обращения и число записей ведутся в памяти, чтение не пишет на диск).
+"""
+import atexit
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении настроек метрик (например, strictness) - старые оценки перестают совпадать
+CACHE_VERSION = "1"
+
+# Общие экземпляры кеша (по пути к файлу)
+_caches = {}
+
+# Сколько обращений к записям копить в памяти до записи last_access на диск
+ACCESS_FLUSH_SIZE = 1000
+
+
+class RagasResultCache:
+    """Оценки метрик в SQLite с LRU-вытеснением"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " key TEXT PRIMARY KEY,"
+            " metric TEXT NOT NULL,"
+            " score REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_last_access ON scores(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        self._pending_access = {}
+
+    def _flush_access(self):
+        """Запись накопленных last_access (вызывается под self._lock)"""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE scores SET last_access = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._pending_access.items()]
+        )
+        self._pending_access.clear()
+
+    def flush(self):
+        """Сброс накопленных обращений на диск"""
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+
+    def get_many(self, keys: list) -> dict:
+        """Поиск оценок по ключам, время обращения запоминается в памяти"""
+        if not keys:
+            return {}
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            now = time.time()
+            for key in found:
+                self._pending_access[key] = now
+            if len(self._pending_access) >= ACCESS_FLUSH_SIZE:
+                self._flush_access()
+                self._conn.commit()
+        return found
+
+    def set_many(self, items: dict):
+        """Сохранение оценок {key: (metric, score)} и вытеснение самых старых сверх лимита"""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, metric, float(score), now) for key, (metric, score) in items.items()]
+        with self._lock:
+            self._flush_access()
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO scores (key, metric, score, last_access) VALUES (?, ?, ?, ?)", rows
+            ).rowcount
+            if inserted < len(rows):
+                self._conn.executemany(
+                    "UPDATE scores SET metric = ?, score = ?, last_access = ? WHERE key = ?",
+                    [(metric, score, accessed, key) for key, metric, score, accessed in rows]
+                )
+            self._count += inserted
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM scores WHERE key IN ("
+                    " SELECT key FROM scores ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+                self._count -= evicted
+                logger.info(f"RAGAS cache: evicted {evicted} least recently used entries")
+            self._conn.commit()
+
+    def count(self) -> int:
+        return self._count
+
+
+def get_cache() -> RagasResultCache | None:
+    """Общий экземпляр кеша (None - кеш выключен RAGAS_CACHE_ENABLED=false)"""
+    if not config.RAGAS_CACHE_ENABLED:
+        return None
+    path = config.RAGAS_CACHE_PATH
+    if path not in _caches:
+        _caches[path] = RagasResultCache(path, config.RAGAS_CACHE_MAX_ENTRIES)
+        atexit.register(_caches[path].flush)
+        logger.info(f"RAGAS cache opened: {path} (max {config.RAGAS_CACHE_MAX_ENTRIES} entries)")
+    return _caches[path]
+
+
+def judge_namespace(ragas_version: str) -> str:
+    """Все, от чего зависит оценка помимо самого примера: модели (и endpoint) судьи и версия ragas"""
+    if config.RAGAS_EMBEDDING_PROVIDER == "openai":
+        embedding_model = config.RAGAS_EMBEDDING_MODEL
+    else:
+        embedding_model = config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL
+    parts = [
+        CACHE_VERSION, ragas_version, config.RAGAS_LLM_MODEL,
+        config.RAGAS_EMBEDDING_PROVIDER, embedding_model,
+    ]
+    # Отдельный endpoint судьи (одно имя модели на разных серверах - разные оценки)
+    if config.RAGAS_LLM_BASE_URL:
+        parts.append(config.RAGAS_LLM_BASE_URL)
+    return "|".join(parts)
+
+
+def example_key(metric: str, namespace: str, question: str, answer: str,
+                contexts: list[str], ground_truth: str) -> str:
+    """Ключ оценки метрики для одного примера"""
+    payload = json.dumps(
+        [metric, namespace, question, answer, contexts, ground_truth], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
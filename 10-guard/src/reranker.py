@@ -0,0 +1,247 @@
+"""
+Сервис reranking на cross-encoder
+
+Вместо ленивой загрузки модели на первом запросе и encoder.predict() прямо в event loop:
+- модель загружается и прогревается при старте бота (warmup)
+- предсказания выполняются в отдельном потоке (executor на один поток - модель не делится)
+- micro-batching: пары (query, chunk) от одновременных запросов собираются в общий батч
+  (до RERANKER_BATCH_SIZE пар или RERANKER_BATCH_WAIT_MS ожидания)
+- LRU кеш score по ключу (hash запроса, id чанка) - повторные вопросы не считаются заново
+- опционально ONNX Runtime (RERANKER_BACKEND=onnx) и квантованная int8 модель для CPU (onnx_int8)
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Имя квантованного файла, которое создает sentence-transformers для avx512_vnni
+ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+def _query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def _chunk_key(doc) -> str:
+    """id чанка (для документов без id - hash текста)"""
+    return doc.id or hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+
+
+class RerankerService:
+    """Cross-encoder с прогревом, отдельным потоком, micro-batching и LRU кешем score"""
+
+    def __init__(self):
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # Очередь micro-batching создается в event loop, где вызывается score()
+        self._queue = None
+        self._loop = None
+        self._worker = None
+
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "batches": 0, "pairs": 0}
+
+    # ---------- Модель ----------
+
+    def _load_model(self):
+        from sentence_transformers import CrossEncoder
+
+        backend = config.RERANKER_BACKEND
+        logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL} (backend={backend})")
+        if backend == "torch":
+            return CrossEncoder(config.CROSS_ENCODER_MODEL)
+        if backend == "onnx":
+            return CrossEncoder(config.CROSS_ENCODER_MODEL, backend="onnx")
+        return self._load_int8_model(CrossEncoder)
+
+    def _load_int8_model(self, cross_encoder_cls):
+        """Квантованная int8 ONNX модель: из репозитория модели или локальный экспорт"""
+        try:
+            return cross_encoder_cls(
+                config.CROSS_ENCODER_MODEL, backend="onnx", model_kwargs={"file_name": ONNX_INT8_FILE}
+            )
+        except Exception as e:
+            logger.info(f"No published int8 ONNX model ({e}), quantizing locally")
+
+        local_dir = Path(config.RERANKER_ONNX_DIR)
+        if not (local_dir / ONNX_INT8_FILE).exists():
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            model = cross_encoder_cls(config.CROSS_ENCODER_MODEL, backend="onnx")
+            model.save_pretrained(str(local_dir))
+            export_dynamic_quantized_onnx_model(model, "avx512_vnni", str(local_dir))
+            logger.info(f"Quantized ONNX model saved to {local_dir}")
+        return cross_encoder_cls(str(local_dir), backend="onnx", model_kwargs={"file_name": ONNX_INT8_FILE})
+
+    def get_model(self):
+        """Модель cross-encoder (загружается один раз)"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    try:
+                        self._model = self._load_model()
+                        logger.info("✓ Cross-encoder loaded successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to load cross-encoder: {e}", exc_info=True)
+                        raise
+        return self._model
+
+    def warmup(self):
+        """Загрузка модели и пробный прогон (первый predict медленный - инициализация графа)"""
+        start = time.perf_counter()
+        self.get_model().predict([("прогрев", "прогрев модели")])
+        logger.info(f"✓ Cross-encoder warmed up in {time.perf_counter() - start:.1f}s")
+
+    def _predict(self, pairs: list) -> list[float]:
+        """Синхронный predict (выполняется в потоке executor)"""
+        scores = self.get_model().predict(pairs, batch_size=config.RERANKER_BATCH_SIZE)
+        self.stats["batches"] += 1
+        self.stats["pairs"] += len(pairs)
+        return [float(score) for score in scores]
+
+    # ---------- Кеш ----------
+
+    def _cache_lookup(self, query: str, documents: list) -> tuple[list, dict]:
+        """Ключи (hash запроса, id чанка) и найденные в кеше score"""
+        query_hash = _query_hash(query)
+        keys = [(query_hash, _chunk_key(doc)) for doc in documents]
+        found = {}
+        with self._cache_lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+        self.stats["cache_hits"] += len(found)
+        self.stats["cache_misses"] += len(set(keys)) - len(found)
+        return keys, found
+
+    def _cache_store(self, scores: dict):
+        with self._cache_lock:
+            self._cache.update(scores)
+            for key in scores:
+                self._cache.move_to_end(key)
+            while len(self._cache) > config.RERANKER_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _missing(keys: list, found: dict, query: str, documents: list) -> dict:
+        """Пары для предсказания: ключ -> (query, text), без дубликатов"""
+        missing = {}
+        for key, doc in zip(keys, documents):
+            if key not in found and key not in missing:
+                missing[key] = (query, doc.page_content)
+        return missing
+
+    # ---------- Scoring ----------
+
+    def score_sync(self, query: str, documents: list) -> list[float]:
+        """Score документов (синхронно, предсказание в потоке reranker)"""
+        keys, found = self._cache_lookup(query, documents)
+        missing = self._missing(keys, found, query, documents)
+        if missing:
+            scores = self._executor.submit(self._predict, list(missing.values())).result()
+            computed = dict(zip(missing.keys(), scores))
+            self._cache_store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def score(self, query: str, documents: list) -> list[float]:
+        """Score документов (async, пары попадают в общий micro-batch)"""
+        keys, found = self._cache_lookup(query, documents)
+        missing = self._missing(keys, found, query, documents)
+        if missing:
+            self._ensure_worker()
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((list(missing.values()), future))
+            computed = dict(zip(missing.keys(), await future))
+            self._cache_store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._batch_loop())
+
+    async def _batch_loop(self):
+        """Сбор пар от одновременных запросов в батчи и предсказание в executor"""
+        loop = asyncio.get_running_loop()
+        wait = config.RERANKER_BATCH_WAIT_MS / 1000
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + wait
+            while size < config.RERANKER_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            pairs = [pair for item_pairs, _ in batch for pair in item_pairs]
+            try:
+                scores = await loop.run_in_executor(self._executor, self._predict, pairs)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            if len(batch) > 1:
+                logger.info(f"Reranker micro-batch: {len(batch)} requests, {len(pairs)} pairs")
+            offset = 0
+            for item_pairs, future in batch:
+                if not future.done():
+                    future.set_result(scores[offset:offset + len(item_pairs)])
+                offset += len(item_pairs)
+
+    def get_stats(self) -> dict:
+        """Статистика: попадания в кеш, батчи, загружена ли модель"""
+        stats = dict(self.stats)
+        total = stats["cache_hits"] + stats["cache_misses"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / total if total else 0.0
+        stats["cache_entries"] = len(self._cache)
+        stats["loaded"] = self._model is not None
+        stats["backend"] = config.RERANKER_BACKEND
+        return stats
+
+
+# Общий экземпляр сервиса
+service = RerankerService()
+
+
+def _top_k(documents: list, scores: list, top_k: int) -> list:
+    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
+    return ranked[:top_k]
+
+
+def rerank(query: str, documents: list, top_k: int) -> list:
+    """Переранжирование (sync): список (document, score) по убыванию score"""
+    if not documents:
+        return []
+    return _top_k(documents, service.score_sync(query, documents), top_k)
+
+
+async def arerank(query: str, documents: list, top_k: int) -> list:
+    """Переранжирование (async, micro-batching): список (document, score) по убыванию score"""
+    if not documents:
+        return []
+    return _top_k(documents, await service.score(query, documents), top_k)
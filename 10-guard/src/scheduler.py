@@ -0,0 +1,164 @@
+"""
+Планировщик запусков агента
+
+Без планировщика каждое сообщение сразу запускает агента:
+- несколько быстрых сообщений одного пользователя - параллельные запуски на одном thread_id
+- всплеск трафика - неограниченное число одновременных вызовов LLM
+
+ChatScheduler:
+- запуски одного чата выполняются строго по очереди (lock на chat_id)
+- новое сообщение отменяет устаревшие запуски того же чата (SCHEDULER_SUPERSEDE):
+  ожидающие в очереди и выполняющийся; отменяемыми являются только обычные сообщения,
+  продолжение после подтверждения операции (HITL) не прерывается
+- не более SCHEDULER_MAX_CONCURRENT одновременных запусков (semaphore),
+  не более SCHEDULER_MAX_QUEUE ожидающих - остальные сразу получают отказ
+- метрики: глубина очереди, выполняющиеся запуски, время ожидания p50/p95
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Окно для p50/p95 времени ожидания
+WAIT_WINDOW = 500
+# Ожидание дольше - пишется в лог
+SLOW_WAIT_SECONDS = 1.0
+
+
+class Superseded(Exception):
+    """Запуск отменен: из того же чата пришло более новое сообщение"""
+
+
+class QueueFull(Exception):
+    """Очередь переполнена - запрос отклонен"""
+
+
+class _Job:
+    def __init__(self, cancellable: bool):
+        self.cancellable = cancellable
+        self.superseded = False
+        self.task = asyncio.current_task()  # задача обработчика сообщения
+
+
+class _ChatState:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.jobs = []
+
+
+class ChatScheduler:
+    """Последовательные запуски по chat_id + общий лимит параллельности"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, supersede: bool):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.supersede = supersede
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._chats: dict[int, _ChatState] = {}
+        self._waiting = 0
+        self._running = 0
+        self._wait_times = deque(maxlen=WAIT_WINDOW)
+        self.stats = {"started": 0, "completed": 0, "superseded": 0, "rejected": 0, "failed": 0}
+
+    @staticmethod
+    def _supersede_previous(chat: _ChatState):
+        """Отмена устаревших запусков чата - и ожидающих в очереди, и выполняющегося"""
+        for job in chat.jobs:
+            if job.cancellable and not job.superseded:
+                job.superseded = True
+                job.task.cancel()
+
+    async def run(self, chat_id: int, func, cancellable: bool = True):
+        """
+        Выполнить func() (корутина) в очереди чата
+
+        Raises:
+            Superseded: запуск отменен более новым сообщением из того же чата
+            QueueFull: слишком много ожидающих запусков
+        """
+        if self._waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            logger.warning(f"Scheduler queue full ({self._waiting} waiting), rejecting chat {chat_id}")
+            raise QueueFull()
+
+        chat = self._chats.setdefault(chat_id, _ChatState())
+        job = _Job(cancellable)
+        if cancellable and self.supersede:
+            self._supersede_previous(chat)
+        chat.jobs.append(job)
+
+        submitted = time.perf_counter()
+        self._waiting += 1
+        waiting = True
+        try:
+            # Сначала очередь чата, затем общий слот - ожидающие сообщения чата не занимают слоты
+            async with chat.lock:
+                async with self._semaphore:
+                    self._waiting -= 1
+                    waiting = False
+                    self._record_wait(chat_id, time.perf_counter() - submitted)
+                    return await self._execute(func)
+        except asyncio.CancelledError:
+            if not job.superseded:
+                raise
+            # Отмена из-за нового сообщения, а не остановка бота - обработчик продолжает работу
+            job.task.uncancel()
+            self.stats["superseded"] += 1
+            logger.info(f"🔁 Chat {chat_id}: run superseded by a newer message ({'queued' if waiting else 'running'})")
+            raise Superseded() from None
+        finally:
+            if waiting:
+                self._waiting -= 1
+            chat.jobs.remove(job)
+            if not chat.jobs:
+                self._chats.pop(chat_id, None)
+
+    async def _execute(self, func):
+        self._running += 1
+        self.stats["started"] += 1
+        try:
+            result = await func()
+            self.stats["completed"] += 1
+            return result
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._running -= 1
+
+    def _record_wait(self, chat_id: int, wait: float):
+        self._wait_times.append(wait)
+        if wait >= SLOW_WAIT_SECONDS:
+            logger.info(
+                f"⏳ Chat {chat_id} waited {wait:.1f}s for agent "
+                f"(running {self._running}/{self.max_concurrent}, waiting {self._waiting})"
+            )
+
+    def get_stats(self) -> dict:
+        """Метрики: очередь, выполняющиеся запуски, время ожидания"""
+        stats = dict(self.stats)
+        stats["waiting"] = self._waiting
+        stats["running"] = self._running
+        stats["max_concurrent"] = self.max_concurrent
+        stats["active_chats"] = len(self._chats)
+        if self._wait_times:
+            waits = np.array(self._wait_times) * 1000
+            stats["wait_p50_ms"] = float(np.percentile(waits, 50))
+            stats["wait_p95_ms"] = float(np.percentile(waits, 95))
+        else:
+            stats["wait_p50_ms"] = stats["wait_p95_ms"] = 0.0
+        return stats
+
+
+# Общий экземпляр
+scheduler = ChatScheduler(
+    max_concurrent=config.SCHEDULER_MAX_CONCURRENT,
+    max_queue=config.SCHEDULER_MAX_QUEUE,
+    supersede=config.SCHEDULER_SUPERSEDE,
+)
@@ -0,0 +1,43 @@
+"""
+Хранилище полных текстов источников, найденных rag_search
+
+В prompt агента попадает только компактный результат rag_search (id чанка, урезанный текст).
+Полные документы нужны вне prompt: для SHOW_SOURCES и для RAGAS evaluation
+(_extract_documents_from_current_request) - они хранятся здесь по id чанка из результата.
+LRU с ограничением размера; после перезапуска бота вместо полного текста
+используется урезанный текст из результата инструмента.
+"""
+import threading
+from collections import OrderedDict
+
+from config import config
+
+
+class SourceStore:
+    """LRU: id чанка -> {"source", "page", "page_content"}"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, chunk_id: str, source: dict):
+        with self._lock:
+            self._items[chunk_id] = source
+            self._items.move_to_end(chunk_id)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def get(self, chunk_id: str) -> dict | None:
+        with self._lock:
+            if chunk_id not in self._items:
+                return None
+            self._items.move_to_end(chunk_id)
+            return self._items[chunk_id]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+# Общий экземпляр
+store = SourceStore(config.RAG_SOURCE_STORE_SIZE)
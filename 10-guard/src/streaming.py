@@ -0,0 +1,115 @@
+"""
+Потоковый вывод ответа в Telegram через редактирование сообщения
+
+Токены LLM накапливаются и показываются одним сообщением, которое периодически
+редактируется (edit_text). Частота правок ограничена с учетом flood-лимитов Telegram:
+не чаще STREAM_EDIT_INTERVAL секунд и только при приросте не менее STREAM_MIN_CHARS символов.
+При TelegramRetryAfter правки приостанавливаются на указанное Telegram время.
+Финальный текст (с источниками) выставляется в finish().
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram
+TELEGRAM_MAX_LENGTH = 4096
+# Индикатор, что ответ еще генерируется
+CURSOR = " ▌"
+
+
+def _split_text(text: str, limit: int = TELEGRAM_MAX_LENGTH) -> list[str]:
+    """Разбиение длинного текста на части по лимиту Telegram (по возможности по переводу строки)"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+class TelegramStreamer:
+    """Прогрессивный вывод ответа в одно сообщение Telegram"""
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.sent = None  # сообщение бота, которое редактируется
+        self._last_text = ""
+        self._last_edit = 0.0
+        self._paused_until = 0.0
+        self._start = time.perf_counter()
+        self.first_token_seconds = None
+
+    async def _edit(self, text: str) -> bool:
+        """Отправка/правка сообщения с обработкой flood-лимитов"""
+        try:
+            if self.sent is None:
+                self.sent = await self.message.answer(text)
+            else:
+                await self.sent.edit_text(text)
+            self._last_text = text
+            self._last_edit = time.monotonic()
+            return True
+        except TelegramRetryAfter as e:
+            logger.warning(f"Telegram flood limit for chat {self.message.chat.id}, pausing edits for {e.retry_after}s")
+            self._paused_until = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            # Текст не изменился - не ошибка
+            if "message is not modified" not in str(e):
+                logger.warning(f"Failed to edit streamed message: {e}")
+        return False
+
+    async def push(self, text: str):
+        """Новый накопленный текст ответа (правка выполняется, только если пора)"""
+        text = text.strip()
+        if not text:
+            return
+        now = time.monotonic()
+        if self.sent is not None:
+            if now < self._paused_until or now - self._last_edit < config.STREAM_EDIT_INTERVAL:
+                return
+            if len(text) - len(self._last_text) < config.STREAM_MIN_CHARS:
+                return
+        # Во время генерации показываем только то, что помещается в одно сообщение
+        preview = text[:TELEGRAM_MAX_LENGTH - len(CURSOR)] + CURSOR
+        if await self._edit(preview) and self.first_token_seconds is None:
+            self.first_token_seconds = time.perf_counter() - self._start
+            logger.info(
+                f"⚡ Time to first visible token for chat {self.message.chat.id}: {self.first_token_seconds:.2f}s"
+            )
+
+    async def finish(self, text: str):
+        """Финальный текст ответа: правка сообщения и отправка продолжения, если текст длинный"""
+        parts = _split_text(text)
+        if self.sent is None:
+            for part in parts:
+                await self.message.answer(part)
+            return
+
+        wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if not await self._edit(parts[0]) and self._last_text != parts[0]:
+            # Правка не удалась - отправляем ответ новым сообщением
+            await self.message.answer(parts[0])
+        for part in parts[1:]:
+            await self.message.answer(part)
+        logger.info(f"Streamed answer finished for chat {self.message.chat.id} in {time.perf_counter() - self._start:.2f}s")
+
+    async def discard(self):
+        """Удаление частично показанного ответа (например, если агент запросил подтверждение)"""
+        if self.sent is not None:
+            try:
+                await self.sent.delete()
+            except TelegramBadRequest as e:
+                logger.warning(f"Failed to delete streamed message: {e}")
+            self.sent = None
@@ -4,46 +4,155 @@
 Инструменты - это функции, которые агент может вызывать для получения информации.
 Декоратор @tool из LangChain автоматически создает описание для LLM.
 """
+import hashlib
 import json
 import logging
+import re
+from pathlib import Path
+
 from langchain_core.tools import tool
+
+from config import config
 import rag
+import source_store
 
 logger = logging.getLogger(__name__)
 
+# Примерно символов на токен для русского текста
+CHARS_PER_TOKEN = 3
+# Остаток бюджета, меньше которого чанк уже не добавляется
+MIN_CHUNK_CHARS = 200
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _chunk_ref(doc) -> str:
+    """Короткий id чанка для prompt (id в индексе - sha256, слишком длинный)"""
+    key = doc.id or doc.page_content
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]
+
+
+def _trim_text(text: str, max_chars: int) -> str:
+    """Обрезка по границе слова"""
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > 0 else max_chars] + "…"
+
+
+def compact_sources(documents: list) -> dict:
+    """
+    Компактное представление найденных чанков для prompt агента
+
+    - пробелы и переводы строк схлопываются, одинаковые и вложенные тексты пропускаются
+    - каждый чанк не длиннее RAG_TOOL_CHUNK_MAX_TOKENS, все вместе - не длиннее RAG_TOOL_MAX_TOKENS
+      (документы идут по убыванию релевантности - обрезаются наименее релевантные)
+    - вместо полного пути - имя файла
+    - полные документы (включая пропущенные) сохраняются в source_store по id чанка,
+      id пропущенных чанков перечисляются в "more" - expand_sources возвращает все найденные
+
+    Returns:
+        dict: {"chunks": [...]} и "more": [id] если часть чанков не попала в prompt
+    """
+    budget = config.RAG_TOOL_MAX_TOKENS * CHARS_PER_TOKEN
+    chunk_limit = config.RAG_TOOL_CHUNK_MAX_TOKENS * CHARS_PER_TOKEN
+    chunks, more, seen_texts = [], [], []
+    budget_exhausted = False
+
+    for doc in documents:
+        source = doc.metadata.get("source", "Unknown")
+        ref = _chunk_ref(doc)
+        full = {"source": source, "page_content": doc.page_content}
+        # page только для PDF (у JSON документов его нет)
+        if "page" in doc.metadata:
+            full["page"] = doc.metadata["page"]
+        source_store.store.put(ref, full)
+
+        text = _WHITESPACE_RE.sub(" ", doc.page_content).strip()
+        normalized = text.lower()
+        if budget_exhausted or not text or any(normalized in seen for seen in seen_texts):
+            more.append(ref)
+            continue
+
+        max_chars = min(chunk_limit, budget)
+        if max_chars < min(MIN_CHUNK_CHARS, len(text)):
+            budget_exhausted = True
+            more.append(ref)
+            continue
+        text = _trim_text(text, max_chars)
+        budget -= len(text)
+        seen_texts.append(normalized)
+
+        chunk = {"id": ref, "source": Path(source).name, "text": text}
+        if "page" in full:
+            chunk["page"] = full["page"]
+        chunks.append(chunk)
+
+    result = {"chunks": chunks}
+    shown = {chunk["id"] for chunk in chunks}
+    more = [ref for ref in dict.fromkeys(more) if ref not in shown]
+    if more:
+        result["more"] = more
+    return result
+
+
+def expand_sources(payload: str) -> list[dict]:
+    """
+    Полные документы для результата rag_search (для SHOW_SOURCES и evaluation)
+
+    Returns:
+        list[dict]: документы с ключами "source", "page_content" и опционально "page"
+    """
+    data = json.loads(payload)
+    # Старый формат (полные тексты в prompt) - в checkpoints, сохраненных до перехода
+    if "sources" in data:
+        return data["sources"]
+
+    documents = []
+    for chunk in data.get("chunks", []):
+        full = source_store.store.get(chunk["id"])
+        if full is None:
+            # После перезапуска бота полного текста нет - используем урезанный
+            full = {"source": chunk.get("source", "Unknown"), "page_content": chunk.get("text", "")}
+            if "page" in chunk:
+                full["page"] = chunk["page"]
+        documents.append(full)
+    # Чанки, не попавшие в prompt (дубликаты и сверх бюджета); после перезапуска их текста нет
+    for ref in data.get("more", []):
+        full = source_store.store.get(ref)
+        if full is not None:
+            documents.append(full)
+    return documents
+
+
 @tool
-def rag_search(query: str) -> str:
+async def rag_search(query: str) -> str:
     """
     Ищет информацию в документах Сбербанка (условия кредитов, вкладов и других банковских продуктов).
-    
-    Возвращает JSON со списком источников, где каждый источник содержит:
+
+    Возвращает JSON со списком найденных фрагментов (по убыванию релевантности), где каждый фрагмент содержит:
+    - id: идентификатор фрагмента
     - source: имя файла
     - page: номер страницы (только для PDF)
-    - page_content: текст документа
+    - text: текст фрагмента (длинные фрагменты сокращены)
+    Поле more - id найденных фрагментов, не включенных в ответ (повторы и сверх лимита).
     """
     try:
         # Получаем релевантные документы через RAG (retrieval + reranking)
-        documents = rag.retrieve_documents(query)
-        
-        if not documents:
-            return json.dumps({"sources": []}, ensure_ascii=False)
-        
-        # Формируем структурированный ответ для агента
-        sources = []
-        for doc in documents:
-            source_data = {
-                "source": doc.metadata.get("source", "Unknown"),
-                "page_content": doc.page_content  # Полный текст документа
-            }
-            # page только для PDF (у JSON документов его нет)
-            if "page" in doc.metadata:
-                source_data["page"] = doc.metadata["page"]
-            sources.append(source_data)
-        
+        # Async версия: поиск не блокирует event loop бота
+        documents = await rag.aretrieve_documents(query)
+
+        # Компактный результат: в prompt агента не попадают полные тексты и пути
+        compact = compact_sources(documents)
+        payload = json.dumps(compact, ensure_ascii=False)
+        if documents:
+            full_chars = sum(len(doc.page_content) for doc in documents)
+            logger.info(f"rag_search payload: {len(documents)} docs -> {len(compact['chunks'])} chunks, "
+                        f"{full_chars} -> {len(payload)} chars")
+
         # ensure_ascii=False для корректной кириллицы
-        return json.dumps({"sources": sources}, ensure_ascii=False)
-        
+        return payload
+
     except Exception as e:
         logger.error(f"Error in rag_search: {e}", exc_info=True)
-        return json.dumps({"sources": []}, ensure_ascii=False)
-
+        return json.dumps({"chunks": []}, ensure_ascii=False)
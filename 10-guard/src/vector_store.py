@@ -0,0 +1,515 @@
+"""
+Векторное хранилище на одной матрице NumPy
+
+В отличие от InMemoryVectorStore (dict с отдельным списком float на каждый документ
+и поштучным расчетом cosine), все embeddings хранятся в одной непрерывной матрице
+float32 (или float16) с нормализованными строками. Поиск top-k:
+1. одно матрично-векторное произведение (cosine = dot для нормализованных векторов)
+2. np.argpartition для выбора k лучших без полной сортировки
+
+Фильтры по метаданным применяются до поиска как булевы маски.
+Интерфейс VectorStore сохраняется - as_retriever() работает как раньше.
+
+Для больших корпусов есть HnswVectorStore (VECTOR_BACKEND=hnsw) - приближенный
+поиск через граф HNSW (hnswlib), с сохранением графа на диск и инкрементальными
+добавлениями/удалениями.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from config import config
+import index_storage
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-нормализация строк (нулевые строки остаются нулевыми)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MatrixVectorStore(VectorStore):
+    """VectorStore с embeddings в одной матрице и поиском через matmul + argpartition"""
+
+    def __init__(self, embedding: Embeddings, dtype: str = "float32"):
+        self.embedding = embedding
+        self.dtype = np.dtype(dtype)
+        self.ids: list[str] = []
+        self.texts: list[str] = []
+        self.metadatas: list[dict] = []
+        self.matrix = np.zeros((0, 0), dtype=self.dtype)
+        self._row_by_id: dict[str, int] = {}
+        self._metadata_columns: dict[str, np.ndarray] = {}
+
+    # ---------- Построение ----------
+
+    @classmethod
+    def from_entries(cls, entries: list, vectors, embedding: Embeddings, dtype: str = "float32"):
+        """
+        Создание хранилища из готовых векторов (без вызова embeddings)
+
+        Args:
+            entries: список dict с ключами id, text, metadata
+            vectors: матрица embeddings (len(entries) x dim)
+        """
+        store = cls(embedding=embedding, dtype=dtype)
+        store._append(
+            [entry["id"] for entry in entries],
+            [entry["text"] for entry in entries],
+            [entry["metadata"] for entry in entries],
+            np.asarray(vectors, dtype=np.float32),
+        )
+        return store
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        *,
+        ids: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> "MatrixVectorStore":
+        store = cls(embedding=embedding, dtype=kwargs.pop("dtype", "float32"))
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def _append(self, ids: list, texts: list, metadatas: list, vectors: np.ndarray):
+        """Добавление строк в матрицу (id, которые уже есть, заменяются)"""
+        existing = [doc_id for doc_id in ids if doc_id in self._row_by_id]
+        if existing:
+            self.delete(existing)
+
+        vectors = normalize_rows(vectors.astype(np.float32)).astype(self.dtype)
+        if self.matrix.size == 0:
+            self.matrix = np.ascontiguousarray(vectors)
+        else:
+            self.matrix = np.ascontiguousarray(np.vstack([self.matrix, vectors]))
+
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        for offset, doc_id in enumerate(ids):
+            self._row_by_id[doc_id] = start + offset
+        self._metadata_columns.clear()
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        *,
+        ids: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        self._append(list(ids), texts, list(metadatas), vectors)
+        return list(ids)
+
+    def add_documents(self, documents: list[Document], **kwargs: Any) -> list[str]:
+        ids = kwargs.pop("ids", None) or [doc.id or str(uuid.uuid4()) for doc in documents]
+        return self.add_texts(
+            [doc.page_content for doc in documents],
+            metadatas=[doc.metadata for doc in documents],
+            ids=ids,
+        )
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Удаление документов по id (перестраивает матрицу одной операцией)"""
+        if not ids:
+            return False
+        rows = {self._row_by_id[doc_id] for doc_id in ids if doc_id in self._row_by_id}
+        if not rows:
+            return False
+
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[list(rows)] = False
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self.ids = [doc_id for i, doc_id in enumerate(self.ids) if keep[i]]
+        self.texts = [text for i, text in enumerate(self.texts) if keep[i]]
+        self.metadatas = [meta for i, meta in enumerate(self.metadatas) if keep[i]]
+        self._row_by_id = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self._metadata_columns.clear()
+        return True
+
+    def get_by_ids(self, ids: list[str], /) -> list[Document]:
+        documents = []
+        for doc_id in ids:
+            row = self._row_by_id.get(doc_id)
+            if row is not None:
+                documents.append(self._document(row))
+        return documents
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _document(self, row: int) -> Document:
+        return Document(id=self.ids[row], page_content=self.texts[row], metadata=self.metadatas[row])
+
+    # ---------- Фильтры ----------
+
+    def _metadata_column(self, key: str) -> np.ndarray:
+        """Колонка метаданных как массив (кешируется до следующего изменения хранилища)"""
+        column = self._metadata_columns.get(key)
+        if column is None:
+            column = np.empty(len(self.metadatas), dtype=object)
+            column[:] = [meta.get(key) for meta in self.metadatas]
+            self._metadata_columns[key] = column
+        return column
+
+    def _filter_mask(self, filter: dict | Callable | None) -> np.ndarray | None:
+        """
+        Булева маска строк по фильтру
+
+        filter может быть:
+        - dict {ключ: значение} или {ключ: [значения]} - равенство / принадлежность списку
+        - callable(Document) -> bool (совместимость с InMemoryVectorStore)
+        """
+        if filter is None:
+            return None
+        if callable(filter):
+            return np.fromiter(
+                (filter(self._document(row)) for row in range(len(self.ids))),
+                dtype=bool, count=len(self.ids)
+            )
+
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, value in filter.items():
+            column = self._metadata_column(key)
+            if isinstance(value, (list, tuple, set)):
+                mask &= np.isin(column, list(value))
+            else:
+                mask &= column == value
+        return mask
+
+    # ---------- Поиск ----------
+
+    def _search(self, query_vector, k: int, filter=None) -> list[tuple[int, float]]:
+        """Top-k строк по cosine similarity: [(row, score), ...] по убыванию score"""
+        if not self.ids or k <= 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        mask = self._filter_mask(filter)
+        if mask is None:
+            candidates = None
+            scores = self.matrix @ query.astype(self.dtype)
+        else:
+            candidates = np.flatnonzero(mask)
+            if candidates.size == 0:
+                return []
+            scores = self.matrix[candidates] @ query.astype(self.dtype)
+        scores = scores.astype(np.float32)
+
+        k = min(k, scores.shape[0])
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        top = top[np.argsort(-scores[top])]
+
+        rows = candidates[top] if candidates is not None else top
+        return [(int(row), float(scores[i])) for row, i in zip(rows, top)]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: list[float], k: int = 4, filter=None, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        return [(self._document(row), score) for row, score in self._search(embedding, k, filter)]
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, filter=None, **kwargs: Any
+    ) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter=None, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        query_vector = self.embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(query_vector, k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter=None, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, filter=None, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        # Embedding запроса - сетевой вызов (await), поиск по матрице - CPU, в потоке
+        query_vector = await self.embedding.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_with_score_by_vector, query_vector, k, filter)
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter=None, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # score уже cosine similarity
+        return lambda score: score
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+
+class HnswVectorStore(MatrixVectorStore):
+    """
+    MatrixVectorStore с приближенным поиском top-k через HNSW граф (hnswlib)
+
+    Матрица embeddings остается в памяти: она нужна для фильтров по метаданным
+    (отфильтрованное подмножество ищется точно) и для перестроения графа.
+
+    Параметры точности/скорости:
+    - m: число связей узла в графе (больше - точнее и больше памяти)
+    - ef_construction: ширина поиска при построении графа (больше - точнее граф, дольше сборка)
+    - ef_search: ширина поиска при запросе (больше - выше recall, выше латентность)
+    """
+
+    GRAPH_FILE = "hnsw.bin"
+    LABELS_FILE = "hnsw_labels.json"
+
+    def __init__(self, embedding: Embeddings, dtype: str = "float32",
+                 m: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        super().__init__(embedding=embedding, dtype=dtype)
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._graph = None
+        self._label_by_id: dict[str, int] = {}
+        self._id_by_label: dict[int, str] = {}
+        self._next_label = 0
+        self._deleted_count = 0
+
+    @staticmethod
+    def _import_hnswlib():
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError(
+                "VECTOR_BACKEND=hnsw requires hnswlib. Install it with: uv sync --extra ann"
+            ) from e
+        return hnswlib
+
+    @classmethod
+    def from_entries(cls, entries: list, vectors, embedding: Embeddings, dtype: str = "float32",
+                     index_dir: str | None = None, **params):
+        """
+        Создание хранилища из готовых векторов
+
+        Если в index_dir есть сохраненный граф - он загружается и синхронизируется
+        с текущими чанками (новые добавляются, удаленные помечаются), иначе граф строится заново.
+        """
+        store = cls(embedding=embedding, dtype=dtype, **params)
+        # Только матрица - граф синхронизируется ниже одним шагом
+        MatrixVectorStore._append(
+            store,
+            [entry["id"] for entry in entries],
+            [entry["text"] for entry in entries],
+            [entry["metadata"] for entry in entries],
+            np.asarray(vectors, dtype=np.float32),
+        )
+
+        loaded = index_dir is not None and store._load_graph(index_dir)
+        changed = store._sync_graph() or not loaded
+        if index_dir is not None and changed:
+            store.save_graph(index_dir)
+        return store
+
+    # ---------- Граф ----------
+
+    def _new_graph(self, capacity: int):
+        hnswlib = self._import_hnswlib()
+        graph = hnswlib.Index(space="ip", dim=self.matrix.shape[1])
+        graph.init_index(max_elements=max(capacity, 1024), ef_construction=self.ef_construction, M=self.m)
+        graph.set_ef(self.ef_search)
+        return graph
+
+    def _reset_graph(self):
+        self._graph = None
+        self._label_by_id = {}
+        self._id_by_label = {}
+        self._next_label = 0
+        self._deleted_count = 0
+
+    def _add_to_graph(self, ids: list):
+        """Добавление векторов с указанными id в граф (с расширением емкости)"""
+        if not ids:
+            return
+        if self._graph is None:
+            self._graph = self._new_graph(len(ids))
+        needed = self._graph.get_current_count() + len(ids)
+        if needed > self._graph.get_max_elements():
+            self._graph.resize_index(max(needed, 2 * self._graph.get_max_elements()))
+
+        rows = [self._row_by_id[doc_id] for doc_id in ids]
+        labels = np.arange(self._next_label, self._next_label + len(ids))
+        self._graph.add_items(self.matrix[rows].astype(np.float32), labels)
+        for label, doc_id in zip(labels.tolist(), ids):
+            self._label_by_id[doc_id] = label
+            self._id_by_label[label] = doc_id
+        self._next_label += len(ids)
+
+    def _sync_graph(self) -> bool:
+        """
+        Синхронизация графа с матрицей: удаленные id помечаются, новые добавляются
+
+        Если помеченных удаленными узлов больше, чем живых - граф перестраивается целиком.
+
+        Returns:
+            bool: True если граф изменился
+        """
+        stale = [doc_id for doc_id in self._label_by_id if doc_id not in self._row_by_id]
+        for doc_id in stale:
+            label = self._label_by_id.pop(doc_id)
+            self._id_by_label.pop(label, None)
+            self._graph.mark_deleted(label)
+        self._deleted_count += len(stale)
+
+        if self._deleted_count > len(self.ids):
+            logger.info(f"HNSW: {self._deleted_count} deleted nodes > {len(self.ids)} live, rebuilding graph")
+            self._reset_graph()
+
+        missing = [doc_id for doc_id in self.ids if doc_id not in self._label_by_id]
+        self._add_to_graph(missing)
+
+        if stale or missing:
+            logger.info(f"HNSW graph synced: +{len(missing)} added, -{len(stale)} deleted")
+        return bool(stale or missing)
+
+    def _append(self, ids: list, texts: list, metadatas: list, vectors: np.ndarray):
+        super()._append(ids, texts, metadatas, vectors)
+        self._add_to_graph(ids)
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        deleted = super().delete(ids)
+        if deleted:
+            self._sync_graph()
+        return deleted
+
+    def save_graph(self, index_dir: str):
+        """Сохранение графа и соответствия label -> id рядом с индексом"""
+        if self._graph is None:
+            return
+        index_path = Path(index_dir)
+        index_path.mkdir(parents=True, exist_ok=True)
+
+        graph_tmp = index_path / (self.GRAPH_FILE + ".tmp")
+        self._graph.save_index(str(graph_tmp))
+        os.replace(graph_tmp, index_path / self.GRAPH_FILE)
+
+        labels_tmp = index_path / (self.LABELS_FILE + ".tmp")
+        with open(labels_tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                "dim": int(self.matrix.shape[1]),
+                "m": self.m,
+                "ef_construction": self.ef_construction,
+                # id чанков - хеши содержимого, от модели не зависят: без этого после смены
+                # модели той же размерности граф старых векторов загрузился бы как актуальный
+                "embedding": index_storage.get_embedding_settings(),
+                "next_label": self._next_label,
+                "deleted_count": self._deleted_count,
+                "ids_by_label": {str(label): doc_id for label, doc_id in self._id_by_label.items()},
+            }, f)
+        os.replace(labels_tmp, index_path / self.LABELS_FILE)
+        logger.info(f"HNSW graph saved to {index_path} ({len(self._id_by_label)} nodes)")
+
+    def _load_graph(self, index_dir: str) -> bool:
+        """Загрузка сохраненного графа (False если графа нет или он построен с другими параметрами или embeddings)"""
+        index_path = Path(index_dir)
+        graph_file = index_path / self.GRAPH_FILE
+        labels_file = index_path / self.LABELS_FILE
+        if not graph_file.exists() or not labels_file.exists() or not self.ids:
+            return False
+
+        try:
+            with open(labels_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta["dim"], meta["m"], meta["ef_construction"]) != (int(self.matrix.shape[1]), self.m, self.ef_construction):
+                logger.info("HNSW graph was built with other parameters, rebuilding")
+                return False
+            if meta.get("embedding") != index_storage.get_embedding_settings():
+                logger.info("HNSW graph was built with another embedding model, rebuilding")
+                return False
+
+            hnswlib = self._import_hnswlib()
+            graph = hnswlib.Index(space="ip", dim=meta["dim"])
+            graph.load_index(str(graph_file))
+            graph.set_ef(self.ef_search)
+        except (OSError, KeyError, ValueError, RuntimeError) as e:
+            logger.warning(f"Failed to load HNSW graph: {e}")
+            return False
+
+        self._graph = graph
+        self._id_by_label = {int(label): doc_id for label, doc_id in meta["ids_by_label"].items()}
+        self._label_by_id = {doc_id: label for label, doc_id in self._id_by_label.items()}
+        self._next_label = meta["next_label"]
+        self._deleted_count = meta.get("deleted_count", 0)
+        logger.info(f"HNSW graph loaded from {index_path} ({len(self._id_by_label)} nodes)")
+        return True
+
+    # ---------- Поиск ----------
+
+    def _search(self, query_vector, k: int, filter=None) -> list[tuple[int, float]]:
+        # С фильтром ищем точно по отфильтрованному подмножеству матрицы
+        if filter is not None or self._graph is None or not self.ids or k <= 0:
+            return super()._search(query_vector, k, filter)
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        try:
+            labels, distances = self._graph.knn_query(query.reshape(1, -1), k=min(k, len(self.ids)))
+        except RuntimeError as e:
+            # hnswlib не смог набрать k результатов (слишком маленький ef/M) - точный поиск
+            logger.warning(f"HNSW query failed, falling back to exact search: {e}")
+            return super()._search(query_vector, k, filter)
+
+        results = []
+        for label, distance in zip(labels[0].tolist(), distances[0].tolist()):
+            row = self._row_by_id.get(self._id_by_label.get(label))
+            if row is not None:
+                # Для space="ip" hnswlib возвращает distance = 1 - dot
+                results.append((row, 1.0 - float(distance)))
+        return results
+
+
+def create_vector_store(entries: list, vectors, embedding: Embeddings, index_dir: str | None = None):
+    """Фабрика векторного хранилища по VECTOR_BACKEND (exact/hnsw)"""
+    backend = config.VECTOR_BACKEND.lower()
+
+    if backend == "exact":
+        return MatrixVectorStore.from_entries(entries, vectors, embedding, dtype=config.VECTOR_DTYPE)
+
+    elif backend == "hnsw":
+        return HnswVectorStore.from_entries(
+            entries, vectors, embedding,
+            dtype=config.VECTOR_DTYPE,
+            index_dir=index_dir,
+            m=config.HNSW_M,
+            ef_construction=config.HNSW_EF_CONSTRUCTION,
+            ef_search=config.HNSW_EF_SEARCH,
+        )
+
+    else:
+        raise ValueError(f"Unknown vector backend: {backend}. Use 'exact' or 'hnsw'")
@@ -0,0 +1,207 @@
+"""
+Тесты загрузки feedback на локальном fake LangSmith endpoint
+
+Fake сервер - http.server в отдельном потоке: принимает POST /feedback,
+хранит принятые feedback по id (повтор с тем же id - 409, как LangSmith)
+и отвечает кодом, который задает тест для каждой попытки.
+"""
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langsmith import Client
+from urllib3.util import Retry
+
+import feedback_uploader
+from config import config
+from feedback_uploader import FeedbackSpool, make_feedback, upload_feedback
+
+
+class FakeLangSmith:
+    """Управляемый fake LangSmith API"""
+
+    def __init__(self):
+        self.stored = {}        # id -> feedback, принятые сервером
+        self.attempts = {}      # id -> число запросов
+        self.responses = {}     # id -> список кодов по попыткам (дальше - 200)
+        self.on_request = None  # вызывается с id перед ответом
+        self._lock = threading.Lock()
+
+    def handle(self, payload: dict) -> int:
+        feedback_id = payload["id"]
+        if self.on_request:
+            self.on_request(feedback_id)
+        with self._lock:
+            attempt = self.attempts.get(feedback_id, 0)
+            self.attempts[feedback_id] = attempt + 1
+            planned = self.responses.get(feedback_id, [])
+            status = planned[attempt] if attempt < len(planned) else 200
+            if status == "lost":
+                # Сервер принял feedback, но ответ до клиента не дошел
+                self.stored[feedback_id] = payload
+                return 503
+            if status != 200:
+                return status
+            if feedback_id in self.stored:
+                return 409
+            self.stored[feedback_id] = payload
+            return 200
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status = fake.handle(json.loads(body))
+                self._reply(status, {"id": "ok"} if status == 200 else {"detail": "error"})
+
+            def do_GET(self):
+                self._reply(200, {})
+
+            def _reply(self, status: int, data: dict):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def fake():
+    langsmith = FakeLangSmith()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), langsmith.handler())
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    langsmith.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield langsmith
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(fake):
+    # Как feedback_uploader.create_client, но на fake endpoint
+    return Client(api_url=fake.url, api_key="test-key", retry_config=Retry(total=0))
+
+
+@pytest.fixture(autouse=True)
+def uploader_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FEEDBACK_SPOOL_PATH", str(tmp_path / "feedback_spool.jsonl"))
+    monkeypatch.setattr(config, "FEEDBACK_UPLOAD_RETRIES", 3)
+    monkeypatch.setattr(config, "FEEDBACK_UPLOAD_WORKERS", 4)
+    monkeypatch.setattr(feedback_uploader, "BACKOFF_SECONDS", 0.01)
+
+
+def spool_ids() -> list[str]:
+    return [item["id"] for item in FeedbackSpool(config.FEEDBACK_SPOOL_PATH).load()]
+
+
+def feedback_items(count: int) -> list[dict]:
+    return [make_feedback(str(uuid.uuid4()), "faithfulness", 0.5 + i / 100, "RAGAS metric") for i in range(count)]
+
+
+async def test_transient_503_is_retried(fake, client):
+    items = feedback_items(3)
+    fake.responses[items[0]["id"]] = [503, 503]
+
+    stats = await upload_feedback(items, client)
+
+    assert stats["uploaded"] == 3
+    assert stats["failed"] == 0
+    assert fake.attempts[items[0]["id"]] == 3
+    assert set(fake.stored) == {item["id"] for item in items}
+    assert spool_ids() == []
+
+
+async def test_conflict_after_lost_response_counts_as_success(fake, client):
+    items = feedback_items(2)
+    fake.responses[items[0]["id"]] = ["lost"]
+
+    stats = await upload_feedback(items, client)
+
+    # Повтор с тем же feedback_id получил 409 - дубль не создан, feedback засчитан
+    assert stats["uploaded"] == 2
+    assert fake.attempts[items[0]["id"]] == 2
+    assert len(fake.stored) == 2
+    assert spool_ids() == []
+
+
+@pytest.mark.parametrize("status", [400, 404, 422])
+async def test_permanent_client_error_is_not_retried(fake, client, status):
+    items = feedback_items(2)
+    fake.responses[items[0]["id"]] = [status] * 5
+
+    stats = await upload_feedback(items, client)
+
+    assert stats["uploaded"] == 1
+    assert stats["failed"] == 1
+    assert fake.attempts[items[0]["id"]] == 1
+
+
+async def test_rate_limit_is_retried(fake, client):
+    items = feedback_items(1)
+    fake.responses[items[0]["id"]] = [429]
+
+    stats = await upload_feedback(items, client)
+
+    assert stats["uploaded"] == 1
+    assert fake.attempts[items[0]["id"]] == 2
+
+
+async def test_spool_written_before_upload_and_keeps_only_failures(fake, client):
+    items = feedback_items(4)
+    failing = items[1]["id"]
+    fake.responses[failing] = [503] * 10
+    spooled_during_upload = []
+    fake.on_request = lambda _: spooled_during_upload.append(set(spool_ids()))
+
+    stats = await upload_feedback(items, client)
+
+    # Во время загрузки в spool уже лежат все feedback
+    assert spooled_during_upload
+    assert all(ids == {item["id"] for item in items} for ids in spooled_during_upload)
+    # После - только незагруженный
+    assert stats["failed"] == 1
+    assert spool_ids() == [failing]
+    assert fake.attempts[failing] == config.FEEDBACK_UPLOAD_RETRIES + 1
+
+
+async def test_nan_scores_are_skipped(fake, client):
+    items = feedback_items(2)
+    items[0]["score"] = float("nan")
+
+    stats = await upload_feedback(items, client)
+
+    assert stats["skipped"] == 1
+    assert stats["uploaded"] == 1
+    assert items[0]["id"] not in fake.attempts
+
+
+async def test_resume_from_spool(fake, client):
+    items = feedback_items(3)
+    failing = items[2]["id"]
+    fake.responses[failing] = [503] * (config.FEEDBACK_UPLOAD_RETRIES + 1)
+
+    first = await upload_feedback(items, client)
+    assert first["failed"] == 1
+    assert spool_ids() == [failing]
+
+    # API снова доступен: догрузка без новых feedback
+    second = await upload_feedback([], client)
+
+    assert second["resumed"] == 1
+    assert second["uploaded"] == 1
+    assert second["failed"] == 0
+    assert failing in fake.stored
+    assert len(fake.stored) == 3
+    assert spool_ids() == []